@@ -3,9 +3,62 @@ NER annotator package initialization
 '''
 
 
+import importlib
+
 from .config import *
-from .annotator import NERAnnotator
+from .store import AnnotationStore
+from .source import (
+    LineSource,
+    CompressedLineSource,
+    JSONLSource,
+    ShardedSource,
+    open_source
+)
+from .journal import Journal, replay_journal
+from .reader import (
+    iter_output,
+    iter_output_range,
+    load_output,
+    load_annotations,
+    match_by_content
+)
+from .cache import PredictionCache
+from .index import TokenIndex
+from .search import search_lines
+from .dedup import LineClusters, realign_entities
+from .profiling import Profiler
+from .export import ChunkedExporter
+from .gazetteer import AhoCorasick, Gazetteer
+from .boundaries import (
+    TokenBoundaries,
+    regex_token_offsets,
+    snap_span
+)
 from .model import load_model
+from .preannotate import preannotate
+from .stats import OutputStats, output_stats, format_stats, dump_stats
+from .ranking import RankedQueue, init_scorer, score_lines
 
 
 __version__ = '0.1.1'
+
+# Qt-based and networking objects are imported only when first accessed,
+# so that the command line interface starts quickly
+LAZY_OBJECTS = {
+    'ModelLoader': '.worker',
+    'ClassificationWorker': '.worker',
+    'RankingWorker': '.worker',
+    'SpanTableModel': '.table',
+    'AnnotationDatabase': '.server',
+    'AnnotationServer': '.server',
+    'ServerConnection': '.client',
+    'ServerClient': '.client',
+    'NERAnnotator': '.annotator'
+}
+
+
+def __getattr__(name):
+    if name in LAZY_OBJECTS:
+        module = importlib.import_module(LAZY_OBJECTS[name], __name__)
+        return getattr(module, name)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -5,11 +5,10 @@ NER annotator entry point
 
 import sys
 import os
+import glob
 import argparse
 import json
 
-from PyQt5.QtWidgets import QApplication
-
 import ner_annotator
 
 
@@ -52,13 +51,19 @@ def parse_args():
         prog='ner-annotator', description='NER annotator'
     )
     parser.add_argument(
-        dest='input', action='store',
-        type=str, help='path to the training text file'
+        dest='input', action='store', type=str,
+        help='path to the training text file, to a directory or to a glob '
+        'pattern of files (.txt or .jsonl, optionally compressed)'
     )
     parser.add_argument(
         '-e', '--entities', dest='entities', action='store', nargs='+',
         type=str, help='list of entities to be classified'
     )
+    parser.add_argument(
+        '-f', '--field', dest='field', action='store', type=str,
+        help='field of JSON lines input files which contains the text '
+        f'(defaults to "{ner_annotator.JSONL_TEXT_FIELD}")'
+    )
     parser.add_argument(
         '-m', '--model', dest='model', action='store',
         type=str, help='path to an existing NER model'
@@ -79,61 +84,401 @@ def parse_args():
         '-p', '--pickle', dest='pickle', action='store_true',
         help='whether or not to save a model-specific pickle file'
     )
+    parser.add_argument(
+        '-x', '--export', dest='export', action='store_true',
+        help='whether or not to export model-specific binary training data '
+        '(e.g. SpaCy DocBin files), in background'
+    )
+    parser.add_argument(
+        '--prefetch', dest='prefetch', action='store',
+        type=int, default=ner_annotator.PREFETCH_LINES,
+        help='number of upcoming lines to classify in background'
+    )
+    parser.add_argument(
+        '--no-cache', dest='cache', action='store_false',
+        help='do not cache model predictions on disk'
+    )
+    parser.add_argument(
+        '-r', '--resume', dest='resume', action='store',
+        type=str, help='path to an output file or journal to resume from '
+        '(defaults to the output file, if it exists)'
+    )
+    parser.add_argument(
+        '--profile', dest='profile', action='store',
+        type=str, default=os.environ.get(ner_annotator.PROFILE_ENV_VAR),
+        help='path to a JSON or CSV file where latencies of GUI actions '
+        f'are saved on exit (defaults to ${ner_annotator.PROFILE_ENV_VAR})'
+    )
+    parser.add_argument(
+        '-u', '--first-unannotated', dest='first_unannotated',
+        action='store_true', help='start from the first unannotated line'
+    )
+    parser.add_argument(
+        '--no-snap', dest='snap', action='store_false',
+        help='do not snap selected entities to token boundaries'
+    )
+    parser.add_argument(
+        '--autosave', dest='autosave', action='store',
+        type=float, default=ner_annotator.AUTOSAVE_INTERVAL,
+        help='seconds without edits after which annotations are saved '
+        f'in background, or after {ner_annotator.AUTOSAVE_EDITS} edits '
+        '(0 disables autosave)'
+    )
+    parser.add_argument(
+        '--propagate', dest='propagate', action='store',
+        choices=ner_annotator.VALID_PROPAGATION_MODES,
+        help='annotate each new entity on every other line where it appears, '
+        'either directly or as suggestions'
+    )
+    parser.add_argument(
+        '--order', dest='order', action='store', default='file',
+        choices=ner_annotator.VALID_ORDERS,
+        help='order of the lines to annotate (ordering by model uncertainty '
+        'requires a model)'
+    )
+    parser.add_argument(
+        '--dedup', dest='dedup', action='store',
+        choices=ner_annotator.VALID_DEDUP_MODES,
+        help='only show one line for each group of exact duplicates '
+        '(or near-duplicates), and copy its annotations to the others on save'
+    )
+    parser.add_argument(
+        '--server', dest='server', action='store',
+        type=str, help='URL of a multi-annotator server (e.g. '
+        f'http://{ner_annotator.SERVER_HOST}:{ner_annotator.SERVER_PORT}), '
+        'which hands out the lines to annotate and stores annotations'
+    )
+    parser.add_argument(
+        '--annotator', dest='annotator', action='store',
+        type=str, help='name of the annotator on the server '
+        '(defaults to the user name)'
+    )
+    parser.add_argument(
+        '--corpus', dest='corpus', action='store',
+        type=str, help='name of the corpus on the server '
+        '(defaults to the name of the input file)'
+    )
     return parser
 
 
-def main():
-    parser = parse_args()
-    args = parser.parse_args()
-
-    if is_file_valid(args.input, ner_annotator.VALID_IN_FMT):
-        input_file = open(args.input, 'r').read().splitlines()
-        if args.output is None:
-            args.output = (
-                os.path.abspath(os.path.join(
-                    os.path.dirname(args.input), 'output.json'
-                ))
-            )
-        elif not is_file_valid(args.output, ner_annotator.VALID_OUT_FMT, output=True):
+def parse_preannotate_args():
+    '''
+    CLI argument parser for the pre-annotation command
+    '''
+    parser = argparse.ArgumentParser(
+        prog='ner-annotator preannotate',
+        description='Pre-annotate a text file with an existing NER model'
+    )
+    parser.add_argument(
+        dest='input', action='store', type=str,
+        help='path to the training text file, to a directory or to a glob '
+        'pattern of files (.txt or .jsonl, optionally compressed)'
+    )
+    parser.add_argument(
+        '-f', '--field', dest='field', action='store', type=str,
+        help='field of JSON lines input files which contains the text '
+        f'(defaults to "{ner_annotator.JSONL_TEXT_FIELD}")'
+    )
+    parser.add_argument(
+        '-m', '--model', dest='model', action='store', required=True,
+        type=str, help='path to an existing NER model'
+    )
+    parser.add_argument(
+        '-e', '--entities', dest='entities', action='store', nargs='+',
+        type=str, help='list of entities to keep (defaults to all of them)'
+    )
+    parser.add_argument(
+        '-o', '--output', dest='output', action='store',
+        type=str, help='path to the output file'
+    )
+    parser.add_argument(
+        '--force', dest='force', action='store_true',
+        help='overwrite an existing output file and discard its journal'
+    )
+    parser.add_argument(
+        '-c', '--config', dest='config', action='store',
+        type=str, help='path to the config file'
+    )
+    parser.add_argument(
+        '-n', '--config-model', dest='config_model', action='store',
+        type=str, help='name of the model to load from the config file'
+    )
+    parser.add_argument(
+        '-b', '--batch-size', dest='batch_size', action='store',
+        type=int, default=ner_annotator.PREANNOTATE_BATCH_SIZE,
+        help='number of lines to classify at once'
+    )
+    parser.add_argument(
+        '-j', '--processes', dest='processes', action='store',
+        type=int, default=os.cpu_count() or 1,
+        help='number of worker processes (defaults to all cores)'
+    )
+    return parser
+
+
+def parse_serve_args():
+    '''
+    CLI argument parser for the multi-annotator server command
+    '''
+    parser = argparse.ArgumentParser(
+        prog='ner-annotator serve',
+        description='Serve lines and store annotations for several annotators'
+    )
+    parser.add_argument(
+        '-d', '--db', dest='db', action='store',
+        type=str, default=ner_annotator.SERVER_DB_PATH,
+        help='path to the SQLite database of annotations'
+    )
+    parser.add_argument(
+        '--host', dest='host', action='store',
+        type=str, default=ner_annotator.SERVER_HOST,
+        help='address to listen on'
+    )
+    parser.add_argument(
+        '--port', dest='port', action='store',
+        type=int, default=ner_annotator.SERVER_PORT,
+        help='port to listen on'
+    )
+    parser.add_argument(
+        '--lease-time', dest='lease_time', action='store',
+        type=float, default=ner_annotator.LEASE_TIME,
+        help='seconds after which unannotated leased lines are handed out again'
+    )
+    return parser
+
+
+def parse_stats_args():
+    '''
+    CLI argument parser for the statistics command
+    '''
+    parser = argparse.ArgumentParser(
+        prog='ner-annotator stats',
+        description='Report statistics and invalid spans of annotation outputs'
+    )
+    parser.add_argument(
+        dest='outputs', action='store', nargs='+',
+        type=str, help='paths to the JSON output files'
+    )
+    parser.add_argument(
+        '-i', '--input', dest='input', action='store', type=str,
+        help='path to the annotated input, so as to also check that '
+        'the content of each annotation matches its input line'
+    )
+    parser.add_argument(
+        '-f', '--field', dest='field', action='store', type=str,
+        help='field of JSON lines input files which contains the text '
+        f'(defaults to "{ner_annotator.JSONL_TEXT_FIELD}")'
+    )
+    parser.add_argument(
+        '-o', '--output', dest='output', action='store', type=str,
+        help='path to a JSON or CSV file where the report is saved '
+        '(defaults to printing it)'
+    )
+    parser.add_argument(
+        '-j', '--processes', dest='processes', action='store',
+        type=int, default=os.cpu_count() or 1,
+        help='number of worker processes (defaults to all cores)'
+    )
+    return parser
+
+
+def output_path(args):
+    '''
+    Return the validated output path, given the CLI arguments
+    '''
+    if args.output is None:
+        directory = (
+            args.input if os.path.isdir(args.input)
+            else os.path.dirname(args.input)
+        )
+        while glob.has_magic(directory):
+            directory = os.path.dirname(directory)
+        return os.path.abspath(os.path.join(directory, 'output.json'))
+    elif not is_file_valid(args.output, ner_annotator.VALID_OUT_FMT, output=True):
+        raise Exception(
+            f'The output file has an invalid extension: choose between {ner_annotator.VALID_OUT_FMT}'
+        )
+    return args.output
+
+
+def config_entities(args):
+    '''
+    Return the entities given in the CLI arguments, either
+    directly or through a config file
+    '''
+    entities = args.entities
+    if args.config is not None:
+        if not os.path.exists(args.config):
             raise Exception(
-                f'The output file has an invalid extension: choose between {ner_annotator.VALID_OUT_FMT}'
+                'The given config file does not exist'
             )
-        if args.model is not None and not os.path.exists(args.model):
+        if args.config_model is None:
             raise Exception(
-                'The given NER model does not exist'
+                'You have to enter the name of the config model to use'
             )
-        entities = args.entities
-        if args.config is not None:
-            if not os.path.exists(args.config):
-                raise Exception(
-                    'The given config file does not exist'
-                )
-            if args.config_model is None:
-                raise Exception(
-                    'You have to enter the name of the config model to use'
-                )
-            with open(args.config, 'r') as f:
-                data = f.read()
-            config_json = json.loads(data)
-            entities = find_config_entities(config_json, args.config_model)
-            if entities is None:
-                raise Exception(
-                    'The config model name you entered is not valid'
-                )
+        with open(args.config, 'r') as f:
+            data = f.read()
+        config_json = json.loads(data)
+        entities = find_config_entities(config_json, args.config_model)
         if entities is None:
             raise Exception(
-                'You have to insert entities manually or use a config file'
+                'The config model name you entered is not valid'
             )
+    return entities
+
 
-        QApplication.setStyle("fusion")
-        app = QApplication(sys.argv)
-        app.setStyleSheet(ner_annotator.STYLE)
+def annotate(args):
+    '''
+    Open the annotator window
+    '''
+    input_file = ner_annotator.open_source(args.input, field=args.field)
+    args.output = output_path(args)
+    if args.model is not None and not os.path.exists(args.model):
+        raise Exception(
+            'The given NER model does not exist'
+        )
+    entities = config_entities(args)
+    if entities is None:
+        raise Exception(
+            'You have to insert entities manually or use a config file'
+        )
+    if args.resume is not None and not os.path.isfile(args.resume):
+        raise Exception(
+            'The given file to resume from does not exist'
+        )
+    if args.order == 'uncertainty' and args.model is None:
+        raise Exception(
+            'Ordering lines by model uncertainty requires a model'
+        )
+
+    from PyQt5.QtWidgets import QApplication, QMessageBox
+
+    QApplication.setStyle("fusion")
+    app = QApplication(sys.argv)
+    app.setStyleSheet(ner_annotator.load_style())
+    try:
         window = ner_annotator.NERAnnotator(
             input_file, args.output, entities,
-            model_path=args.model, save_pickle=args.pickle
+            model_path=args.model, save_pickle=args.pickle,
+            prefetch=args.prefetch, cache_predictions=args.cache,
+            resume=args.resume, first_unannotated=args.first_unannotated,
+            profile=args.profile, export=args.export,
+            propagate=args.propagate, order=args.order, dedup=args.dedup,
+            server=args.server, annotator=args.annotator, corpus=args.corpus,
+            autosave=args.autosave, snap=args.snap
+        )
+    except Exception as err:
+        from ner_annotator.annotator import show_dialog
+
+        show_dialog(
+            dialog_type=QMessageBox.Critical,
+            title='Error',
+            text='The annotator could not be started',
+            informative=str(err)
+        )
+        sys.exit(1)
+    window.show()
+    sys.exit(app.exec_())
+
+
+def preannotate(args):
+    '''
+    Classify the whole input file with the given model
+    and save the results, without opening the annotator window
+    '''
+    input_file = ner_annotator.open_source(args.input, field=args.field)
+    args.output = output_path(args)
+    journal = args.output + ner_annotator.JOURNAL_EXT
+    existing = [path for path in (args.output, journal) if os.path.exists(path)]
+    if existing and not args.force:
+        raise Exception(
+            f'Found {" and ".join(existing)}, which could contain '
+            'manual annotations: choose another output file '
+            'or pass --force to overwrite it'
+        )
+    if not os.path.exists(args.model):
+        raise Exception(
+            'The given NER model does not exist'
+        )
+    entities = config_entities(args)
+    model = ner_annotator.load_model(args.model)
+
+    def report(lines, elapsed):
+        print(
+            f'{lines}/{len(input_file)} lines '
+            f'({lines / elapsed:.1f} lines/s)', file=sys.stderr
+        )
+
+    lines, elapsed = ner_annotator.preannotate(
+        model, input_file, args.output, entities=entities,
+        batch_size=args.batch_size, n_process=args.processes,
+        report=report
+    )
+    if os.path.exists(journal):
+        os.remove(journal)
+        print(
+            f'Removed the journal {journal}, which would have been '
+            'replayed over the pre-annotations', file=sys.stderr
         )
-        window.show()
-        sys.exit(app.exec_())
+    print(
+        f'Pre-annotated {lines} lines in {elapsed:.2f}s '
+        f'({lines / max(elapsed, 1e-9):.1f} lines/s), '
+        f'saved to {args.output}'
+    )
+
+
+def stats(args):
+    '''
+    Compute statistics of the given output files
+    and print or save the report
+    '''
+    for path in args.outputs:
+        if not os.path.isfile(path):
+            raise Exception(f'The output file {path} does not exist')
+    summary = ner_annotator.output_stats(
+        args.outputs, input_path=args.input, field=args.field,
+        processes=args.processes
+    )
+    if args.output is not None:
+        ner_annotator.dump_stats(summary, args.output)
+    else:
+        print(ner_annotator.format_stats(summary))
+
+
+def serve(args):
+    '''
+    Run the multi-annotator server until interrupted
+    '''
+    import asyncio
+
+    server = ner_annotator.AnnotationServer(args.db, args.lease_time)
+    try:
+        asyncio.run(server.serve(
+            args.host, args.port,
+            started=lambda _: print(
+                f'Serving {args.db} on http://{args.host}:{args.port}'
+            )
+        ))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+
+COMMANDS = {
+    'preannotate': (parse_preannotate_args, preannotate),
+    'serve': (parse_serve_args, serve),
+    'stats': (parse_stats_args, stats)
+}
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] in COMMANDS:
+        parse, run = COMMANDS[sys.argv[1]]
+        run(parse().parse_args(sys.argv[2:]))
+    else:
+        parser = parse_args()
+        annotate(parser.parse_args())
 
 
 if __name__ == "__main__":
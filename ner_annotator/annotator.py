@@ -3,11 +3,12 @@ Define the main window
 '''
 
 
-import json
-import copy
+import re
 import math
-import random
+import time
+import getpass
 import pickle
+import sqlite3
 import os
 from functools import partial
 
@@ -18,17 +19,25 @@ from PyQt5.QtWidgets import (
     QHBoxLayout,
     QGridLayout,
     QPlainTextEdit,
+    QTextEdit,
     QLabel,
     QPushButton,
     QMessageBox,
     QSizePolicy,
-    QTableWidget,
-    QTableWidgetItem,
+    QTableView,
     QHeaderView,
-    QAbstractItemView
+    QAbstractItemView,
+    QDockWidget,
+    QLineEdit,
+    QCheckBox,
+    QComboBox,
+    QListWidget,
+    QListWidgetItem,
+    QSpinBox,
+    QShortcut
 )
-from PyQt5.QtCore import Qt, QEvent, QSize
-from PyQt5.QtGui import QIcon, QTextCursor, QTextCharFormat, QColor
+from PyQt5.QtCore import Qt, QEvent, QSize, QTimer, pyqtSignal
+from PyQt5.QtGui import QIcon, QTextCursor, QKeySequence
 
 import ner_annotator
 
@@ -52,11 +61,13 @@ class AutoGridLayout(QGridLayout):
         (see https://stackoverflow.com/questions/19538517/find-matrix-dimension-so-as-to-contain-numbers)
         '''
         mm = list(range(2, math.ceil(math.sqrt(self.num_elements)) + 1))[::-1]
+        if not mm:
+            return 1, self.num_elements
         nn = list(map(lambda x: math.ceil(self.num_elements / x), mm))
         excess = list(
             map(lambda xy: xy[0] * xy[1] - self.num_elements, zip(mm, nn))
         )
-        ind = min(excess)
+        ind = excess.index(min(excess))
         return mm[ind], nn[ind]
 
     def addNextWidget(self, widget):
@@ -87,25 +98,163 @@ class NERAnnotator(QMainWindow):
     Main window
     '''
 
-    def __init__(self, input_file, output_file, entities, model_path=None, save_pickle=False):
+    # Emitted (from the journal thread) when a save is completed,
+    # with the raised exception or with None on success
+    saved = pyqtSignal(object)
+
+    # Emitted (from the exporter thread) when an export is completed,
+    # with the raised exception or with None on success
+    exported = pyqtSignal(object)
+
+    # Emitted (from the clustering thread) when duplicate lines are
+    # clustered, with the raised exception or with None on success
+    clustered = pyqtSignal(object)
+
+    # Emitted (from the client thread) when lines are leased
+    # from the server, or when leasing them failed
+    leased = pyqtSignal()
+
+    # Emitted (from the indexing thread) when every input line is indexed
+    indexed = pyqtSignal()
+
+    def __init__(self, input_file, output_file, entities, model_path=None, save_pickle=False,
+                 prefetch=ner_annotator.PREFETCH_LINES, cache_predictions=True,
+                 resume=None, first_unannotated=False, profile=None, export=False,
+                 propagate=None, order='file', dedup=None,
+                 server=None, annotator=None, corpus=None,
+                 autosave=ner_annotator.AUTOSAVE_INTERVAL, snap=True):
         # Window settings
         QMainWindow.__init__(self)
         self.resize(1200, 800)
         self.setWindowTitle(ner_annotator.WINDOW_TITLE)
         self.setFocusPolicy(Qt.StrongFocus)
 
+        # Instrumentation
+        self.profiler = None
+        if profile is not None:
+            self.profiler = ner_annotator.Profiler(profile, metadata={
+                'version': ner_annotator.__version__,
+                'lines': len(input_file),
+                'model': None
+            })
+            for action in ner_annotator.PROFILED_ACTIONS:
+                setattr(
+                    self, action,
+                    self.profiler.wrap(action, getattr(self, action))
+                )
+
         # Instance variables
         self.input_file = input_file
         self.output_file = output_file
         self.entities = entities
-        self.model = (
-            ner_annotator.load_model(model_path) if model_path is not None
-            else None
-        )
+        self.model_path = model_path
+        self.model = None
         self.save_pickle = save_pickle
-        self.annotations = []
+        self.export = export
+        self.exporter = None
+        self.unexported_lines = set()
+        self.exported.connect(self.on_exported)
+        self.annotations = ner_annotator.AnnotationStore()
         self.current_line = 0
-        self.latest_save = []
+        self.saving_lines = set()
+        self.saving_manually = False
+        self.save_error = None
+        self.cluster_copies = {}
+        self.save_requested = False
+        self.unsaved_edits = 0
+        self.autosave_interval = autosave
+        self.autosave_timer = QTimer(self)
+        self.autosave_timer.setSingleShot(True)
+        self.autosave_timer.timeout.connect(self.autosave)
+        if resume is None and os.path.isfile(self.output_file):
+            resume = self.output_file
+        unmatched = 0
+        if resume is not None:
+            try:
+                unmatched = ner_annotator.load_annotations(
+                    resume, self.annotations, self.input_file
+                )
+            except Exception as err:
+                raise Exception(
+                    f'The annotations in {resume} could not be read ({err}). '
+                    'Please fix or move the file and start again'
+                )
+            if resume == self.output_file:
+                self.annotations.mark_saved()
+        self.journal = ner_annotator.Journal(
+            self.output_file + ner_annotator.JOURNAL_EXT,
+            ner_annotator.JOURNAL_SYNC_EVERY,
+            ner_annotator.JOURNAL_SYNC_INTERVAL
+        )
+        latest_line, journal_unmatched = self.journal.replay(
+            self.annotations, self.input_file
+        )
+        unmatched += journal_unmatched
+        if latest_line is not None:
+            self.current_line = min(latest_line, len(self.input_file) - 1)
+        if first_unannotated:
+            self.current_line = min(
+                self.annotations.first_unannotated(), len(self.input_file) - 1
+            )
+        self.clusters = None
+        self.unclustered_lines = set()
+        if dedup is not None:
+            self.clusters = ner_annotator.LineClusters(
+                self.input_file, near=dedup == 'near'
+            )
+            self.clustered.connect(self.on_clustered)
+            self.clusters.start(callback=self.clustered.emit)
+            self.current_line = self.clusters.representative(self.current_line)
+        self.client = None
+        self.awaiting_lease = False
+        self.leased_line = None
+        if server is not None:
+            self.leased.connect(self.on_leased)
+            self.client = ner_annotator.ServerClient(
+                server,
+                corpus or self.corpus_name(),
+                len(self.input_file), annotator or getpass.getuser(),
+                ner_annotator.CLIENT_BATCH_SIZE,
+                ner_annotator.CLIENT_FLUSH_INTERVAL,
+                ner_annotator.CLIENT_PREFETCH_LINES,
+                callback=self.leased.emit
+            )
+            self.leased_line = self.client.next_line()
+            self.awaiting_lease = self.leased_line is None
+            if self.leased_line is not None:
+                self.current_line = self.leased_line
+        self.saved.connect(self.on_saved)
+        self.propagation = propagate
+        self.suggestions = {}
+        self.pending_propagations = []
+        self.index = ner_annotator.TokenIndex(
+            self.input_file, path=getattr(self.input_file, 'path', None),
+            callback=self.indexed.emit
+        )
+        self.indexed.connect(self.on_indexed)
+        if self.propagation is not None:
+            self.index.start()
+        self.order = order
+        self.ranking = None
+        self.ranking_worker = None
+        self.history = []
+        self.prefetch = prefetch
+        self.boundaries = None
+        if snap:
+            self.boundaries = ner_annotator.TokenBoundaries(
+                self.input_file, prefetch, ner_annotator.PREFETCH_CACHE_SIZE
+            )
+        self.cache_predictions = cache_predictions
+        self.classifier = None
+        self.pending_classification = None
+        self.prediction_cache = None
+        self.model_loader = None
+        if self.model_path is not None:
+            self.model_loader = ner_annotator.ModelLoader(
+                self.model_path, self
+            )
+            self.model_loader.loaded.connect(self.on_model_loaded)
+            self.model_loader.failed.connect(self.on_model_failed)
 
         # Main layout
         self.central_widget = QWidget(self)
@@ -180,15 +329,21 @@ class NERAnnotator(QMainWindow):
             ner_annotator.SELECTION_START_LABEL: 2,
             ner_annotator.SELECTION_END_LABEL: 3
         }
-        self.output_table = QTableWidget(
-            0, len(self.output_table_labels), self.output_widget
+        self.output_model = ner_annotator.SpanTableModel(
+            list(self.output_table_labels.keys()), self
         )
+        for signal in (
+            self.output_model.modelReset,
+            self.output_model.rowsInserted,
+            self.output_model.rowsRemoved,
+            self.output_model.dataChanged
+        ):
+            signal.connect(lambda *args: self.highlight())
+        self.output_table = QTableView(self.output_widget)
+        self.output_table.setModel(self.output_model)
         self.output_table.setSizePolicy(
             QSizePolicy.Expanding, QSizePolicy.Expanding
         )
-        self.output_table.setHorizontalHeaderLabels(
-            self.output_table_labels.keys()
-        )
         self.output_table.setSelectionBehavior(QAbstractItemView.SelectRows)
         self.output_table.horizontalHeader().setSectionResizeMode(
             self.output_table_labels[ner_annotator.ENTITY_LABEL], QHeaderView.Stretch
@@ -207,33 +362,34 @@ class NERAnnotator(QMainWindow):
 
         # Commands sections
         self.prev_button = self.set_button(
-            icon_path=ner_annotator.PREV_ICON_PATH,
+            icon_path=ner_annotator.icon_path(ner_annotator.PREV_ICON),
             function=self.prev,
             parent=self.commands_widget
         )
-        if self.model is not None:
+        if self.model_path is not None:
             self.classify_button = self.set_button(
-                icon_path=ner_annotator.CLASSIFY_ICON_PATH,
+                icon_path=ner_annotator.icon_path(ner_annotator.CLASSIFY_ICON),
                 function=self.classify,
                 parent=self.commands_widget
             )
+            self.classify_button.setEnabled(False)
         self.next_button = self.set_button(
-            icon_path=ner_annotator.NEXT_ICON_PATH,
+            icon_path=ner_annotator.icon_path(ner_annotator.NEXT_ICON),
             function=self.next,
             parent=self.commands_widget
         )
         self.skip_button = self.set_button(
-            icon_path=ner_annotator.SKIP_ICON_PATH,
+            icon_path=ner_annotator.icon_path(ner_annotator.SKIP_ICON),
             function=self.skip,
             parent=self.commands_widget
         )
         self.save_button = self.set_button(
-            icon_path=ner_annotator.SAVE_ICON_PATH,
+            icon_path=ner_annotator.icon_path(ner_annotator.SAVE_ICON),
             function=self.stop,
             parent=self.commands_widget
         )
         self.commands_layout.addWidget(self.prev_button)
-        if self.model is not None:
+        if self.model_path is not None:
             self.commands_layout.addWidget(self.classify_button)
         self.commands_layout.addWidget(self.next_button)
         self.commands_layout.addWidget(self.skip_button)
@@ -246,6 +402,162 @@ class NERAnnotator(QMainWindow):
         self.main_layout.addWidget(self.output_widget)
         self.main_layout.addWidget(self.commands_widget)
 
+        # Search panel
+        self.search_dock = QDockWidget('Search', self)
+        self.search_dock.setObjectName('search')
+        self.search_widget = QWidget(self.search_dock)
+        self.search_layout = QVBoxLayout(self.search_widget)
+        self.search_text = QLineEdit(self.search_widget)
+        self.search_text.setPlaceholderText('Search lines')
+        self.search_text.returnPressed.connect(self.search)
+        self.search_regex = QCheckBox('Regular expression', self.search_widget)
+        self.search_label = QComboBox(self.search_widget)
+        self.search_label.addItem('Any label', None)
+        for entity in self.entities:
+            self.search_label.addItem(entity, entity)
+        self.search_results = QListWidget(self.search_widget)
+        self.search_results.itemActivated.connect(
+            lambda item: self.jump_to_line(item.data(Qt.UserRole))
+        )
+        self.search_status = QLabel(self.search_widget)
+        self.goto_widget = QWidget(self.search_widget)
+        self.goto_layout = QHBoxLayout(self.goto_widget)
+        self.goto_layout.setContentsMargins(0, 0, 0, 0)
+        self.goto_line = QSpinBox(self.goto_widget)
+        self.goto_line.setRange(1, len(self.input_file))
+        self.goto_button = QPushButton('Go to line', self.goto_widget)
+        self.goto_button.clicked.connect(
+            lambda: self.jump_to_line(self.goto_line.value() - 1)
+        )
+        self.goto_layout.addWidget(self.goto_line)
+        self.goto_layout.addWidget(self.goto_button)
+        self.search_layout.addWidget(self.search_text)
+        self.search_layout.addWidget(self.search_regex)
+        self.search_layout.addWidget(self.search_label)
+        self.search_layout.addWidget(self.search_results)
+        self.search_layout.addWidget(self.search_status)
+        self.search_layout.addWidget(self.goto_widget)
+        self.search_dock.setWidget(self.search_widget)
+        self.addDockWidget(Qt.RightDockWidgetArea, self.search_dock)
+        QShortcut(QKeySequence.Find, self, self.focus_search)
+        QShortcut(QKeySequence('Ctrl+G'), self, self.focus_goto)
+        QShortcut(QKeySequence('Ctrl+R'), self, self.reload_model)
+
+        self.show_line(self.current_line)
+        if self.model_loader is not None:
+            self.model_loader.start()
+        if unmatched > 0:
+            show_dialog(
+                dialog_type=QMessageBox.Warning,
+                title='Warning',
+                text=f'{unmatched} previous annotations do not match any input line',
+                informative='They will be lost at the next save'
+            )
+
+    def reload_model(self):
+        '''
+        Load the model again, to pick up changes to its files
+        '''
+        if self.model_loader is None or self.model_loader.thread.is_alive():
+            return
+        self.statusBar().showMessage('Reloading the NER model')
+        self.model_loader.start()
+
+    def on_model_loaded(self, model):
+        '''
+        Start classifying lines in background, once the given model
+        is loaded, replacing the workers of the previous model (if any)
+        '''
+        if self.classifier is not None:
+            self.classifier.stop()
+        if self.ranking_worker is not None:
+            self.ranking_worker.stop()
+        if self.prediction_cache is not None:
+            try:
+                self.prediction_cache.close()
+            except sqlite3.Error:
+                pass
+            self.prediction_cache = None
+        self.model = model
+        if self.profiler is not None:
+            self.profiler.metadata['model'] = type(model).__name__
+        if self.boundaries is not None and self.model.has_tokenizer():
+            self.boundaries.set_tokenizer(self.model.token_offsets)
+            self.boundaries.prefetch(self.current_line)
+        if self.cache_predictions:
+            try:
+                self.prediction_cache = ner_annotator.PredictionCache(
+                    ner_annotator.PREDICTION_CACHE_PATH,
+                    self.model.fingerprint(),
+                    ner_annotator.PREDICTION_CACHE_SIZE
+                )
+            except (sqlite3.Error, OSError) as err:
+                self.on_cache_failed(err)
+        self.classifier = ner_annotator.ClassificationWorker(
+            self.model, self.input_file, self.prefetch,
+            ner_annotator.PREFETCH_CACHE_SIZE,
+            prediction_cache=self.prediction_cache,
+            profiler=self.profiler, parent=self
+        )
+        self.classifier.classified.connect(self.on_classified)
+        self.classifier.failed.connect(self.on_classification_failed)
+        self.classifier.cache_failed.connect(self.on_cache_failed)
+        self.classifier.prefetch(
+            self.current_line if self.pending_classification is None
+            else self.pending_classification
+        )
+        self.classify_button.setEnabled(True)
+        if self.order == 'uncertainty':
+            if self.ranking is None:
+                self.ranking = ner_annotator.RankedQueue(len(self.input_file))
+            else:
+                self.ranking.reset()
+            self.ranking_worker = ner_annotator.RankingWorker(
+                self.model_path, self.input_file, self.current_line,
+                ner_annotator.RANKING_CHUNK_SIZE, os.cpu_count(),
+                self.ranking.generation, self
+            )
+            self.ranking_worker.scored.connect(self.on_scored)
+            self.ranking_worker.failed.connect(self.on_ranking_failed)
+            self.ranking_worker.start()
+
+    def on_scored(self, generation, first, scores):
+        '''
+        Add the uncertainty scores computed in background to the
+        queue of lines to annotate, unless they come from a previous model
+        '''
+        if self.ranking is None:
+            return
+        self.ranking.update(first, scores, generation)
+        self.statusBar().showMessage(
+            f'Ranked {self.ranking.scored}/{len(self.input_file)} lines '
+            'by model uncertainty'
+        )
+
+    def on_ranking_failed(self, error):
+        '''
+        Notify the user that lines could not be ranked,
+        and fall back to the file order
+        '''
+        self.ranking = None
+        show_dialog(
+            dialog_type=QMessageBox.Critical,
+            title='Error',
+            text='An error occurred while ranking lines by model uncertainty',
+            informative=str(error)
+        )
+
+    def on_model_failed(self, error):
+        '''
+        Notify the user that the given model could not be loaded
+        '''
+        show_dialog(
+            dialog_type=QMessageBox.Critical,
+            title='Error',
+            text='An error occurred while loading the NER model',
+            informative=str(error)
+        )
+
     def set_button(self, icon_path, function, name="", parent=None):
         '''
         Configures a QPushButton
@@ -259,11 +571,102 @@ class NERAnnotator(QMainWindow):
         )
         return btn
 
+    def show_line(self, line):
+        '''
+        Show the given line of the training file, together
+        with its annotations (if any)
+        '''
+        self.current_line = line
+        label = f'Line {self.current_line + 1}/{len(self.input_file)}'
+        if self.clusters is not None:
+            members = len(self.clusters.cluster_members(self.current_line))
+            if members > 0:
+                label += f' (and {members} duplicate lines)'
+        self.lines_label.setText(label)
+        self.content_text.clear()
+        self.content_text.insertPlainText(self.input_file[self.current_line])
+        text = self.content_text.toPlainText()
+        annotation = self.annotations.get(self.current_line)
+        entities = annotation['entities'] if annotation is not None else []
+        self.output_model.set_spans(text, entities)
+        spans = list(entities)
+        suggested = []
+        for start, end, label in self.suggestions.pop(self.current_line, []):
+            if end > start and not any(
+                start < span[1] and span[0] < end for span in spans
+            ):
+                spans.append([start, end, label])
+                suggested.append([start, end, label])
+        self.output_model.add_spans(suggested)
+        if self.classifier is not None:
+            self.classifier.prefetch(self.current_line)
+        if self.boundaries is not None:
+            self.boundaries.prefetch(self.current_line)
+
+    def search(self):
+        '''
+        List the input lines which match the query and
+        the label selected in the search panel
+        '''
+        query = self.search_text.text()
+        try:
+            lines = ner_annotator.search_lines(
+                self.input_file, self.index, self.annotations, query,
+                regex=self.search_regex.isChecked(),
+                label=self.search_label.currentData()
+            )
+        except re.error as err:
+            self.search_status.setText(f'Invalid regular expression: {err}')
+            return
+        self.search_results.clear()
+        for line in lines[:ner_annotator.SEARCH_MAX_RESULTS]:
+            item = QListWidgetItem(
+                f'{line + 1}: {self.input_file[line]}', self.search_results
+            )
+            item.setData(Qt.UserRole, line)
+        status = f'{len(lines)} matching lines'
+        if len(lines) > ner_annotator.SEARCH_MAX_RESULTS:
+            status += f' (first {ner_annotator.SEARCH_MAX_RESULTS} shown)'
+        if query and not self.search_regex.isChecked() and not self.index.ready:
+            status += (
+                f', indexed {len(self.index)}/{len(self.input_file)} lines'
+            )
+        self.search_status.setText(status)
+
+    def jump_to_line(self, line):
+        '''
+        Save the current annotations and go to the given line
+        '''
+        self.record()
+        self.show_line(line)
+
+    def focus_search(self):
+        '''
+        Show the search panel and move the focus to the search query
+        '''
+        self.search_dock.show()
+        self.search_text.setFocus()
+        self.search_text.selectAll()
+
+    def focus_goto(self):
+        '''
+        Show the search panel and move the focus to the line number
+        '''
+        self.search_dock.show()
+        self.goto_line.setValue(self.current_line + 1)
+        self.goto_line.setFocus()
+        self.goto_line.selectAll()
+
     def skip(self):
         '''
-        Show the next line of the training file
+        Show the next line of the training file, or the next
+        leased one when annotating through a server
         '''
-        if self.current_line == len(self.input_file) - 1:
+        if self.client is not None:
+            self.skip_leased_line()
+            return
+        line = self.following_line(1)
+        if line is None:
             show_dialog(
                 dialog_type=QMessageBox.Warning,
                 title='Warning',
@@ -271,26 +674,30 @@ class NERAnnotator(QMainWindow):
                 informative='You should save the results'
             )
             return
-        self.current_line += 1
-        self.lines_label.setText(
-            f'Line {self.current_line + 1}/{len(self.input_file)}'
-        )
-        self.content_text.clear()
-        self.content_text.insertPlainText(self.input_file[self.current_line])
-        self.output_table.setRowCount(0)
-        text = self.content_text.toPlainText()
-        index = self.annotation_index(text)
-        if index is not None:
-            for ent in self.annotations[index]['entities']:
-                selection_start, selection_end, entity = ent[0], ent[1], ent[2]
-                value = text[selection_start:selection_end]
-                self.add_entity(entity, selection_start, selection_end, value)
+        self.show_line(line)
 
     def undo(self):
         '''
-        Show the previous line of the training file
+        Show the previous line of the training file, or the previously
+        annotated one when annotating through a server
         '''
-        if self.current_line == 0:
+        if self.client is not None:
+            if not self.history:
+                show_dialog(
+                    dialog_type=QMessageBox.Warning,
+                    title='Warning',
+                    text='No previously annotated lines',
+                    informative='Lines are leased by the server'
+                )
+                return
+            if self.leased_line == self.current_line and not self.awaiting_lease:
+                self.client.put_back(self.current_line)
+            self.awaiting_lease = False
+            self.leased_line = None
+            self.show_line(self.history.pop())
+            return
+        line = self.following_line(-1)
+        if line is None:
             show_dialog(
                 dialog_type=QMessageBox.Warning,
                 title='Warning',
@@ -298,120 +705,488 @@ class NERAnnotator(QMainWindow):
                 informative='You should save the results'
             )
             return
-        self.current_line -= 1
-        self.lines_label.setText(
-            f'Line {self.current_line + 1}/{len(self.input_file)}'
+        self.show_line(line)
+
+    def following_line(self, step):
+        '''
+        Return the closest line after (or before, if the given step is
+        negative) the current one, skipping duplicate lines which are
+        not representatives of their cluster, or None if there is none
+        '''
+        line = self.current_line + step
+        while (0 <= line < len(self.input_file) and self.clusters is not None
+               and not self.clusters.is_representative(line)):
+            line += step
+        return line if 0 <= line < len(self.input_file) else None
+
+    def expand_clusters(self, annotations, lines):
+        '''
+        Copy the annotations of the given changed representative lines
+        to every other line of their clusters (moving entities
+        to the matching text in near-duplicate lines), in the given
+        snapshot of annotations, and return the lines of the new copies.
+        Copies are kept in `cluster_copies` and applied to later
+        snapshots as well, unless their lines are changed directly,
+        and lines annotated directly are never overwritten.
+        Runs on the journal thread
+        '''
+        clusters = self.clusters
+        copied = set()
+        if clusters is not None and clusters.ready:
+            for line in lines:
+                self.cluster_copies.pop(line, None)
+            for line in lines:
+                annotation = annotations.get(line)
+                for member in clusters.cluster_members(line):
+                    if member in annotations:
+                        continue
+                    entities = []
+                    if annotation is not None:
+                        content = self.input_file[member]
+                        entities = ner_annotator.realign_entities(
+                            annotation['entities'], annotation['content'],
+                            content
+                        )
+                    self.cluster_copies[member] = {
+                        'line': member, 'content': content,
+                        'entities': entities
+                    } if entities else None
+                    copied.add(member)
+        for member, annotation in self.cluster_copies.items():
+            if annotation is None:
+                annotations.pop(member, None)
+            else:
+                annotations[member] = annotation
+        return copied
+
+    def on_clustered(self, error):
+        '''
+        Copy the annotations saved before duplicate lines were clustered
+        to the other lines of their clusters with the next save,
+        or notify the user if clusters could not be computed
+        '''
+        if error is not None:
+            self.clusters = None
+            show_dialog(
+                dialog_type=QMessageBox.Warning,
+                title='Warning',
+                text='Duplicate lines could not be grouped',
+                informative=str(error)
+            )
+            return
+        lines, self.unclustered_lines = self.unclustered_lines, set()
+        if lines:
+            self.annotations.mark_dirty(lines)
+            self.edited(len(lines))
+        self.statusBar().showMessage(
+            f'Grouped {len(self.input_file)} lines into '
+            f'{len(self.clusters)} clusters of duplicates'
         )
-        self.content_text.clear()
-        self.content_text.insertPlainText(self.input_file[self.current_line])
-        self.output_table.setRowCount(0)
-        text = self.content_text.toPlainText()
-        index = self.annotation_index(text)
-        if index is not None:
-            for ent in self.annotations[index]['entities']:
-                selection_start, selection_end, entity = ent[0], ent[1], ent[2]
-                value = text[selection_start:selection_end]
-                self.add_entity(entity, selection_start, selection_end, value)
 
     def record(self):
         '''
         Save the current annotations
         '''
-        entities = []
-        for i in range(self.output_table.rowCount()):
-            ent = self.output_table.item(
-                i, self.output_table_labels[ner_annotator.ENTITY_LABEL]
-            ).text()
-            ss = self.output_table.item(
-                i,  self.output_table_labels[ner_annotator.SELECTION_START_LABEL]
-            ).text()
-            se = self.output_table.item(
-                i,  self.output_table_labels[ner_annotator.SELECTION_END_LABEL]
-            ).text()
-            if ent and ss.isdigit() and se.isdigit():
-                entities.append([int(ss), int(se), ent])
-        annotation = {
-            'content': self.content_text.toPlainText(),
-            'entities': entities
-        }
-        index = self.annotation_index(annotation['content'])
-        if index is None and entities:
-            self.annotations.append(annotation)
-        elif index is not None:
-            if not entities:
-                del self.annotations[index]
-            else:
-                self.annotations[index]['entities'] = entities
+        entities = self.output_model.spans()
+        content = self.content_text.toPlainText()
+        previous = self.annotations.get(self.current_line)
+        if entities:
+            if previous is None or previous['entities'] != entities:
+                self.annotations.set(self.current_line, content, entities)
+                self.journal.append(self.current_line, content, entities)
+                self.edited()
+        elif self.annotations.delete(self.current_line) is not None:
+            self.journal.append(self.current_line, content, entities)
+            self.edited()
+
+    def edited(self, count=1):
+        '''
+        Count the given number of edits and schedule an autosave once
+        edits stop for the autosave interval, or right away after
+        `AUTOSAVE_EDITS` unsaved edits
+        '''
+        if not self.autosave_interval:
+            return
+        self.unsaved_edits += count
+        if self.unsaved_edits >= ner_annotator.AUTOSAVE_EDITS:
+            self.autosave()
+        else:
+            self.autosave_timer.start(int(self.autosave_interval * 1000))
 
-    def annotation_index(self, content):
+    def autosave(self):
         '''
-        Check if the given annotation exists.
-        If it does, return its index in the annotations,
-        otherwise return None.
+        Save annotations in background, unless nothing changed.
+        If a save is running, the autosave is postponed
         '''
-        for i, ann in enumerate(self.annotations):
-            if ann['content'] == content:
-                return i
-        return None
+        self.autosave_timer.stop()
+        if not self.annotations.is_dirty():
+            self.unsaved_edits = 0
+        elif self.journal.busy:
+            self.autosave_timer.start(int(self.autosave_interval * 1000))
+        else:
+            self.write_output(manual=False)
 
     def next(self):
         '''
-        Save the current annotations and go to the next line
+        Save the current annotations and go to the next line,
+        which is the most uncertain unannotated one if lines
+        are ordered by model uncertainty (and some are ranked already),
+        or the next leased one when annotating through a server
         '''
         self.record()
+        if self.client is not None:
+            self.next_leased_line()
+            return
+        if self.ranking is not None:
+            line = self.ranking.pop(
+                skip=lambda l: l == self.current_line or l in self.annotations
+                or (self.clusters is not None
+                    and not self.clusters.is_representative(l))
+            )
+            if line is not None:
+                self.history.append(self.current_line)
+                self.show_line(line)
+                return
         self.skip()
 
+    def next_leased_line(self):
+        '''
+        Send the annotations of the current line to the server
+        and go to the next line leased by the server
+        '''
+        if not self.awaiting_lease:
+            annotation = self.annotations.get(self.current_line)
+            self.client.submit(
+                self.current_line, self.input_file[self.current_line],
+                annotation['entities'] if annotation is not None else []
+            )
+            self.history.append(self.current_line)
+        self.show_leased_line(self.client.next_line())
+
+    def skip_leased_line(self):
+        '''
+        Give up the lease of the current line without annotating it
+        (unless it was annotated already, coming back to it)
+        and go to the next line leased by the server
+        '''
+        if self.leased_line == self.current_line and not self.awaiting_lease:
+            self.client.skip(self.current_line)
+        elif not self.awaiting_lease:
+            self.history.append(self.current_line)
+        self.show_leased_line(self.client.next_line())
+
+    def show_leased_line(self, line):
+        '''
+        Show the given leased line or, if no line is available yet,
+        wait for the server to lease one (see `on_leased`)
+        '''
+        if line is None:
+            self.awaiting_lease = True
+            self.statusBar().showMessage(self.client_status(
+                'Waiting for lines from the server'
+            ))
+            return
+        self.awaiting_lease = False
+        self.leased_line = line
+        self.show_line(line)
+        self.statusBar().showMessage(self.client_status(
+            f'Annotating as {self.client.annotator} on {self.client.corpus}'
+        ))
+
+    def on_leased(self):
+        '''
+        Show the next leased line if the annotator was waiting for one,
+        or notify the user if no more lines are left on the server
+        '''
+        if not self.awaiting_lease:
+            return
+        line = self.client.next_line(request=False)
+        if line is None and self.client.exhausted:
+            self.statusBar().showMessage(self.client_status(
+                'No more lines to annotate on the server'
+            ))
+            show_dialog(
+                dialog_type=QMessageBox.Warning,
+                title='Warning',
+                text='No more lines to annotate on the server',
+                informative='You should save the results'
+            )
+            return
+        self.show_leased_line(line)
+
+    def client_status(self, message):
+        '''
+        Return the given status message, followed by the number of
+        rejected annotations and by the latest server error (if any)
+        '''
+        if self.client.rejected:
+            message += (
+                f', {len(self.client.rejected)} annotations rejected '
+                'because their lines were leased to others'
+            )
+        if self.client.error is not None:
+            message += f', server error: {self.client.error}'
+        return message
+
     def prev(self):
         '''
-        Save the current annotations and go to the previous line
+        Save the current annotations and go to the previous line,
+        which is the previously shown one if lines are ordered
+        by model uncertainty or when annotating through a server
         '''
         self.record()
+        if self.history and self.client is None:
+            self.show_line(self.history.pop())
+            return
         self.undo()
 
     def save(self):
         '''
-        Save annotations to the output file
+        Save annotations to the output file, in background.
+        If a save is running, another one follows it
         '''
-        if self.latest_save != self.annotations:
-            try:
-                open(self.output_file, 'w').write(json.dumps(self.annotations))
-                if self.model is not None and self.save_pickle:
-                    pickle_file, _ = os.path.splitext(self.output_file)
-                    with open(pickle_file, 'wb') as p:
-                        model_annotations = self.model.from_json(
-                            self.annotations
-                        )
-                        pickle.dump(model_annotations, p)
-                self.latest_save = copy.deepcopy(self.annotations)
-                show_dialog(
-                    dialog_type=QMessageBox.Information,
-                    title='Success',
-                    text='The output file was successfully saved'
+        if self.journal.busy:
+            self.save_requested = True
+            self.statusBar().showMessage('Saving...')
+        elif self.annotations.is_dirty():
+            self.write_output(manual=True)
+        else:
+            self.statusBar().showMessage('No new data to save')
+
+    def write_output(self, manual):
+        '''
+        Snapshot the annotations and hand them to the journal thread,
+        which expands clusters, writes them to the output file (and to
+        the pickle file, if requested) with an atomic rename and exports
+        them. Manual saves also send pending annotations to the server
+        right away
+        '''
+        self.autosave_timer.stop()
+        self.unsaved_edits = 0
+        self.saving_manually = manual
+        self.save_error = None
+        try:
+            if manual and self.client is not None:
+                self.client.flush()
+            annotations = self.annotations.snapshot()
+            self.saving_lines = self.annotations.mark_saved()
+            if self.clusters is not None and not self.clusters.ready:
+                self.unclustered_lines |= self.saving_lines
+            exporter, export_lines = None, set()
+            if self.export:
+                self.unexported_lines |= self.saving_lines
+                exporter = self.chunked_exporter()
+                if exporter is not None:
+                    export_lines, self.unexported_lines = (
+                        self.unexported_lines, set()
+                    )
+            callback = self.finish_save
+            if self.model is not None and self.save_pickle:
+                callback = partial(
+                    self.write_pickle, self.model, annotations, callback
                 )
+            self.statusBar().showMessage(
+                'Saving...' if manual else 'Autosaving...'
+            )
+            self.journal.compact(
+                partial(
+                    self.output_items, annotations, self.saving_lines,
+                    exporter, export_lines
+                ),
+                self.output_file, callback=callback
+            )
+        except Exception as err:
+            self.save_error = err
+            self.on_saved(err)
+
+    def write_pickle(self, model, annotations, callback, error):
+        '''
+        Write the given annotations to the pickle file of the given model,
+        once the output file was written, and call the given callback
+        with the raised exception or with None on success
+        '''
+        if error is None:
+            try:
+                pickle_file, _ = os.path.splitext(self.output_file)
+                with open(pickle_file + '.tmp', 'wb') as p:
+                    pickle.dump(model.from_json(
+                        [annotations[line] for line in sorted(annotations)]
+                    ), p)
+                os.replace(pickle_file + '.tmp', pickle_file)
             except Exception as err:
+                error = err
+        callback(error)
+
+    def finish_save(self, error):
+        '''
+        Record the outcome of a save, from the journal thread,
+        and report it to the main thread (see `on_saved`)
+        '''
+        self.save_error = error
+        self.saved.emit(error)
+
+    def corpus_name(self):
+        '''
+        Return the default name of the corpus on the server, which is
+        the name of the input file (or of the directory of its shards)
+        '''
+        path = getattr(self.input_file, 'spec', ('corpus',))[0]
+        if isinstance(path, tuple):
+            path = os.path.commonpath(path)
+        return os.path.basename(os.path.normpath(path))
+
+    def output_items(self, annotations, lines, exporter=None,
+                     export_lines=()):
+        '''
+        Expand the clusters of the given changed lines in the given
+        snapshot of annotations, start exporting the given lines (and
+        their cluster copies) with the given exporter (if any) and return
+        the (line, annotation) pairs to save, recording the shard and
+        the line in the shard of each annotation, if the input is made
+        of several shards. Runs on the journal thread
+        '''
+        copies = self.expand_clusters(annotations, lines)
+        if exporter is not None:
+            exporter.export(
+                annotations, set(export_lines) | copies,
+                callback=self.exported.emit
+            )
+        items = sorted(annotations.items())
+        if not hasattr(self.input_file, 'provenance'):
+            return items
+        return [
+            (line, dict(annotation, source=self.input_file.provenance(line)))
+            for line, annotation in items
+        ]
+
+    def chunked_exporter(self):
+        '''
+        Return the exporter of annotations to model-specific training
+        data, once the model is loaded, or None if it is not available
+        '''
+        if self.model is None:
+            return None
+        if self.exporter is None:
+            if self.model.EXPORT_EXT is None:
+                self.on_exported(Exception(
+                    'The given NER model does not support exporting annotations'
+                ))
+                return None
+            directory, _ = os.path.splitext(self.output_file)
+            self.exporter = ner_annotator.ChunkedExporter(
+                self.model.exporter(), directory + self.model.EXPORT_EXT,
+                self.model.EXPORT_EXT, ner_annotator.EXPORT_CHUNK_SIZE,
+                os.cpu_count()
+            )
+        return self.exporter
+
+    def on_exported(self, error):
+        '''
+        Notify the user if an export failed
+        '''
+        if error is not None:
+            show_dialog(
+                dialog_type=QMessageBox.Critical,
+                title='Error',
+                text='An error occurred while exporting annotations',
+                informative=str(error)
+            )
+
+    def on_saved(self, error):
+        '''
+        Notify the user about the outcome of a save in the status bar
+        (and with a dialog if a manual save failed), and start the
+        save requested while it was running, if any
+        '''
+        if error is None:
+            self.saving_lines = set()
+            self.statusBar().showMessage(
+                f'Saved {len(self.annotations)} annotations to '
+                f'{os.path.basename(self.output_file)} at {time.strftime("%H:%M:%S")}'
+            )
+        else:
+            self.annotations.mark_dirty(self.saving_lines)
+            self.statusBar().showMessage(f'Could not save: {error}')
+            if self.saving_manually:
                 show_dialog(
                     dialog_type=QMessageBox.Critical,
                     title='Error',
                     text='An error occurred while saving the output file',
-                    informative=str(err)
+                    informative=str(error)
                 )
-        else:
-            show_dialog(
-                dialog_type=QMessageBox.Information,
-                title='No data to save',
-                text='You do not have new data to save'
-            )
+            elif self.autosave_interval:
+                self.autosave_timer.start(int(self.autosave_interval * 1000))
+        if self.save_requested:
+            self.save_requested = False
+            self.save()
 
     def classify(self):
         '''
         Classify the current text using the given model
         '''
-        entities = self.model.classify(self.content_text.toPlainText())
-        for ent in entities:
-            if ent['label'] in self.entities:
-                self.add_entity(
-                    ent['label'], ent['start'], ent['end'], ent['text']
-                )
+        entities = self.classifier.get(self.current_line)
+        if entities is None:
+            self.pending_classification = self.current_line
+            self.classifier.prefetch(self.current_line)
+            return
+        self.add_classified_entities(entities)
+
+    def on_classified(self, line, entities):
+        '''
+        Show the entities classified in background, if they
+        were requested for the line which is currently shown
+        '''
+        if self.sender() is not self.classifier:
+            return
+        if line == self.pending_classification == self.current_line:
+            self.pending_classification = None
+            self.add_classified_entities(entities)
+
+    def on_classification_failed(self, line, error):
+        '''
+        Notify the user in the status bar that the given line
+        could not be classified in background
+        '''
+        if line == self.pending_classification:
+            self.pending_classification = None
+        self.statusBar().showMessage(
+            f'Line {line + 1} could not be classified: {error}'
+        )
+
+    def on_cache_failed(self, error):
+        '''
+        Notify the user in the status bar that model
+        predictions are not cached anymore
+        '''
+        if self.prediction_cache is not None:
+            try:
+                self.prediction_cache.close()
+            except sqlite3.Error:
+                pass
+            self.prediction_cache = None
+        self.statusBar().showMessage(
+            f'Model predictions are not cached on disk: {error}'
+        )
+
+    def cache_summary(self):
+        '''
+        Return the number of hits and misses of the prediction cache
+        '''
+        cache = self.prediction_cache
+        if cache is None:
+            return 'Model predictions are not cached on disk'
+        return f'Prediction cache: {cache.hits} hits, {cache.misses} misses'
+
+    def add_classified_entities(self, entities):
+        '''
+        Add the entities retrieved by the model to the output table
+        '''
+        if self.prediction_cache is not None:
+            self.statusBar().showMessage(self.cache_summary())
+        self.output_model.add_spans([
+            [ent['start'], ent['end'], ent['label']] for ent in entities
+            if ent['label'] in self.entities and ent['end'] > ent['start']
+        ])
 
     def stop(self):
         '''
@@ -422,103 +1197,135 @@ class NERAnnotator(QMainWindow):
 
     def add_selected_entity(self, entity):
         '''
-        Add the selected entity to the output table
+        Add the selected entity to the output table, snapping
+        the selection to token boundaries (if enabled)
         '''
         cursor = self.content_text.textCursor()
-        value = cursor.selectedText()
         selection_start = cursor.selectionStart()
         selection_end = cursor.selectionEnd()
-        self.add_entity(entity, selection_start, selection_end, value)
+        if self.boundaries is not None and selection_end > selection_start:
+            selection_start, selection_end = self.boundaries.snap(
+                self.current_line, selection_start, selection_end
+            )
+        self.add_entity(entity, selection_start, selection_end)
+        if self.propagation is not None and selection_end > selection_start:
+            self.propagate(entity, selection_start, selection_end)
 
-    def add_entity(self, entity, selection_start, selection_end, value):
+    def propagate(self, entity, selection_start, selection_end):
         '''
-        Add the given entity to the output table
+        Annotate the given entity on every other line where its text
+        appears as whole words, either directly or as suggestions which
+        are added to the output table when their line is shown.
+        Spans overlapping existing annotations are left out
         '''
-        if selection_end - selection_start > 0:
-            rows = self.output_table.rowCount()
-            self.output_table.insertRow(rows)
-            self.output_table.setItem(
-                rows,
-                self.output_table_labels[ner_annotator.ENTITY_LABEL],
-                QTableWidgetItem(entity)
+        text = self.output_model.text[selection_start:selection_end]
+        if not self.index.ready:
+            self.pending_propagations.append(
+                (entity, text, self.current_line, len(self.index))
             )
-            self.output_table.setItem(
-                rows,
-                self.output_table_labels[ner_annotator.VALUE_LABEL],
-                QTableWidgetItem(value)
+        lines = self.propagate_text(entity, text, self.current_line)
+        status = 'Suggested' if self.propagation == 'suggest' else 'Annotated'
+        message = f'{status} "{text}" as {entity} on {lines} other lines'
+        if not self.index.ready:
+            message += (
+                f' (indexed {len(self.index)}/{len(self.input_file)} lines,'
+                ' the others will follow once indexed)'
             )
-            self.output_table.setItem(
-                rows,
-                self.output_table_labels[ner_annotator.SELECTION_START_LABEL],
-                QTableWidgetItem(str(selection_start))
-            )
-            self.output_table.setItem(
-                rows,
-                self.output_table_labels[ner_annotator.SELECTION_END_LABEL],
-                QTableWidgetItem(str(selection_end))
-            )
-            self.output_table.resizeRowsToContents()
-            self.set_highlighting(rows, selection_start, selection_end)
+        self.statusBar().showMessage(message)
 
-    def highlight(self, selection_start, selection_end, color):
+    def propagate_text(self, entity, text, source_line, first_line=0):
         '''
-        Color selected text in the content section
+        Annotate the given entity on the lines from the given one onwards
+        where the given text appears, except for the line it comes from,
+        and return the number of annotated lines. Entities of the shown
+        line go to the output table, which is saved when leaving it
         '''
-        cursor = self.content_text.textCursor()
-        cursor.setPosition(int(selection_start))
-        cursor.setPosition(int(selection_end), QTextCursor.KeepAnchor)
-        fmt = QTextCharFormat()
-        if isinstance(color, str):
-            fmt.setBackground(QColor("transparent"))
-        elif isinstance(color, tuple) or isinstance(color, list):
-            if len(color) == 3:
-                fmt.setBackground(
-                    QColor(color[0], color[1], color[2])
-                )
-            elif len(color) == 4:
-                fmt.setBackground(
-                    QColor(color[0], color[1], color[2], color[3])
+        length = len(text)
+        lines = 0
+        for line, starts in self.index.find(text):
+            if line == source_line or line < first_line:
+                continue
+            if line == self.current_line:
+                entities = self.output_model.spans()
+            else:
+                annotation = self.annotations.get(line)
+                entities = list(annotation['entities']) if annotation else []
+            suggested = self.suggestions.get(line, [])
+            added = [
+                [start, start + length, entity] for start in starts
+                if not any(
+                    start < span[1] and span[0] < start + length
+                    for span in entities + suggested
                 )
-        cursor.setCharFormat(fmt)
+            ]
+            if not added:
+                continue
+            lines += 1
+            if line == self.current_line:
+                self.output_model.add_spans(added)
+            elif self.propagation == 'suggest':
+                self.suggestions.setdefault(line, []).extend(added)
+            else:
+                entities = sorted(entities + added)
+                content = self.input_file[line]
+                self.annotations.set(line, content, entities)
+                self.journal.append(line, content, entities)
+        if self.propagation != 'suggest' and lines > 0:
+            self.edited(lines)
+        return lines
 
-    def set_highlighting(self, output_row, selection_start, selection_end):
+    def on_indexed(self):
         '''
-        Color selected text and the corresponding row in the output table
+        Propagate the entities added before the index was complete
+        to the lines which were not indexed at that time
         '''
-        # Color selected text
-        color = [
-            random.randint(0, 255),
-            random.randint(0, 255),
-            random.randint(0, 255),
-            80
-        ]
-        self.highlight(selection_start, selection_end, color)
-
-        # Color entire row in output table
-        for output_col in self.output_table_labels.values():
-            self.output_table.item(output_row, output_col).setBackground(
-                QColor(color[0], color[1], color[2], 80)
+        pending, self.pending_propagations = self.pending_propagations, []
+        lines = sum(
+            self.propagate_text(entity, text, source_line, first_line)
+            for entity, text, source_line, first_line in pending
+        )
+        if pending:
+            status = (
+                'suggested' if self.propagation == 'suggest' else 'annotated'
+            )
+            self.statusBar().showMessage(
+                f'Index complete: {status} pending entities'
+                f' on {lines} more lines'
             )
 
-    def clear_highlighting(self, output_row):
+    def add_entity(self, entity, selection_start, selection_end):
         '''
-        Remove highlighting from text when removing 
-        corresponding entity in output table
+        Add the given entity to the output table
         '''
-        selection_start = self.output_table.item(
-            output_row, self.output_table_labels[ner_annotator.SELECTION_START_LABEL]
-        ).text()
-        selection_end = self.output_table.item(
-            output_row, self.output_table_labels[ner_annotator.SELECTION_END_LABEL]
-        ).text()
-        self.highlight(selection_start, selection_end, "transparent")
+        if selection_end - selection_start > 0:
+            self.output_model.add_span(entity, selection_start, selection_end)
+
+    def highlight(self):
+        '''
+        Color all the spans in the output table in the content section,
+        with a single layout update and without modifying the document
+        '''
+        selections = []
+        length = len(self.output_model.text)
+        for row in range(self.output_model.rowCount()):
+            start, end, _ = self.output_model.span(row)
+            start, end = min(start, length), min(end, length)
+            selection = QTextEdit.ExtraSelection()
+            selection.cursor = QTextCursor(self.content_text.document())
+            selection.cursor.setPosition(start)
+            selection.cursor.setPosition(end, QTextCursor.KeepAnchor)
+            selection.format.setBackground(self.output_model.color(row))
+            selections.append(selection)
+        self.content_text.setExtraSelections(selections)
 
     def keyPressEvent(self, event):
         if event.type() == QEvent.KeyPress and event.key() in (Qt.Key_Delete, Qt.Key_Backspace):
             select = self.output_table.selectionModel()
-            for index in select.selectedRows():
-                self.clear_highlighting(index.row())
-                self.output_table.removeRow(index.row())
+            rows = sorted(
+                (index.row() for index in select.selectedRows()), reverse=True
+            )
+            for row in rows:
+                self.output_model.remove_span(row)
         elif event.type() == QEvent.KeyPress and event.key() in range(Qt.Key_1, Qt.Key_9):
             if len(self.entities) < 10:
                 index = int(event.key()) - 48
@@ -526,14 +1333,19 @@ class NERAnnotator(QMainWindow):
 
     def closeEvent(self, event):
         self.record()
-        if self.latest_save != self.annotations:
+        if self.annotations.is_dirty():
             quit_msg = "You have unsaved work. Would you like to save it before leaving?"
             reply = QMessageBox.question(
                 self, 'Save before exit', quit_msg, QMessageBox.Yes | QMessageBox.No | QMessageBox.Cancel
             )
             if reply == QMessageBox.Yes:
-                self.save()
-                event.accept()
+                self.journal.wait()
+                self.write_output(manual=True)
+                self.journal.wait()
+                if self.save_error is None:
+                    event.accept()
+                else:
+                    event.ignore()
             elif reply == QMessageBox.Cancel:
                 event.ignore()
             else:
@@ -547,3 +1359,31 @@ class NERAnnotator(QMainWindow):
                 event.accept()
             else:
                 event.ignore()
+        if event.isAccepted():
+            self.autosave_timer.stop()
+            if self.boundaries is not None:
+                self.boundaries.stop()
+            self.journal.close()
+            self.index.stop()
+            if self.clusters is not None:
+                self.clusters.stop()
+            if self.client is not None:
+                try:
+                    self.client.close()
+                except Exception:
+                    pass
+            if self.ranking_worker is not None:
+                self.ranking_worker.stop()
+            if self.exporter is not None:
+                self.exporter.close()
+            if self.classifier is not None:
+                self.classifier.stop()
+            if self.prediction_cache is not None:
+                if self.profiler is not None:
+                    self.profiler.metadata.update({
+                        'cache_hits': self.prediction_cache.hits,
+                        'cache_misses': self.prediction_cache.misses
+                    })
+                self.prediction_cache.close()
+            if self.profiler is not None:
+                self.profiler.dump()
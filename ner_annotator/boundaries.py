@@ -0,0 +1,149 @@
+'''
+Define the snapping of selections to token boundaries
+'''
+
+
+import re
+import bisect
+import threading
+from array import array
+from collections import OrderedDict, deque
+
+import ner_annotator
+
+
+# Fallback tokenizer, which splits words and punctuation marks
+TOKEN_BOUNDARY_REGEX = re.compile(ner_annotator.SNAP_TOKEN_PATTERN)
+
+
+def regex_token_offsets(text):
+    '''
+    Return the (start, end) character offsets of the tokens of the given
+    text, where tokens are words and single punctuation marks
+    '''
+    return [match.span() for match in TOKEN_BOUNDARY_REGEX.finditer(text)]
+
+
+def snap_span(starts, ends, start, end):
+    '''
+    Return the given span moved to the boundaries of the tokens with
+    the given sorted offsets: it is extended to whole tokens and
+    shrunk to exclude leading and trailing whitespace.
+    Spans without tokens become empty
+    '''
+    first = bisect.bisect_right(ends, start)
+    last = bisect.bisect_left(starts, end) - 1
+    if first > last:
+        return start, start
+    return starts[first], ends[last]
+
+
+class TokenBoundaries(object):
+    '''
+    Token offsets of input lines, computed on a background thread for
+    the lines which follow the current one and kept in a bounded LRU
+    cache, so that selections can be snapped to token boundaries with
+    a binary search. Lines are tokenized with the given function,
+    which can be replaced once a model is loaded
+    '''
+
+    def __init__(self, lines, ahead, cache_size, tokenize=regex_token_offsets):
+        self.lines = lines
+        self.ahead = ahead
+        self.cache_size = max(cache_size, ahead + 1)
+        self.tokenize = tokenize
+        self.cache = OrderedDict()
+        self.queue = deque()
+        self.condition = threading.Condition()
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def set_tokenizer(self, tokenize):
+        '''
+        Tokenize lines with the given function from now on,
+        forgetting the offsets computed so far
+        '''
+        with self.condition:
+            self.tokenize = tokenize
+            self.cache.clear()
+
+    def offsets(self, line):
+        '''
+        Return the sorted start and end offsets of the tokens of
+        the given line, tokenizing it right away if they are not cached
+        '''
+        with self.condition:
+            offsets = self.cache.get(line)
+            if offsets is not None:
+                self.cache.move_to_end(line)
+                return offsets
+            tokenize = self.tokenize
+        offsets = self._offsets(tokenize, self.lines[line])
+        self._store(line, tokenize, offsets)
+        return offsets
+
+    def snap(self, line, start, end):
+        '''
+        Return the given span of the given line
+        snapped to token boundaries (see `snap_span`)
+        '''
+        starts, ends = self.offsets(line)
+        if not starts:
+            return start, end
+        return snap_span(starts, ends, start, end)
+
+    def prefetch(self, line):
+        '''
+        Tokenize the given line first and the following ones next,
+        cancelling every other pending line
+        '''
+        with self.condition:
+            window = range(line, min(line + self.ahead + 1, len(self.lines)))
+            self.queue = deque(l for l in window if l not in self.cache)
+            self.condition.notify()
+
+    def stop(self):
+        '''
+        Stop the worker thread
+        '''
+        with self.condition:
+            self.running = False
+            self.queue.clear()
+            self.condition.notify()
+
+    @staticmethod
+    def _offsets(tokenize, text):
+        '''
+        Return the token offsets of the given text as arrays of starts
+        and ends, skipping empty tokens (such as whitespace)
+        '''
+        starts, ends = array('I'), array('I')
+        for start, end in tokenize(text):
+            if end > start and not text[start:end].isspace():
+                starts.append(start)
+                ends.append(end)
+        return starts, ends
+
+    def _store(self, line, tokenize, offsets):
+        '''
+        Cache the given offsets, unless the tokenizer changed meanwhile
+        '''
+        with self.condition:
+            if tokenize is self.tokenize:
+                self.cache[line] = offsets
+                while len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while self.running and not self.queue:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                line = self.queue.popleft()
+                if line in self.cache:
+                    continue
+                tokenize = self.tokenize
+            self._store(line, tokenize, self._offsets(tokenize, self.lines[line]))
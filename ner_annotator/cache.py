@@ -0,0 +1,127 @@
+'''
+Define the persistent cache of model predictions
+'''
+
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+
+class PredictionCache(object):
+    '''
+    On-disk cache of model predictions, stored in a SQLite database
+    and keyed by the fingerprint of the model and by the hash of the
+    classified text. When the size of cached predictions exceeds the
+    given maximum size (in bytes), least recently used ones are evicted
+    '''
+
+    def __init__(self, path, fingerprint, max_size):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS predictions ('
+            'model TEXT NOT NULL, '
+            'text_hash BLOB NOT NULL, '
+            'entities TEXT NOT NULL, '
+            'size INTEGER NOT NULL, '
+            'accessed INTEGER NOT NULL, '
+            'PRIMARY KEY (model, text_hash))'
+        )
+        self.connection.execute(
+            'CREATE INDEX IF NOT EXISTS predictions_accessed '
+            'ON predictions (accessed)'
+        )
+        self.connection.commit()
+        self.size = self.connection.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM predictions'
+        ).fetchone()[0]
+
+    @staticmethod
+    def text_hash(text):
+        '''
+        Return the key of the given text
+        '''
+        return hashlib.sha1(text.encode('utf-8')).digest()
+
+    def get(self, text):
+        '''
+        Return the cached entities of the given text,
+        or None if they are not cached
+        '''
+        key = (self.fingerprint, self.text_hash(text))
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT entities FROM predictions '
+                'WHERE model = ? AND text_hash = ?', key
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.connection.execute(
+                'UPDATE predictions SET accessed = ? '
+                'WHERE model = ? AND text_hash = ?', (time.time_ns(), *key)
+            )
+            self.connection.commit()
+        return json.loads(row[0])
+
+    def put(self, text, entities):
+        '''
+        Cache the given entities for the given text,
+        evicting least recently used predictions if needed
+        '''
+        data = json.dumps(entities)
+        key = (self.fingerprint, self.text_hash(text))
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT size FROM predictions '
+                'WHERE model = ? AND text_hash = ?', key
+            ).fetchone()
+            if row is not None:
+                self.size -= row[0]
+            self.connection.execute(
+                'INSERT OR REPLACE INTO predictions VALUES (?, ?, ?, ?, ?)',
+                (*key, data, len(data), time.time_ns())
+            )
+            self.size += len(data)
+            self._evict()
+            self.connection.commit()
+
+    def _evict(self):
+        '''
+        Remove least recently used predictions until the size
+        of the cache is within the maximum size
+        '''
+        while self.size > self.max_size:
+            rows = self.connection.execute(
+                'SELECT rowid, size FROM predictions '
+                'ORDER BY accessed LIMIT 100'
+            ).fetchall()
+            if not rows:
+                self.size = 0
+                break
+            for rowid, size in rows:
+                self.connection.execute(
+                    'DELETE FROM predictions WHERE rowid = ?', (rowid,)
+                )
+                self.size -= size
+                if self.size <= self.max_size:
+                    break
+
+    def close(self):
+        '''
+        Close the underlying database
+        '''
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,284 @@
+'''
+Define the client of the multi-annotator server
+'''
+
+
+import json
+import time
+import threading
+import http.client
+from collections import deque
+from urllib.parse import urlsplit, urlencode
+
+
+class ServerConnection(object):
+    '''
+    Persistent HTTP connection to an annotation server,
+    which can be shared by several threads
+    '''
+
+    def __init__(self, url):
+        self.url = urlsplit(url)
+        self.connection = None
+        self.lock = threading.Lock()
+
+    def request(self, method, path, body=None, query=None):
+        '''
+        Send a request to the server, reconnecting once if the
+        connection was dropped, and return the decoded response
+        '''
+        if query is not None:
+            path += '?' + urlencode(query)
+        payload = json.dumps(body).encode() if body is not None else None
+        with self.lock:
+            for attempt in range(2):
+                if self.connection is None:
+                    self.connection = http.client.HTTPConnection(
+                        self.url.hostname, self.url.port or 80, timeout=30
+                    )
+                try:
+                    self.connection.request(
+                        method, path, body=payload,
+                        headers={'Content-Type': 'application/json'}
+                    )
+                    response = self.connection.getresponse()
+                    result = json.loads(response.read())
+                    break
+                except (OSError, http.client.HTTPException):
+                    self.connection.close()
+                    self.connection = None
+                    if attempt == 1:
+                        raise
+        if response.status != 200:
+            raise Exception(f'Server error: {result.get("error")}')
+        return result
+
+    def close(self):
+        '''
+        Close the connection
+        '''
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+
+class ServerClient(object):
+    '''
+    Client of an annotation server, which keeps a few leased lines
+    ahead of the annotator, sends annotations in batches (every given
+    number of annotations or seconds, whichever comes first), renews
+    the leases it holds and releases skipped lines, all from a background
+    thread. The optional callback is called from the background thread
+    when lines are leased after `next_line` found none available
+    '''
+
+    def __init__(self, url, corpus, lines, annotator,
+                 batch_size, flush_interval, prefetch, callback=None):
+        self.server = ServerConnection(url)
+        self.corpus = corpus
+        self.lines = lines
+        self.annotator = annotator
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.prefetch = prefetch
+        self.callback = callback
+        self.condition = threading.Condition()
+        self.leased = deque()
+        self.held = set()
+        self.pending = {}
+        self.releasing = set()
+        self.rejected = []
+        self.error = None
+        self.exhausted = False
+        self.waiting = False
+        self.expires = 0
+        self.last_flush = time.monotonic()
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def lease(self, count):
+        '''
+        Lease the given number of lines and queue them
+        '''
+        result = self.server.request('POST', '/lease', {
+            'corpus': self.corpus, 'lines': self.lines,
+            'annotator': self.annotator, 'count': count
+        })
+        with self.condition:
+            self.leased.extend(result['lines'])
+            self.held.update(result['lines'])
+            self.expires = result['expires']
+            self.exhausted = not result['lines']
+            self.condition.notify_all()
+
+    def next_line(self, request=True):
+        '''
+        Return the next leased line, or None if none is available.
+        In that case, if requested, the background thread tries to lease
+        lines again (even if none were left, since the leases of other
+        annotators may have expired meanwhile) and then calls
+        the callback: `exhausted` tells if no more lines are left
+        '''
+        with self.condition:
+            if self.leased:
+                line = self.leased.popleft()
+                self.condition.notify_all()
+                return line
+            if request:
+                self.waiting = True
+                self.exhausted = False
+                self.condition.notify_all()
+            return None
+
+    def put_back(self, line):
+        '''
+        Queue the given leased line again, as the next one
+        '''
+        with self.condition:
+            self.leased.appendleft(line)
+            self.condition.notify_all()
+
+    def skip(self, line):
+        '''
+        Give up the lease of the given line, without annotating it
+        '''
+        with self.condition:
+            self.held.discard(line)
+            self.pending.pop(line, None)
+            self.releasing.add(line)
+            self.condition.notify_all()
+
+    def submit(self, line, content, entities):
+        '''
+        Queue the given annotation (an empty list of entities
+        marking the line as done) to be sent to the server
+        '''
+        with self.condition:
+            self.pending[line] = {
+                'line': line, 'content': content, 'entities': entities
+            }
+            self.condition.notify_all()
+
+    def flush(self):
+        '''
+        Send pending annotations to the server
+        '''
+        with self.condition:
+            annotations = list(self.pending.values())
+            self.pending = {}
+            self.last_flush = time.monotonic()
+        if not annotations:
+            return
+        try:
+            result = self.server.request('POST', '/annotations', {
+                'corpus': self.corpus, 'annotator': self.annotator,
+                'annotations': annotations
+            })
+        except Exception:
+            with self.condition:
+                for annotation in annotations:
+                    self.pending.setdefault(annotation['line'], annotation)
+            raise
+        with self.condition:
+            self.held.difference_update(
+                annotation['line'] for annotation in annotations
+            )
+            self.rejected.extend(result['rejected'])
+
+    def release(self):
+        '''
+        Give up the leases of skipped lines
+        '''
+        with self.condition:
+            lines = sorted(self.releasing)
+            self.releasing = set()
+        if not lines:
+            return
+        try:
+            self.server.request('POST', '/release', {
+                'corpus': self.corpus, 'annotator': self.annotator,
+                'lines': lines
+            })
+        except Exception:
+            with self.condition:
+                self.releasing.update(lines)
+            raise
+
+    def renew(self):
+        '''
+        Extend the leases of the held lines
+        '''
+        with self.condition:
+            lines = sorted(self.held)
+        if lines:
+            result = self.server.request('POST', '/renew', {
+                'corpus': self.corpus, 'annotator': self.annotator,
+                'lines': lines
+            })
+            with self.condition:
+                self.expires = result['expires']
+
+    def annotations(self):
+        '''
+        Return the annotations of the corpus stored by the server
+        '''
+        return self.server.request(
+            'GET', '/annotations', query={'corpus': self.corpus}
+        )
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while self.running and not (
+                    len(self.pending) >= self.batch_size
+                    or (self.pending and time.monotonic() - self.last_flush
+                        >= self.flush_interval)
+                    or (len(self.leased) < self.prefetch and not self.exhausted)
+                    or self.releasing
+                    or (self.held and self.expires - time.time()
+                        < self.flush_interval * 2)
+                ):
+                    self.condition.wait(self.flush_interval / 2)
+                if not self.running:
+                    return
+                refill = len(self.leased) < self.prefetch and not self.exhausted
+                renew = bool(self.held) and (
+                    self.expires - time.time() < self.flush_interval * 2
+                )
+            try:
+                self.flush()
+                self.release()
+                if refill:
+                    self.lease(max(self.prefetch - len(self.leased), 1))
+                if renew:
+                    self.renew()
+                self.error = None
+            except Exception as err:
+                self.error = err
+            with self.condition:
+                notify = self.waiting and (
+                    self.leased or self.exhausted or self.error is not None
+                )
+                if self.leased or self.exhausted:
+                    self.waiting = False
+            if notify and self.callback is not None:
+                self.callback()
+            if self.error is not None:
+                time.sleep(self.flush_interval)
+
+    def close(self):
+        '''
+        Stop the background thread, send pending annotations
+        and give up the leases of lines which were not annotated
+        '''
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        self.thread.join()
+        self.flush()
+        with self.condition:
+            self.releasing.update(self.held)
+        self.release()
+        self.server.close()
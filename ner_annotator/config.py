@@ -3,48 +3,165 @@ Store configuration values
 '''
 
 
-from pkg_resources import resource_filename
-from os.path import abspath
-
-from PyQt5.QtCore import QFile
+import importlib
+from functools import lru_cache
+from os.path import abspath, dirname, expanduser, join
 
 
 # Input/output formats
-VALID_IN_FMT = ('.txt')
+VALID_IN_FMT = ('.txt', '.jsonl')
 VALID_OUT_FMT = ('.json')
 
+# Persisted line offsets index, stored next to the input file
+LINE_INDEX_EXT = '.idx'
+
+# Field of JSON lines input files which contains the text to annotate
+JSONL_TEXT_FIELD = 'text'
+
+# Number of lines of compressed input files which are decompressed
+# at once, and number of blocks of decompressed lines kept in memory
+COMPRESSED_BLOCK_LINES = 1024
+COMPRESSED_CACHE_BLOCKS = 16
+
+# Number of lines classified at once by the pre-annotation command
+PREANNOTATE_BATCH_SIZE = 256
+
+# Number of upcoming lines classified in background
+# and maximum number of cached classifications
+PREFETCH_LINES = 5
+PREFETCH_CACHE_SIZE = 256
+
+# Persistent cache of model predictions and its maximum size (in bytes)
+PREDICTION_CACHE_PATH = join(
+    expanduser('~'), '.cache', 'ner_annotator', 'predictions.sqlite'
+)
+PREDICTION_CACHE_SIZE = 256 * 1024 * 1024
+
+# Directory of compiled gazetteers
+GAZETTEER_CACHE_DIR = join(
+    expanduser('~'), '.cache', 'ner_annotator', 'gazetteers'
+)
+
+# Orderings of input lines, and number of lines scored at once
+# by each worker process when ordering them by model uncertainty
+VALID_ORDERS = ('file', 'uncertainty')
+RANKING_CHUNK_SIZE = 64
+
+# Clusters of duplicate input lines, stored next to the input file,
+# and parameters of the search for near-duplicates
+VALID_DEDUP_MODES = ('exact', 'near')
+CLUSTERS_EXT = '.clusters'
+DEDUP_CHUNK_SIZE = 10000
+MINHASH_PERMUTATIONS = 64
+MINHASH_BANDS = 8
+MINHASH_SHINGLE_SIZE = 5
+MINHASH_THRESHOLD = 0.8
+
+# Inverted index of input lines, used to propagate annotations
+TOKEN_PATTERN = r'\w+'
+TOKEN_INDEX_EXT = '.tokens'
+INDEX_BATCH_SIZE = 10000
+VALID_PROPAGATION_MODES = ('apply', 'suggest')
+
+# Maximum number of results shown in the search panel, and number
+# of lines decoded at once when matching regular expressions
+SEARCH_MAX_RESULTS = 1000
+SEARCH_BLOCK_LINES = 65536
+
+# Multi-annotator server: address, time (in seconds) after which
+# leased lines are handed out again, and client batching of writes
+SERVER_HOST = '127.0.0.1'
+SERVER_PORT = 8765
+SERVER_DB_PATH = 'annotations.sqlite'
+LEASE_TIME = 600
+CLIENT_BATCH_SIZE = 20
+CLIENT_FLUSH_INTERVAL = 5
+CLIENT_PREFETCH_LINES = 10
+
+# Journal of annotation changes, stored next to the output file,
+# which is flushed to disk every given number of changes or seconds
+JOURNAL_EXT = '.journal.jsonl'
+JOURNAL_SYNC_EVERY = 20
+JOURNAL_SYNC_INTERVAL = 5
+
+# Seconds without edits after which annotations are saved in background,
+# and number of edits after which they are saved right away
+AUTOSAVE_INTERVAL = 30
+AUTOSAVE_EDITS = 50
+
+# Tokens which selections are snapped to, when the model
+# has no tokenizer (words and single punctuation marks)
+SNAP_TOKEN_PATTERN = r'\w+|[^\w\s]'
+
+# Number of characters read at once when streaming output files
+READ_CHUNK_SIZE = 1024 * 1024
+
+# Number of bytes of output files which are read by each worker process
+# when computing statistics, and number of examples of invalid annotations
+# which are reported
+STATS_CHUNK_SIZE = 64 * 1024 * 1024
+STATS_MAX_EXAMPLES = 20
+
+# Number of lines in each file of exported training data
+EXPORT_CHUNK_SIZE = 10000
+
+# Environment variable with the path of the profile file, and
+# annotator actions which are timed when profiling is enabled
+PROFILE_ENV_VAR = 'NER_ANNOTATOR_PROFILE'
+PROFILED_ACTIONS = (
+    'next', 'prev', 'skip', 'undo', 'record', 'save',
+    'classify', 'add_entity', 'highlight', 'show_line', 'propagate',
+    'search'
+)
+
 # Output table labels
 ENTITY_LABEL = 'Entity'
 VALUE_LABEL = 'Value'
 SELECTION_START_LABEL = 'Start'
 SELECTION_END_LABEL = 'End'
 
-# CSS
-STYLE = ""
-STYLE_FILE_PATH = abspath(resource_filename(
-    'ner_annotator.resources.style', 'style.qss'
-))
-STYLE_FILE = QFile(STYLE_FILE_PATH)
-if STYLE_FILE.open(QFile.ReadOnly):
-    STYLE = STYLE_FILE.readAll().data().decode()
-
-# Icons
-NEXT_ICON_PATH = abspath(resource_filename(
-    'ner_annotator.resources.icons', 'next.png'
-))
-PREV_ICON_PATH = abspath(resource_filename(
-    'ner_annotator.resources.icons', 'previous.png'
-))
-SKIP_ICON_PATH = abspath(resource_filename(
-    'ner_annotator.resources.icons', 'skip.png'
-))
-SAVE_ICON_PATH = abspath(resource_filename(
-    'ner_annotator.resources.icons', 'save.png'
-))
-CLASSIFY_ICON_PATH = abspath(resource_filename(
-    'ner_annotator.resources.icons', 'categorize.png'
-))
+# Style and icons, which are resolved lazily
+STYLE_FILE = 'style.qss'
+NEXT_ICON = 'next.png'
+PREV_ICON = 'previous.png'
+SKIP_ICON = 'skip.png'
+SAVE_ICON = 'save.png'
+CLASSIFY_ICON = 'categorize.png'
 ICON_SIZE = 64
 
 # Main window
 WINDOW_TITLE = "NER Annotator"
+
+
+@lru_cache(maxsize=None)
+def resource_path(package, name):
+    '''
+    Return the absolute path of the given resource of the given package
+    '''
+    try:
+        from importlib.resources import files
+        return abspath(str(files(package) / name))
+    except ImportError:
+        return abspath(join(
+            dirname(importlib.import_module(package).__file__), name
+        ))
+
+
+def icon_path(name):
+    '''
+    Return the absolute path of the given icon
+    '''
+    return resource_path('ner_annotator.resources.icons', name)
+
+
+@lru_cache(maxsize=None)
+def load_style():
+    '''
+    Return the contents of the style sheet, or an empty
+    string if it cannot be read
+    '''
+    try:
+        with open(resource_path('ner_annotator.resources.style', STYLE_FILE)) as f:
+            return f.read()
+    except OSError:
+        return ''
@@ -0,0 +1,396 @@
+'''
+Define the clustering of duplicate and near-duplicate input lines
+'''
+
+
+import os
+import re
+import zlib
+import struct
+import hashlib
+import threading
+import multiprocessing
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+import ner_annotator
+
+
+# Multiplier used to spread shingle hashes over 64 bits
+GOLDEN_RATIO_64 = 0x9E3779B97F4A7C15
+MASK_64 = (1 << 64) - 1
+
+
+def line_digest(text):
+    '''
+    Return a 64-bit digest of the given text
+    '''
+    return int.from_bytes(
+        hashlib.blake2b(text.encode(), digest_size=8).digest(), 'little'
+    )
+
+
+def minhash(text, permutations, shingle_size):
+    '''
+    Return the MinHash signature of the given text, computed over its
+    lowercased character shingles. Signatures are computed with a single
+    hash function, whose values are split into as many bins as permutations
+    (one permutation hashing), and empty bins borrow the value of the
+    following non-empty one
+    '''
+    text = re.sub(r'\s+', ' ', text.strip().lower())
+    signature = [None] * permutations
+    for i in range(max(1, len(text) - shingle_size + 1)):
+        value = (
+            zlib.crc32(text[i:i + shingle_size].encode()) * GOLDEN_RATIO_64
+        ) & MASK_64
+        index = value % permutations
+        if signature[index] is None or value < signature[index]:
+            signature[index] = value
+    last = max(i for i, value in enumerate(signature) if value is not None)
+    for offset in range(1, permutations):
+        index = (last - offset) % permutations
+        if signature[index] is None:
+            signature[index] = signature[(index + 1) % permutations]
+    return signature
+
+
+def band_digests(signature, bands):
+    '''
+    Return a 64-bit digest of each band of the given MinHash signature
+    '''
+    rows = len(signature) // bands
+    return [
+        line_digest(str(signature[band * rows:(band + 1) * rows]))
+        for band in range(bands)
+    ]
+
+
+def sketch_similarity(sketch, other):
+    '''
+    Estimate the Jaccard similarity of the shingles of two texts
+    from the given sketches of their signatures, which keep the lowest
+    byte of each value (b-bit MinHash), correcting for the chance
+    that the bytes of different values are equal
+    '''
+    matches = sum(a == b for a, b in zip(sketch, other)) / len(sketch)
+    return (matches - 1 / 256) / (1 - 1 / 256)
+
+
+def digest_texts(texts, near, permutations, bands, shingle_size, running=None):
+    '''
+    Return the digests of the given texts (followed by the digests
+    of their bands, if near-duplicates are searched for) and the
+    sketches of their signatures, or None if the given function
+    returns false before every text is digested
+    '''
+    digests, sketches = array('Q'), bytearray()
+    for text in texts:
+        if running is not None and not running():
+            return None
+        digests.append(line_digest(text))
+        if near:
+            signature = minhash(text, permutations, shingle_size)
+            digests.extend(band_digests(signature, bands))
+            sketches.extend(value & 0xFF for value in signature)
+    return digests, sketches
+
+
+def digest_lines(spec, first, last, near, permutations, bands, shingle_size):
+    '''
+    Return the digests and the sketches of `digest_texts` for the given
+    range of lines of the input source opened with the given arguments
+    of `open_source`, in a worker process
+    '''
+    lines = ner_annotator.open_source(*spec)
+    try:
+        return digest_texts(
+            (lines[line] for line in range(first, last)),
+            near, permutations, bands, shingle_size
+        )
+    finally:
+        lines.close()
+
+
+class LineClusters(object):
+    '''
+    Clusters of duplicate input lines, each one represented by its
+    first line. Exact duplicates are found by hashing lines, and
+    near-duplicates (optionally) by locality-sensitive hashing of MinHash
+    signatures of their character shingles: lines are digested by a pool
+    of worker processes driven from a background thread, and clusters are
+    persisted next to the input file and reused on later runs, as long as
+    the file does not change. Until clusters are ready, every line is
+    considered the only member of its own cluster
+    '''
+
+    HEADER = struct.Struct('<8sQQ?')
+    MAGIC = b'NERCLST2'
+
+    def __init__(self, lines, near=False, processes=None,
+                 chunk_size=ner_annotator.DEDUP_CHUNK_SIZE):
+        self.lines = lines
+        self.near = near
+        self.processes = processes or os.cpu_count()
+        self.chunk_size = chunk_size
+        self.index_path = None
+        self.signature = None
+        path = getattr(lines, 'path', None)
+        if path is not None:
+            stat = os.stat(path)
+            self.index_path = path + ner_annotator.CLUSTERS_EXT
+            self.signature = (stat.st_size, stat.st_mtime_ns, near)
+        self.representatives = None
+        self.members = {}
+        self.running = True
+        self.thread = None
+
+    def __len__(self):
+        '''
+        Return the number of clusters
+        '''
+        if self.representatives is None:
+            return len(self.lines)
+        return len(self.representatives) - sum(map(len, self.members.values()))
+
+    @property
+    def ready(self):
+        '''
+        Check if clusters were computed (or loaded)
+        '''
+        return self.representatives is not None
+
+    def start(self, callback=None):
+        '''
+        Load the persisted clusters or start computing them. The optional
+        callback is called once clusters are ready (from the background
+        thread, if they were computed) with None, or with the raised
+        exception if they could not be computed
+        '''
+        representatives = self._load_index()
+        if representatives is not None:
+            self._set_representatives(representatives)
+            if callback is not None:
+                callback(None)
+            return
+        self.thread = threading.Thread(
+            target=self._run, args=(callback,), daemon=True
+        )
+        self.thread.start()
+
+    def stop(self):
+        '''
+        Stop computing clusters, after the lines in flight are digested
+        '''
+        self.running = False
+
+    def representative(self, line):
+        '''
+        Return the representative line of the cluster of the given line
+        '''
+        if self.representatives is None:
+            return line
+        return self.representatives[line]
+
+    def is_representative(self, line):
+        '''
+        Check if the given line represents its cluster
+        '''
+        return self.representative(line) == line
+
+    def cluster_members(self, line):
+        '''
+        Return the lines represented by the given one (excluding it)
+        '''
+        return self.members.get(line, [])
+
+    def _set_representatives(self, representatives):
+        '''
+        Switch to the given representatives of lines
+        '''
+        members = {}
+        for line, representative in enumerate(representatives):
+            if representative != line:
+                members.setdefault(representative, []).append(line)
+        self.members = members
+        self.representatives = representatives
+
+    def _run(self, callback=None):
+        error = None
+        try:
+            representatives = self._build_index()
+            if representatives is None:
+                return
+            self._set_representatives(representatives)
+            self._save_index()
+        except Exception as err:
+            error = err
+        if callback is not None:
+            callback(error)
+
+    def _ranges(self):
+        '''
+        Return the ranges of lines digested by each worker process:
+        chunks of the shards which can be read at any line, and whole
+        shards otherwise, since compressed shards would be decompressed
+        from their start for each chunk
+        '''
+        sources, starts = [self.lines], [0, len(self.lines)]
+        if isinstance(self.lines, ner_annotator.ShardedSource):
+            sources, starts = self.lines.sources, self.lines.starts
+        ranges = []
+        for source, first, end in zip(sources, starts, starts[1:]):
+            step = (
+                self.chunk_size if getattr(source, 'random_access', True)
+                else max(end - first, 1)
+            )
+            ranges.extend(
+                (start, min(start + step, end))
+                for start in range(first, end, step)
+            )
+        return ranges
+
+    def _digests(self):
+        '''
+        Return the digests of all lines (and of their bands) and the
+        sketches of their signatures, reading lines in worker processes
+        if the input source can be reopened and split into several ranges
+        '''
+        args = (
+            self.near, ner_annotator.MINHASH_PERMUTATIONS,
+            ner_annotator.MINHASH_BANDS, ner_annotator.MINHASH_SHINGLE_SIZE
+        )
+        spec = getattr(self.lines, 'spec', None)
+        ranges = (
+            self._ranges() if spec is not None and self.processes > 1 else []
+        )
+        if len(ranges) <= 1:
+            return digest_texts(
+                iter(self.lines), *args, running=lambda: self.running
+            )
+        digests, sketches = array('Q'), bytearray()
+        with ProcessPoolExecutor(
+            min(self.processes, len(ranges)),
+            mp_context=multiprocessing.get_context('spawn')
+        ) as pool:
+            futures = [
+                pool.submit(digest_lines, spec, first, end, *args)
+                for first, end in ranges
+            ]
+            for future in futures:
+                if not self.running:
+                    for other in futures:
+                        other.cancel()
+                    return None
+                chunk_digests, chunk_sketches = future.result()
+                digests.extend(chunk_digests)
+                sketches.extend(chunk_sketches)
+        return digests, sketches
+
+    def _build_index(self):
+        '''
+        Return the representative of each line, or None if clusters
+        were stopped. Exact duplicates join the cluster of their first
+        occurrence, while other lines join the first representative
+        which shares a band with them and whose estimated similarity
+        reaches `MINHASH_THRESHOLD`, or represent a new cluster: every
+        line is compared with its representative, so that clusters never
+        grow by chains of similar lines
+        '''
+        bands = ner_annotator.MINHASH_BANDS
+        permutations = ner_annotator.MINHASH_PERMUTATIONS
+        stride = 1 + (bands if self.near else 0)
+        result = self._digests()
+        if result is None:
+            return None
+        digests, sketches = result
+        representatives = array('I', range(len(self.lines)))
+        exact, buckets = {}, [{} for _ in range(stride - 1)]
+        for line in range(len(self.lines)):
+            first = exact.setdefault(digests[line * stride], line)
+            if first != line:
+                representatives[line] = representatives[first]
+                continue
+            if not self.near:
+                continue
+            keys = digests[line * stride + 1:(line + 1) * stride]
+            sketch = sketches[line * permutations:(line + 1) * permutations]
+            candidates = sorted({
+                other for bucket, key in zip(buckets, keys)
+                for other in bucket.get(key, ())
+            })
+            for other in candidates:
+                if sketch_similarity(sketch, sketches[
+                    other * permutations:(other + 1) * permutations
+                ]) >= ner_annotator.MINHASH_THRESHOLD:
+                    representatives[line] = other
+                    break
+            else:
+                for bucket, key in zip(buckets, keys):
+                    bucket.setdefault(key, []).append(line)
+        return representatives
+
+    def _load_index(self):
+        '''
+        Load the persisted clusters, if they exist
+        and they match the current input file
+        '''
+        if self.index_path is None:
+            return None
+        try:
+            with open(self.index_path, 'rb') as f:
+                header = f.read(self.HEADER.size)
+                if len(header) != self.HEADER.size:
+                    return None
+                magic, size, mtime, near = self.HEADER.unpack(header)
+                if magic != self.MAGIC or (size, mtime, near) != self.signature:
+                    return None
+                representatives = array('I')
+                representatives.frombytes(f.read())
+                if len(representatives) != len(self.lines):
+                    return None
+                return representatives
+        except (OSError, ValueError):
+            return None
+
+    def _save_index(self):
+        '''
+        Persist the clusters next to the input file. Failures are
+        ignored, since clusters can always be computed again
+        '''
+        if self.index_path is None:
+            return
+        tmp_path = self.index_path + '.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(self.HEADER.pack(self.MAGIC, *self.signature))
+                f.write(self.representatives.tobytes())
+            os.replace(tmp_path, self.index_path)
+        except OSError:
+            pass
+
+
+def realign_entities(entities, content, other_content):
+    '''
+    Move the given entities of the given content to the given
+    near-duplicate content, by looking for the occurrence of the text
+    of each entity which is closest to its original position.
+    Entities whose text cannot be found, or which would overlap
+    previous ones, are dropped
+    '''
+    if content == other_content:
+        return [list(entity) for entity in entities]
+    realigned, covered = [], 0
+    for start, end, label in sorted(entities):
+        text = content[start:end]
+        occurrences = [
+            match.start()
+            for match in re.finditer(re.escape(text), other_content)
+            if match.start() >= covered
+        ]
+        if not text or not occurrences:
+            continue
+        other_start = min(occurrences, key=lambda pos: abs(pos - start))
+        realigned.append([other_start, other_start + len(text), label])
+        covered = other_start + len(text)
+    return realigned
@@ -0,0 +1,154 @@
+'''
+Export annotations to model-specific training data
+'''
+
+
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+
+class ChunkedExporter(object):
+    '''
+    Export annotations to a directory of model-specific files, each one
+    covering a fixed-size chunk of input lines. The first export of each
+    session covers every chunk, since files left by previous sessions
+    could be stale, while the following ones only export chunks with
+    changed lines again, by a pool of worker processes which is driven
+    from a background thread
+    '''
+
+    def __init__(self, export, directory, extension, chunk_size, processes):
+        self.export_chunk = export
+        self.directory = directory
+        self.extension = extension
+        self.chunk_size = chunk_size
+        self.processes = processes
+        self.complete = False
+        self.pool = None
+        self.pending = None
+        self.condition = threading.Condition()
+        self.thread = None
+
+    def chunk_path(self, chunk):
+        '''
+        Return the path of the file of the given chunk
+        '''
+        return os.path.join(
+            self.directory, f'chunk-{chunk:06d}{self.extension}'
+        )
+
+    def existing_chunks(self):
+        '''
+        Return the chunks whose files are in the directory
+        '''
+        if not os.path.isdir(self.directory):
+            return []
+        return [
+            int(name[len('chunk-'):-len(self.extension)])
+            for name in os.listdir(self.directory)
+            if name.startswith('chunk-') and name.endswith(self.extension)
+            and name[len('chunk-'):-len(self.extension)].isdigit()
+        ]
+
+    def export(self, annotations, lines=None, callback=None):
+        '''
+        On a background thread, export the chunks of the given annotations
+        (a mapping from line numbers to annotations which is not changed
+        afterwards, such as an annotation store snapshot) which contain
+        the given lines (all of them if no lines are given).
+        If an export is running, this one follows it, together with
+        the lines of any other export requested meanwhile.
+        The optional callback is called from the background thread
+        with the raised exception, or with None on success
+        '''
+        lines = None if lines is None else set(lines)
+        with self.condition:
+            if self.pending is not None:
+                pending_lines = self.pending[1]
+                lines = (
+                    None if lines is None or pending_lines is None
+                    else lines | pending_lines
+                )
+            self.pending = (annotations, lines, callback)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                if self.pending is None:
+                    self.thread = None
+                    self.condition.notify_all()
+                    return
+                annotations, lines, callback = self.pending
+                self.pending = None
+            error = None
+            try:
+                self._export(annotations, lines)
+                self.complete = True
+            except Exception as err:
+                self.complete = False
+                error = err
+            if callback is not None:
+                callback(error)
+
+    def _export(self, annotations, lines):
+        '''
+        Export the chunks of the given annotations which contain
+        the given lines, or all of them (removing the files of empty
+        chunks) if the directory was not fully exported in this session yet
+        '''
+        if lines is None or not self.complete:
+            chunks = {line // self.chunk_size for line in annotations}
+            chunks.update(self.existing_chunks())
+        else:
+            chunks = {line // self.chunk_size for line in lines}
+        chunks = sorted(chunks)
+        paths, chunk_annotations = [], []
+        for chunk in chunks:
+            first = chunk * self.chunk_size
+            paths.append(self.chunk_path(chunk))
+            chunk_annotations.append([
+                annotations[line]
+                for line in range(first, first + self.chunk_size)
+                if line in annotations
+            ])
+        os.makedirs(self.directory, exist_ok=True)
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(
+                self.processes, mp_context=multiprocessing.get_context('spawn')
+            )
+        tmp_paths = [path + '.tmp' for path in paths]
+        jobs = [
+            (tmp_path, chunk)
+            for tmp_path, chunk in zip(tmp_paths, chunk_annotations) if chunk
+        ]
+        list(self.pool.map(
+            self.export_chunk,
+            [chunk for _, chunk in jobs], [path for path, _ in jobs]
+        ))
+        for path, tmp_path, chunk in zip(paths, tmp_paths, chunk_annotations):
+            if chunk:
+                os.replace(tmp_path, path)
+            elif os.path.isfile(path):
+                os.remove(path)
+
+    def wait(self):
+        '''
+        Wait for the running and the requested exports (if any) to complete
+        '''
+        with self.condition:
+            while self.thread is not None:
+                self.condition.wait()
+
+    def close(self):
+        '''
+        Wait for the running export (if any) and stop worker processes
+        '''
+        self.wait()
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
@@ -0,0 +1,295 @@
+'''
+Define dictionary-based entity matching
+'''
+
+
+import json
+import mmap
+import struct
+from array import array
+from bisect import bisect_left
+
+
+class AhoCorasick(object):
+    '''
+    Aho-Corasick automaton, which finds all the occurrences of a set
+    of keys in a text in time linear in the length of the text
+    (plus the number of occurrences), regardless of the number of keys.
+    Once built, the automaton is stored as flat arrays of integers,
+    which can be saved to disk and memory-mapped back
+    '''
+
+    # Names of the flat arrays, in the order in which they are stored:
+    # the transitions of node n are the (sorted) characters and targets
+    # in [edge_start[n], edge_start[n + 1]), while its values are the
+    # integers in [value_start[n], value_start[n + 1])
+    ARRAYS = (
+        'edge_start', 'edge_chars', 'edge_targets', 'fail',
+        'output', 'depth', 'value_start', 'values'
+    )
+
+    def __init__(self):
+        self.goto = [{}]
+        self.node_values = [None]
+        for name in self.ARRAYS:
+            setattr(self, name, None)
+
+    def add(self, key, value):
+        '''
+        Add the given key, associated with the given integer value
+        '''
+        node = 0
+        for char in key:
+            child = self.goto[node].get(char)
+            if child is None:
+                child = len(self.goto)
+                self.goto[node][char] = child
+                self.goto.append({})
+                self.node_values.append(None)
+            node = child
+        if self.node_values[node] is None:
+            self.node_values[node] = []
+        self.node_values[node].append(value)
+
+    def build(self):
+        '''
+        Renumber nodes in breadth-first order, flatten transitions
+        and values and compute failure links and output links.
+        The output link of a node is the closest node, along its chain
+        of failure links, which is the end of some key
+        '''
+        order, ids = [0], {0: 0}
+        for node in order:
+            for char in sorted(self.goto[node]):
+                ids[self.goto[node][char]] = len(order)
+                order.append(self.goto[node][char])
+        size = len(order)
+        self.edge_start, self.edge_chars = array('I', [0]), array('I')
+        self.edge_targets, self.depth = array('I'), array('I', [0]) * size
+        self.value_start, self.values = array('I', [0]), array('I')
+        for i, node in enumerate(order):
+            for char in sorted(self.goto[node]):
+                child = ids[self.goto[node][char]]
+                self.edge_chars.append(ord(char))
+                self.edge_targets.append(child)
+                self.depth[child] = self.depth[i] + 1
+            self.edge_start.append(len(self.edge_chars))
+            self.values.extend(self.node_values[node] or ())
+            self.value_start.append(len(self.values))
+        self.goto, self.node_values = None, None
+
+        self.fail, self.output = array('I', [0]) * size, array('I', [0]) * size
+        for node in range(size):
+            for edge in range(self.edge_start[node], self.edge_start[node + 1]):
+                code, child = self.edge_chars[edge], self.edge_targets[edge]
+                state, target = self.fail[node], None
+                while node and target is None:
+                    target = self.next(state, code)
+                    if not state:
+                        break
+                    state = self.fail[state]
+                self.fail[child] = target or 0
+                fail = self.fail[child]
+                self.output[child] = (
+                    fail if self.value_start[fail] < self.value_start[fail + 1]
+                    else self.output[fail]
+                )
+
+    def next(self, node, code):
+        '''
+        Return the target of the transition from the given node
+        with the given character code, or None if there is none
+        '''
+        lo, hi = self.edge_start[node], self.edge_start[node + 1]
+        edge = bisect_left(self.edge_chars, code, lo, hi)
+        if edge < hi and self.edge_chars[edge] == code:
+            return self.edge_targets[edge]
+        return None
+
+    def iter(self, text):
+        '''
+        Yield (end, length, value) triples for each occurrence of each key
+        in the given text, where end is the index after the occurrence
+        '''
+        node = 0
+        for i, char in enumerate(text):
+            code = ord(char)
+            target = self.next(node, code)
+            while target is None and node:
+                node = self.fail[node]
+                target = self.next(node, code)
+            node = target or 0
+            match = (
+                node if self.value_start[node] < self.value_start[node + 1]
+                else self.output[node]
+            )
+            while match:
+                for value in range(
+                    self.value_start[match], self.value_start[match + 1]
+                ):
+                    yield i + 1, self.depth[match], self.values[value]
+                match = self.output[match]
+
+    def arrays(self):
+        '''
+        Return the flat arrays of the automaton, in storage order
+        '''
+        return [getattr(self, name) for name in self.ARRAYS]
+
+    @classmethod
+    def from_buffer(cls, buffer, sizes):
+        '''
+        Return an automaton whose flat arrays are views over
+        the given buffer, with the given number of items each
+        '''
+        automaton, offset = cls(), 0
+        automaton.goto = automaton.node_values = None
+        view = memoryview(buffer)
+        for name, size in zip(cls.ARRAYS, sizes):
+            setattr(
+                automaton, name, view[offset:offset + size * 4].cast('I')
+            )
+            offset += size * 4
+        return automaton, offset
+
+
+class Gazetteer(object):
+    '''
+    Match entries of per-label lists of entities, with optional
+    case folding and word boundaries checks, returning the leftmost
+    longest non-overlapping matches
+    '''
+
+    # Header of saved gazetteers: magic number, number of items
+    # of each flat array of the automaton, size of the encoded labels
+    # and matching options, padded to keep the arrays aligned
+    MAGIC = b'NERGAZT1'
+    HEADER = struct.Struct('<8s8QQ??6x')
+
+    def __init__(
+        self, entries=(), case_folding=False, word_boundaries=True
+    ):
+        self.case_folding = case_folding
+        self.word_boundaries = word_boundaries
+        self.labels, label_ids = [], {}
+        self.automaton = AhoCorasick()
+        for label, entry in entries:
+            entry = self.fold(entry)
+            if entry:
+                if label not in label_ids:
+                    label_ids[label] = len(self.labels)
+                    self.labels.append(label)
+                self.automaton.add(entry, label_ids[label])
+        self.automaton.build()
+
+    def save(self, path):
+        '''
+        Save the gazetteer to the given path, as a header
+        followed by the raw flat arrays of the automaton
+        '''
+        arrays = self.automaton.arrays()
+        labels = json.dumps(self.labels).encode('utf-8')
+        with open(path, 'wb') as f:
+            f.write(self.HEADER.pack(
+                self.MAGIC, *(len(a) for a in arrays), len(labels),
+                self.case_folding, self.word_boundaries
+            ))
+            for a in arrays:
+                f.write(a.tobytes())
+            f.write(labels)
+
+    @classmethod
+    def load(cls, path):
+        '''
+        Load a gazetteer saved to the given path, memory-mapping
+        its automaton instead of reading it, so that loading
+        takes constant time and pages are shared among processes
+        '''
+        with open(path, 'rb') as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, *sizes, labels_size, case_folding, word_boundaries = (
+                cls.HEADER.unpack_from(buffer)
+            )
+            end = cls.HEADER.size + sum(sizes) * 4 + labels_size
+            if magic != cls.MAGIC or end != len(buffer):
+                raise ValueError(f'Invalid gazetteer file {path}')
+            gazetteer = cls.__new__(cls)
+            gazetteer.case_folding = case_folding
+            gazetteer.word_boundaries = word_boundaries
+            gazetteer.automaton, offset = AhoCorasick.from_buffer(
+                memoryview(buffer)[cls.HEADER.size:], sizes
+            )
+            gazetteer.labels = json.loads(
+                buffer[cls.HEADER.size + offset:end].decode('utf-8')
+            )
+        except (struct.error, ValueError, UnicodeDecodeError):
+            raise ValueError(f'Invalid gazetteer file {path}')
+        return gazetteer
+
+    def fold(self, text):
+        '''
+        Lowercase the given text if case folding is enabled,
+        preserving character offsets
+        '''
+        if not self.case_folding:
+            return text
+        folded = text.lower()
+        if len(folded) == len(text):
+            return folded
+        return ''.join(
+            char.lower() if len(char.lower()) == 1 else char for char in text
+        )
+
+    def is_boundary(self, text, index):
+        '''
+        Check if the given index in the given text is a word boundary
+        '''
+        if index <= 0 or index >= len(text):
+            return True
+        return not (text[index - 1].isalnum() and text[index].isalnum())
+
+    def candidates(self, text):
+        '''
+        Return (start, end, label) tuples of all the matches
+        in the given text, including overlapping ones, sorted
+        by their start and then from the longest one
+        '''
+        matches = []
+        for end, length, label in self.automaton.iter(self.fold(text)):
+            start = end - length
+            if (not self.word_boundaries or
+                    (self.is_boundary(text, start) and self.is_boundary(text, end))):
+                matches.append((start, end, self.labels[label]))
+        matches.sort(key=lambda match: (match[0], match[0] - match[1]))
+        return matches
+
+    def ambiguity(self, text):
+        '''
+        Return the fraction of matches in the given text
+        which are discarded because of overlaps
+        '''
+        matches = self.candidates(text)
+        if not matches:
+            return 0.0
+        return 1 - len(self.match(text, matches)) / len(matches)
+
+    def match(self, text, matches=None):
+        '''
+        Return the entities found in the given text, with the
+        schema defined by `NERModel.classify`, optionally
+        choosing them among the given candidate matches
+        '''
+        if matches is None:
+            matches = self.candidates(text)
+        entities, covered = [], 0
+        for start, end, label in matches:
+            if start >= covered:
+                entities.append({
+                    'label': label,
+                    'start': start,
+                    'end': end,
+                    'text': text[start:end]
+                })
+                covered = end
+        return entities
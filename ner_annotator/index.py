@@ -0,0 +1,229 @@
+'''
+Define the inverted index of input lines
+'''
+
+
+import os
+import re
+import struct
+import bisect
+import threading
+from array import array
+
+import ner_annotator
+
+
+def contains(values, value):
+    '''
+    Check if the given sorted values contain the given value
+    '''
+    index = bisect.bisect_left(values, value)
+    return index < len(values) and values[index] == value
+
+
+class TokenIndex(object):
+    '''
+    Inverted index from (lowercased) word tokens to the sorted
+    numbers of the lines which contain them, built incrementally
+    on a background thread, which is started explicitly or by the first
+    lookup: lookups only cover the lines indexed so far, and the given
+    callback (if any) is called from the thread once every line is indexed.
+    If the path of the input file is given, the index is persisted
+    next to it and reused on later runs, as long as the file does not
+    change: the file stores the lengths of tokens and of their posting
+    lists, followed by the tokens and by the concatenated postings
+    '''
+
+    HEADER = struct.Struct('<8sQQQQ')
+    MAGIC = b'NERTIDX2'
+
+    def __init__(self, lines, path=None,
+                 batch_size=ner_annotator.INDEX_BATCH_SIZE, callback=None):
+        self.lines = lines
+        self.callback = callback
+        self.index_path = None
+        self.signature = None
+        if path is not None:
+            stat = os.stat(path)
+            self.index_path = path + ner_annotator.TOKEN_INDEX_EXT
+            self.signature = (stat.st_size, stat.st_mtime_ns)
+        self.batch_size = batch_size
+        self.pattern = re.compile(ner_annotator.TOKEN_PATTERN)
+        self.postings = {}
+        self.indexed = 0
+        self.lock = threading.Lock()
+        self.running = True
+        self.started = False
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def __len__(self):
+        return self.indexed
+
+    @property
+    def ready(self):
+        '''
+        Check if every line was indexed
+        '''
+        return self.indexed == len(self.lines)
+
+    def start(self):
+        '''
+        Start loading the persisted index or indexing lines
+        in background, unless it was done already
+        '''
+        with self.lock:
+            if self.started:
+                return
+            self.started = True
+        self.thread.start()
+
+    def stop(self):
+        '''
+        Stop indexing lines
+        '''
+        self.running = False
+
+    def tokens(self, text):
+        '''
+        Return the distinct tokens of the given text
+        '''
+        return set(self.pattern.findall(text.lower()))
+
+    def _run(self):
+        postings = self._load_index()
+        if postings is not None:
+            with self.lock:
+                self.postings = postings
+                self.indexed = len(self.lines)
+        else:
+            self._index_lines()
+        if self.running and self.callback is not None:
+            self.callback()
+
+    def _index_lines(self):
+        total = len(self.lines)
+        for first in range(0, total, self.batch_size):
+            if not self.running:
+                return
+            batch = {}
+            for line in range(first, min(first + self.batch_size, total)):
+                for token in self.tokens(self.lines[line]):
+                    batch.setdefault(token, []).append(line)
+            with self.lock:
+                for token, lines in batch.items():
+                    postings = self.postings.get(token)
+                    if postings is None:
+                        self.postings[token] = array('I', lines)
+                    else:
+                        postings.extend(lines)
+                self.indexed = min(first + self.batch_size, total)
+        self._save_index()
+
+    def _load_index(self):
+        '''
+        Load the persisted token index, if it exists
+        and it matches the current input file
+        '''
+        if self.index_path is None:
+            return None
+        try:
+            with open(self.index_path, 'rb') as f:
+                header = f.read(self.HEADER.size)
+                if len(header) != self.HEADER.size:
+                    return None
+                magic, size, mtime, tokens, total = self.HEADER.unpack(header)
+                if magic != self.MAGIC or (size, mtime) != self.signature:
+                    return None
+                token_lengths, posting_lengths = array('I'), array('I')
+                token_lengths.frombytes(f.read(tokens * token_lengths.itemsize))
+                posting_lengths.frombytes(
+                    f.read(tokens * posting_lengths.itemsize)
+                )
+                names = f.read(sum(token_lengths))
+                lines = array('I')
+                lines.frombytes(f.read(total * lines.itemsize))
+                if len(token_lengths) != tokens or (
+                    len(posting_lengths) != tokens
+                ) or len(names) != sum(token_lengths) or (
+                    len(lines) != total or sum(posting_lengths) != total
+                ):
+                    return None
+        except (OSError, ValueError):
+            return None
+        try:
+            postings, name_offset, line_offset = {}, 0, 0
+            for token_length, posting_length in zip(
+                token_lengths, posting_lengths
+            ):
+                token = names[name_offset:name_offset + token_length]
+                postings[token.decode('utf-8')] = (
+                    lines[line_offset:line_offset + posting_length]
+                )
+                name_offset += token_length
+                line_offset += posting_length
+        except UnicodeDecodeError:
+            return None
+        return postings
+
+    def _save_index(self):
+        '''
+        Persist the token index next to the input file. Failures are
+        ignored, since the index can always be rebuilt
+        '''
+        if self.index_path is None:
+            return
+        tmp_path = self.index_path + '.tmp'
+        try:
+            names = [token.encode('utf-8') for token in self.postings]
+            postings = list(self.postings.values())
+            with open(tmp_path, 'wb') as f:
+                f.write(self.HEADER.pack(
+                    self.MAGIC, *self.signature,
+                    len(names), sum(map(len, postings))
+                ))
+                f.write(array('I', map(len, names)).tobytes())
+                f.write(array('I', map(len, postings)).tobytes())
+                f.write(b''.join(names))
+                for lines in postings:
+                    f.write(lines.tobytes())
+            os.replace(tmp_path, self.index_path)
+        except OSError:
+            pass
+
+    def candidates(self, text):
+        '''
+        Return the sorted numbers of the indexed lines which contain
+        every token of the given text, by intersecting posting lists
+        starting from the shortest one
+        '''
+        self.start()
+        tokens = self.tokens(text)
+        if not tokens:
+            return []
+        with self.lock:
+            postings = sorted(
+                (self.postings.get(token, array('I')) for token in tokens),
+                key=len
+            )
+            lines = list(postings[0])
+            for other in postings[1:]:
+                lines = [line for line in lines if contains(other, line)]
+                if not lines:
+                    break
+        return lines
+
+    def find(self, text):
+        '''
+        Return (line, starts) pairs, with the starting offsets
+        of the whole-word occurrences of the given text in each
+        indexed line where it appears
+        '''
+        pattern = re.compile(r'(?<!\w)' + re.escape(text) + r'(?!\w)')
+        occurrences = []
+        for line in self.candidates(text):
+            starts = [
+                match.start() for match in pattern.finditer(self.lines[line])
+            ]
+            if starts:
+                occurrences.append((line, starts))
+        return occurrences
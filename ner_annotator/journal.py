@@ -0,0 +1,233 @@
+'''
+Define the append-only journal of annotation changes
+'''
+
+
+import os
+import json
+import time
+import threading
+
+import ner_annotator
+
+
+def replay_journal(path, store, lines=None):
+    '''
+    Apply every change recorded in the given journal to the given
+    annotation store. Changes recorded before the latest save are
+    marked as saved and a truncated last record, left by a crash,
+    is ignored. If input lines are given, records whose content does
+    not match their input line (e.g. because the input was edited) are
+    matched by content, as in `load_output`.
+    Return the latest changed line (or None if the journal is empty)
+    and the number of annotations which could not be matched
+    '''
+    latest = None
+    mismatched = {}
+    with open(path, 'r') as f:
+        for record in f:
+            try:
+                record = json.loads(record)
+            except ValueError:
+                break
+            if record.get('saved'):
+                store.mark_saved()
+                continue
+            line = record['line']
+            if lines is not None and not (
+                0 <= line < len(lines) and lines[line] == record['content']
+            ):
+                mismatched[line] = record
+                continue
+            if record['entities']:
+                store.set(line, record['content'], record['entities'])
+            else:
+                store.delete(line)
+            latest = line
+    unmatched = {}
+    for record in mismatched.values():
+        if record['entities']:
+            unmatched.setdefault(record['content'], []).append(
+                record['entities']
+            )
+    if not unmatched:
+        return latest, 0
+    return latest, ner_annotator.match_by_content(store, lines, unmatched)
+
+
+class Journal(object):
+    '''
+    Append-only JSONL file where each line records the entities of one
+    input line (an empty list of entities meaning that the annotation
+    was removed). Writes are flushed to disk in batches and the journal
+    can be compacted, together with the final JSON output, by a
+    background thread, while new changes keep being appended: appending
+    only writes to the file buffer, while every fsync happens on
+    the background thread, without holding the lock of the file
+    '''
+
+    def __init__(self, path, sync_every, sync_interval):
+        self.path = path
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.condition = threading.Condition()
+        self.file = open(path, 'a')
+        self.unsynced = 0
+        self.latest_sync = time.monotonic()
+        self.sync_requested = False
+        self.tail = None
+        self.compaction = None
+        self.compacting = False
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def replay(self, store, lines=None):
+        '''
+        Apply every recorded change to the given annotation store,
+        checking records against the given input lines, and return
+        the latest changed line and the number of unmatched
+        annotations (see `replay_journal`)
+        '''
+        return replay_journal(self.path, store, lines)
+
+    def append(self, line, content, entities):
+        '''
+        Record the entities of the given line, asking the background
+        thread to flush changes to disk once enough of them are pending
+        '''
+        record = json.dumps(
+            {'line': line, 'content': content, 'entities': entities}
+        )
+        with self.condition:
+            self.file.write(record + '\n')
+            if self.tail is not None:
+                self.tail.append(record)
+            self.unsynced += 1
+            if self.unsynced >= self.sync_every:
+                self.sync_requested = True
+                self.condition.notify_all()
+
+    def sync(self):
+        '''
+        Flush pending changes to disk
+        '''
+        with self.condition:
+            self.file.flush()
+            fileno = self.file.fileno()
+            self.unsynced = 0
+            self.latest_sync = time.monotonic()
+            self.sync_requested = False
+        os.fsync(fileno)
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while self.running and self.compaction is None and not (
+                    self.sync_requested or (self.unsynced and (
+                        time.monotonic() - self.latest_sync
+                        >= self.sync_interval
+                    ))
+                ):
+                    self.condition.wait(
+                        self.sync_interval if self.unsynced else None
+                    )
+                if not self.running:
+                    return
+                compaction, self.compaction = self.compaction, None
+            if compaction is not None:
+                self._compact(*compaction)
+            else:
+                self.sync()
+
+    def compact(self, items, output_file, callback=None):
+        '''
+        On the background thread, write the given (line, annotation)
+        pairs to the output file, using the annotator JSON schema, and
+        replace the journal with one record per annotated line, followed
+        by a marker of the save. Items can also be given as a function
+        returning them, which is then called on the background thread.
+        The optional callback is called from the background thread with
+        the raised exception, or with None on success. Callers which
+        must not block should check that no compaction is running
+        first (see `busy`)
+        '''
+        self.wait()
+        with self.condition:
+            self.tail = []
+            self.compacting = True
+            self.compaction = (items, output_file, callback)
+            self.condition.notify_all()
+
+    def _compact(self, items, output_file, callback):
+        error = None
+        tmp_journal = self.path + '.tmp'
+        try:
+            self.sync()
+            if callable(items):
+                items = items()
+            tmp_output = output_file + '.tmp'
+            with open(tmp_output, 'w') as f:
+                json.dump([annotation for _, annotation in items], f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_output, output_file)
+            with open(tmp_journal, 'w') as f:
+                for _, annotation in items:
+                    f.write(json.dumps(annotation) + '\n')
+                f.write(json.dumps({'saved': True}) + '\n')
+                with self.condition:
+                    synced = len(self.tail)
+                    for record in self.tail:
+                        f.write(record + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+                with self.condition:
+                    for record in self.tail[synced:]:
+                        f.write(record + '\n')
+                    f.flush()
+                    self.unsynced = len(self.tail) - synced
+                    self.file.close()
+                    os.replace(tmp_journal, self.path)
+                    self.file = open(self.path, 'a')
+                    self.tail = None
+        except Exception as err:
+            error = err
+            with self.condition:
+                self.tail = None
+                if self.file.closed:
+                    self.file = open(self.path, 'a')
+        if callback is not None:
+            callback(error)
+        with self.condition:
+            self.compacting = False
+            self.condition.notify_all()
+
+    @property
+    def busy(self):
+        '''
+        Check if a compaction is running
+        '''
+        return self.compacting
+
+    def wait(self):
+        '''
+        Wait for the running compaction (if any) to complete
+        '''
+        with self.condition:
+            while self.compacting:
+                self.condition.wait()
+
+    def close(self):
+        '''
+        Wait for the running compaction (if any), stop
+        the background thread and flush pending changes
+        '''
+        self.wait()
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        self.thread.join()
+        self.sync()
+        with self.condition:
+            self.file.close()
@@ -3,28 +3,88 @@ Define NER models to classify entities and convert JSON data
 '''
 
 
+import os
+import json
+import hashlib
+import functools
+import threading
+import importlib.util
+import multiprocessing
+
+import ner_annotator
+
+
 def load_model(model_path):
     '''
-    Try to load the correct NER model
+    Try to load the correct NER model, by fully loading it only
+    with the first backend which cheaply detects it as its own
     '''
-    model = None
-    correct_subclass = None
     for subclass in NERModel.__subclasses__():
+        if not subclass._detect(model_path):
+            continue
         model = subclass._load_model(model_path)
         if model is not None:
-            correct_subclass = subclass
+            return subclass(model_path, model=model)
+
+    raise Exception(
+        'Could not find the corresponding library for the given NER model'
+    )
 
-    if correct_subclass is None:
-        raise Exception(
-            'Could not find the corresponding library for the given NER model'
+
+def path_fingerprint(model_path, meta_files=()):
+    '''
+    Return a string which identifies the given model file or directory,
+    computed from its path, from the size and modification time of
+    its files and from the contents of the given metadata files
+    '''
+    digest = hashlib.sha1(os.path.abspath(model_path).encode())
+    paths = [model_path] if os.path.isfile(model_path) else []
+    if os.path.isdir(model_path):
+        paths = sorted(
+            os.path.join(root, name)
+            for root, _, names in os.walk(model_path)
+            for name in names
         )
-    return correct_subclass(model_path, model=model)
+    for path in paths:
+        stat = os.stat(path)
+        digest.update(
+            f'{os.path.relpath(path, model_path)}:'
+            f'{stat.st_size}:{stat.st_mtime_ns}'.encode()
+        )
+        if os.path.basename(path) in meta_files:
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+    return digest.hexdigest()
+
+
+def disagreement(entities, other_entities):
+    '''
+    Return one minus the Jaccard similarity of the given lists
+    of entities (with the schema defined by `NERModel.classify`)
+    '''
+    spans = {(ent['start'], ent['end'], ent['label']) for ent in entities}
+    other_spans = {
+        (ent['start'], ent['end'], ent['label']) for ent in other_entities
+    }
+    union = spans | other_spans
+    if not union:
+        return 0.0
+    return 1 - len(spans & other_spans) / len(union)
 
 
 class NERModel(object):
 
+    # Names of the model files whose contents identify the model
+    META_FILES = ()
+
+    # Extension of exported training data files (None if not supported)
+    EXPORT_EXT = None
+
     def __init__(self, model_path, model=None):
         self.model_path = model_path
+        # Serializes calls to libraries which are not thread-safe,
+        # such as classifying and tokenizing from different threads
+        self.lock = threading.Lock()
         if model is not None:
             self.model = model
         else:
@@ -39,6 +99,16 @@ class NERModel(object):
                 'The given model is not a NER model'
             )
 
+    @classmethod
+    def _detect(cls, model_path):
+        '''
+        Cheaply check if the given model could belong to this backend,
+        without importing the corresponding library or loading the model.
+        Backends which cannot tell should return True, so that a full
+        load is attempted
+        '''
+        return True
+
     @classmethod
     def _load_model(cls, model_path):
         '''
@@ -54,6 +124,14 @@ class NERModel(object):
         '''
         return True
 
+    def fingerprint(self):
+        '''
+        Return a string which identifies the loaded model, computed from
+        its path, from the size and modification time of its files
+        and from the contents of its metadata files
+        '''
+        return path_fingerprint(self.model_path, self.META_FILES)
+
     def classify(self, text):
         '''
         Classify the given text and return the retrieved entities.
@@ -68,24 +146,107 @@ class NERModel(object):
         '''
         raise NotImplementedError
 
+    def classify_batch(self, texts, batch_size=1, n_process=1):
+        '''
+        Classify the given iterable of texts and yield the retrieved
+        entities of each one of them, in order, with the same schema
+        as the one returned by `classify`. Subclasses should override
+        this method if their library supports batched inference
+        '''
+        for text in texts:
+            yield self.classify(text)
+
+    def uncertainty_batch(self, texts, batch_size=1):
+        '''
+        Return the uncertainty of the model on each one of the given
+        texts, as a number between 0 (confident) and 1 (uncertain).
+        Since models do not generally expose confidences, it is measured
+        as the disagreement between the entities retrieved from each text
+        and from its lowercased version: subclasses should override
+        this method if their library provides a better estimate
+        '''
+        texts = list(texts)
+        return [
+            disagreement(entities, lowercased_entities)
+            for entities, lowercased_entities in zip(
+                self.classify_batch(texts, batch_size=batch_size),
+                self.classify_batch(
+                    [text.lower() for text in texts], batch_size=batch_size
+                )
+            )
+        ]
+
+    def token_offsets(self, text):
+        '''
+        Return the (start, end) character offsets of the tokens of
+        the given text. Subclasses should override this method if their
+        library has its own tokenizer, so that entities can be aligned
+        to the tokens it produces
+        '''
+        return ner_annotator.regex_token_offsets(text)
+
+    def has_tokenizer(self):
+        '''
+        Check if the model overrides `token_offsets` with
+        the tokenizer of its library
+        '''
+        return type(self).token_offsets is not NERModel.token_offsets
+
     def from_json(self, annotations):
         '''
         Convert JSON data to model data
         '''
         raise NotImplementedError
 
+    def exporter(self):
+        '''
+        Return a picklable function, which can run in worker processes,
+        that writes the given list of annotations (in the JSON schema)
+        to the given path, in a model-specific binary format
+        '''
+        raise NotImplementedError
+
 
 class SpaCyNERModel(NERModel):
 
+    META_FILES = ('meta.json', 'config.cfg')
+    EXPORT_EXT = '.spacy'
+
     def __init__(self, model_path, model=None):
         super(SpaCyNERModel, self).__init__(model_path, model)
+        # Copy of the tokenizer with its own vocabulary, so that lines
+        # can be tokenized while the pipeline classifies others
+        self.tokenizer = self._copy_tokenizer()
+
+    def _copy_tokenizer(self):
+        '''
+        Return a copy of the tokenizer of the pipeline, in a blank
+        pipeline of the same language, or None if it cannot be copied
+        (e.g. because it is a custom one)
+        '''
+        try:
+            import spacy
+            blank = spacy.blank(self.model.lang)
+            blank.tokenizer.from_bytes(self.model.tokenizer.to_bytes())
+            return blank.tokenizer
+        except Exception:
+            return None
+
+    @classmethod
+    def _detect(cls, model_path):
+        if importlib.util.find_spec('spacy') is None:
+            return False
+        return any(
+            os.path.isfile(os.path.join(model_path, name))
+            for name in cls.META_FILES
+        )
 
     @classmethod
     def _load_model(cls, model_path):
         try:
             import spacy
             return spacy.load(model_path)
-        except:
+        except Exception:
             return None
 
     def _is_ner_model(self):
@@ -95,8 +256,35 @@ class SpaCyNERModel(NERModel):
         return False
 
     def classify(self, text):
+        with self.lock:
+            return self._doc_entities(self.model(text))
+
+    def classify_batch(self, texts, batch_size=1, n_process=1):
+        docs = self.model.pipe(
+            texts, batch_size=batch_size, n_process=n_process
+        )
+        for doc in docs:
+            yield self._doc_entities(doc)
+
+    def token_offsets(self, text):
+        if self.tokenizer is None:
+            with self.lock:
+                return self._token_offsets(self.model.tokenizer, text)
+        return self._token_offsets(self.tokenizer, text)
+
+    def _token_offsets(self, tokenizer, text):
+        '''
+        Return the token offsets of the given text with the given tokenizer
+        '''
+        return [
+            (token.idx, token.idx + len(token)) for token in tokenizer(text)
+        ]
+
+    def _doc_entities(self, doc):
+        '''
+        Return the entities of the given SpaCy document
+        '''
         entities = []
-        doc = self.model(text)
         for ent in doc.ents:
             entities.append({
                 'label': ent.label_,
@@ -115,3 +303,150 @@ class SpaCyNERModel(NERModel):
             ents = [tuple(entity) for entity in data['entities']]
             train_data.append((data['content'], {'entities': ents}))
         return train_data
+
+    def exporter(self):
+        return functools.partial(export_docbin, self.model_path)
+
+
+# Tokenizer-only SpaCy pipelines used by the exporter, loaded once per process
+SPACY_TOKENIZERS = {}
+
+
+def export_docbin(model_path, annotations, path):
+    '''
+    Write the given annotations to the given path as a SpaCy `DocBin`,
+    tokenized by the given model. Spans which do not match token
+    boundaries, or which overlap longer ones, are dropped
+    '''
+    import spacy
+    from spacy.tokens import DocBin
+    from spacy.util import filter_spans
+
+    if model_path not in SPACY_TOKENIZERS:
+        with open(os.path.join(model_path, 'meta.json'), 'r') as f:
+            pipeline = json.load(f).get('pipeline', [])
+        SPACY_TOKENIZERS[model_path] = spacy.load(model_path, disable=pipeline)
+    nlp = SPACY_TOKENIZERS[model_path]
+    doc_bin = DocBin()
+    for annotation in annotations:
+        doc = nlp.make_doc(annotation['content'])
+        spans = [
+            doc.char_span(start, end, label=label)
+            for start, end, label in annotation['entities']
+        ]
+        doc.ents = filter_spans([span for span in spans if span is not None])
+        doc_bin.add(doc)
+    with open(path, 'wb') as f:
+        f.write(doc_bin.to_bytes())
+
+
+class GazetteerNERModel(NERModel):
+    '''
+    Dictionary-based model, stored as a directory with a `gazetteer.json`
+    manifest and one text file per label, with one entry per line.
+    The manifest may contain the following options:
+    {
+        'labels': Mapping from labels to file names (defaults to
+                  every .txt file, labeled by its name),
+        'case_folding': Whether to ignore case (defaults to false),
+        'word_boundaries': Whether matches must start and end
+                           at word boundaries (defaults to true)
+    }
+    Compiled automata are cached on disk and memory-mapped when loaded
+    '''
+
+    MANIFEST = 'gazetteer.json'
+    META_FILES = (MANIFEST,)
+
+    def __init__(self, model_path, model=None):
+        super(GazetteerNERModel, self).__init__(model_path, model)
+
+    @classmethod
+    def _detect(cls, model_path):
+        return os.path.isfile(os.path.join(model_path, cls.MANIFEST))
+
+    @classmethod
+    def _load_model(cls, model_path):
+        cache_path = os.path.join(
+            ner_annotator.GAZETTEER_CACHE_DIR,
+            path_fingerprint(model_path, cls.META_FILES) + '.gazetteer'
+        )
+        try:
+            return ner_annotator.Gazetteer.load(cache_path)
+        except (OSError, ValueError):
+            pass
+
+        with open(os.path.join(model_path, cls.MANIFEST), 'r') as f:
+            manifest = json.load(f)
+        labels = manifest.get('labels') or {
+            os.path.splitext(name)[0]: name
+            for name in sorted(os.listdir(model_path))
+            if name.endswith('.txt')
+        }
+
+        def entries():
+            for label, name in labels.items():
+                with open(os.path.join(model_path, name), 'r') as f:
+                    for entry in f:
+                        yield label, entry.strip()
+
+        gazetteer = ner_annotator.Gazetteer(
+            entries(),
+            case_folding=manifest.get('case_folding', False),
+            word_boundaries=manifest.get('word_boundaries', True)
+        )
+        try:
+            os.makedirs(ner_annotator.GAZETTEER_CACHE_DIR, exist_ok=True)
+            gazetteer.save(cache_path + '.tmp')
+            os.replace(cache_path + '.tmp', cache_path)
+        except OSError:
+            pass
+        return gazetteer
+
+    def classify(self, text):
+        return self.model.match(text)
+
+    def uncertainty_batch(self, texts, batch_size=1):
+        '''
+        Gazetteers are uncertain about texts where entries overlap,
+        so the uncertainty is the fraction of discarded matches
+        '''
+        return [self.model.ambiguity(text) for text in texts]
+
+    def classify_batch(self, texts, batch_size=1, n_process=1):
+        if n_process <= 1:
+            yield from super(GazetteerNERModel, self).classify_batch(texts)
+            return
+        with multiprocessing.get_context('spawn').Pool(
+            n_process, initializer=init_gazetteer_worker,
+            initargs=(self.model_path,)
+        ) as pool:
+            yield from pool.imap(
+                gazetteer_worker_classify, texts, chunksize=batch_size
+            )
+
+    def from_json(self, annotations):
+        '''
+        Gazetteers have no specific training format,
+        so JSON data is returned as is
+        '''
+        return annotations
+
+
+# Gazetteer loaded by each worker process of the batch path
+GAZETTEER_WORKER_MODEL = None
+
+
+def init_gazetteer_worker(model_path):
+    '''
+    Load the given gazetteer in a worker process, from the disk cache
+    '''
+    global GAZETTEER_WORKER_MODEL
+    GAZETTEER_WORKER_MODEL = GazetteerNERModel._load_model(model_path)
+
+
+def gazetteer_worker_classify(text):
+    '''
+    Classify the given text in a worker process
+    '''
+    return GAZETTEER_WORKER_MODEL.match(text)
@@ -0,0 +1,58 @@
+'''
+Headless pre-annotation of input files with an existing NER model
+'''
+
+
+import os
+import json
+import time
+
+
+def preannotate(model, lines, output_file, entities=None,
+                batch_size=1, n_process=1, report=None, report_every=10000):
+    '''
+    Classify every line of the given sequence with the given model
+    and stream the results to the output file, using the same schema
+    as the annotator (with the shard and the line in the shard of each
+    annotation, if the sequence is made of several shards).
+    Only entities whose label is in the given list are kept (all of them
+    if no list is given) and lines without entities are not written.
+    The optional `report` callable is periodically called with the number
+    of processed lines and the elapsed time in seconds. Results are
+    written to a temporary file, which replaces the output file only
+    once every line is classified.
+    Return the number of processed lines and the elapsed time
+    '''
+    start = time.perf_counter()
+    processed = 0
+    written = 0
+    tmp_output = output_file + '.tmp'
+    with open(tmp_output, 'w') as out:
+        out.write('[')
+        predictions = model.classify_batch(
+            iter(lines), batch_size=batch_size, n_process=n_process
+        )
+        for line, (content, ents) in enumerate(zip(lines, predictions)):
+            processed += 1
+            annotation = {
+                'line': line,
+                'content': content,
+                'entities': [
+                    [ent['start'], ent['end'], ent['label']] for ent in ents
+                    if entities is None or ent['label'] in entities
+                ]
+            }
+            if annotation['entities']:
+                if hasattr(lines, 'provenance'):
+                    annotation['source'] = lines.provenance(line)
+                if written > 0:
+                    out.write(', ')
+                out.write(json.dumps(annotation))
+                written += 1
+            if report is not None and processed % report_every == 0:
+                report(processed, time.perf_counter() - start)
+        out.write(']')
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(tmp_output, output_file)
+    return processed, time.perf_counter() - start
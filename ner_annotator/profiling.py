@@ -0,0 +1,91 @@
+'''
+Define the opt-in instrumentation of annotator actions
+'''
+
+
+import csv
+import json
+import time
+import threading
+import functools
+from array import array
+
+
+def percentile(values, p):
+    '''
+    Return the given percentile of the given sorted values
+    '''
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+
+class Profiler(object):
+    '''
+    Collect the latency of named actions and summarize
+    them as percentiles, together with some metadata
+    '''
+
+    def __init__(self, path, metadata=None):
+        self.path = path
+        self.metadata = dict(metadata or {})
+        self.timings = {}
+        self.lock = threading.Lock()
+
+    def add(self, name, elapsed):
+        '''
+        Record the given elapsed time (in seconds) for the given action
+        '''
+        with self.lock:
+            self.timings.setdefault(name, array('d')).append(elapsed)
+
+    def wrap(self, name, function):
+        '''
+        Return the given function, timed under the given action name
+        '''
+        @functools.wraps(function)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.add(name, time.perf_counter() - start)
+        return timed
+
+    def summary(self):
+        '''
+        Return latency statistics (in milliseconds) of each action
+        '''
+        with self.lock:
+            timings = {
+                name: sorted(t * 1000 for t in values)
+                for name, values in self.timings.items()
+            }
+        stats = {}
+        for name, values in sorted(timings.items()):
+            stats[name] = {
+                'count': len(values),
+                'mean': sum(values) / len(values),
+                'p50': percentile(values, 50),
+                'p95': percentile(values, 95),
+                'p99': percentile(values, 99),
+                'max': values[-1]
+            }
+        return stats
+
+    def dump(self):
+        '''
+        Save the summary to the profile file, as CSV if its
+        extension is .csv and as JSON otherwise
+        '''
+        stats = self.summary()
+        if self.path.endswith('.csv'):
+            with open(self.path, 'w', newline='') as f:
+                fields = list(self.metadata) + [
+                    'action', 'count', 'mean', 'p50', 'p95', 'p99', 'max'
+                ]
+                writer = csv.DictWriter(f, fieldnames=fields)
+                writer.writeheader()
+                for name, values in stats.items():
+                    writer.writerow({**self.metadata, 'action': name, **values})
+        else:
+            with open(self.path, 'w') as f:
+                json.dump({**self.metadata, 'actions': stats}, f, indent=4)
@@ -0,0 +1,86 @@
+'''
+Define the ordering of input lines by model uncertainty
+'''
+
+
+import math
+import heapq
+from array import array
+
+import ner_annotator
+
+
+# Model loaded by each worker process of the ranking pool
+SCORING_MODEL = None
+
+
+def init_scorer(model_path):
+    '''
+    Load the given model in a worker process
+    '''
+    global SCORING_MODEL
+    SCORING_MODEL = ner_annotator.load_model(model_path)
+
+
+def score_lines(texts):
+    '''
+    Return the uncertainty of the model on the given texts,
+    in a worker process
+    '''
+    return SCORING_MODEL.uncertainty_batch(texts, batch_size=len(texts))
+
+
+class RankedQueue(object):
+    '''
+    Priority queue of input lines, from the most uncertain one,
+    which is filled incrementally as lines are scored. Each scoring
+    pass of a model has a generation, so that scores of previous
+    passes are dropped once the lines are scored again
+    '''
+
+    def __init__(self, size):
+        self.scores = array('d', [math.nan]) * size
+        self.heap = []
+        self.scored = 0
+        self.generation = 0
+
+    def __len__(self):
+        return len(self.heap)
+
+    def reset(self):
+        '''
+        Start a new generation of scores, after the model changed,
+        and return it. Previous scores are dropped
+        '''
+        self.generation += 1
+        self.scores = array('d', [math.nan]) * len(self.scores)
+        self.heap = []
+        self.scored = 0
+        return self.generation
+
+    def update(self, first, scores, generation=0):
+        '''
+        Set the scores of the lines starting from the given one,
+        unless they belong to a previous generation
+        '''
+        if generation != self.generation:
+            return
+        for line, score in enumerate(scores, start=first):
+            if math.isnan(self.scores[line]):
+                self.scored += 1
+            self.scores[line] = score
+            heapq.heappush(self.heap, (-score, generation, line))
+
+    def pop(self, skip=None):
+        '''
+        Remove and return the most uncertain line, ignoring outdated
+        scores and the lines for which the given function returns true,
+        or return None if no scored line is left
+        '''
+        while self.heap:
+            score, generation, line = heapq.heappop(self.heap)
+            if generation != self.generation or -score != self.scores[line]:
+                continue
+            if skip is None or not skip(line):
+                return line
+        return None
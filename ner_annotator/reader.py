@@ -0,0 +1,268 @@
+'''
+Read annotations saved by previous sessions
+'''
+
+
+import re
+import json
+import codecs
+
+import ner_annotator
+
+
+# Candidate start of an annotation in an output file, which is a JSON
+# object following the opening bracket of the array or a comma. This can
+# also match inside a string, when the quote is the closing one of the
+# string, so candidates are only trusted once they are decoded
+ANNOTATION_START = re.compile(r'[\[,]\s*(\{)\s*"')
+
+# JSON whitespace between annotations
+WHITESPACE = re.compile(r'[ \t\r\n]*')
+
+# Number of characters from the end of a partially read output file
+# within which an invalid token may just be truncated
+TOKEN_MARGIN = 64
+
+# Number of bytes read before the start of a range of an output file,
+# so as to find annotations starting right at the beginning of the range
+RANGE_OVERLAP = 1024
+
+
+def iter_output(path, chunk_size=ner_annotator.READ_CHUNK_SIZE):
+    '''
+    Stream the annotations of the given JSON output file, one at a time,
+    without reading the whole file in memory. Empty files (such as
+    the ones left by an interrupted first save) have no annotations
+    '''
+    decoder = json.JSONDecoder()
+    with open(path, 'r') as f:
+        buffer, pos, eof = '', 0, False
+        started = False
+        while True:
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+                pos += 1
+            if pos == len(buffer):
+                if eof:
+                    if not started:
+                        return
+                    raise Exception(f'Unexpected end of file in {path}')
+                chunk = f.read(chunk_size)
+                buffer, pos, eof = buffer[pos:] + chunk, 0, not chunk
+                continue
+            if not started:
+                if buffer[pos] != '[':
+                    raise Exception(f'{path} does not contain a JSON array')
+                started = True
+                pos += 1
+                continue
+            if buffer[pos] == ']':
+                return
+            try:
+                annotation, pos = decoder.raw_decode(buffer, pos)
+            except ValueError:
+                if eof:
+                    raise
+                chunk = f.read(chunk_size)
+                buffer, pos, eof = buffer[pos:] + chunk, 0, not chunk
+                continue
+            yield annotation
+
+
+class OutputBuffer(object):
+    '''
+    Text of an output file from the given offset in bytes, decoded
+    as chunks are read and dropped as annotations are consumed.
+    Text before `start` was dropped, and `offset` is the offset in bytes
+    of `start`: dropped text is only removed once it is most of the text,
+    so that positions stay valid while annotations are decoded
+    '''
+
+    def __init__(self, f, offset, chunk_size):
+        self.file = f
+        self.offset = offset
+        self.chunk_size = chunk_size
+        self.decoder = codecs.getincrementaldecoder('utf-8')('surrogateescape')
+        self.json_decoder = json.JSONDecoder()
+        self.text = ''
+        self.start = 0
+        self.eof = False
+
+    def read(self):
+        '''
+        Read and decode the next chunk, returning False
+        if the end of the file was reached already
+        '''
+        if self.eof:
+            return False
+        chunk = self.file.read(self.chunk_size)
+        self.eof = not chunk
+        self.text += self.decoder.decode(chunk, final=self.eof)
+        return True
+
+    def offset_of(self, pos):
+        '''
+        Return the offset in bytes of the given position
+        '''
+        return self.offset + len(
+            self.text[self.start:pos].encode('utf-8', 'surrogateescape')
+        )
+
+    def drop(self, pos):
+        '''
+        Drop the text before the given position, which becomes the start
+        '''
+        self.offset = self.offset_of(pos)
+        self.start = pos
+        if self.start > len(self.text) // 2:
+            self.text = self.text[self.start:]
+            self.start = 0
+
+    def skip_whitespace(self, pos):
+        '''
+        Return the first position after the given one which is not
+        whitespace, reading more of the file if needed, or the length
+        of the text at the end of the file
+        '''
+        while True:
+            pos = WHITESPACE.match(self.text, pos).end()
+            if pos < len(self.text) or not self.read():
+                return pos
+
+    def decode(self, pos):
+        '''
+        Decode the annotation at the given position, which must be
+        a JSON object followed by a comma or by the end of the array,
+        reading more of the file if it is truncated, and return it with
+        the position of the delimiter. Raise ValueError if it is invalid
+        '''
+        while True:
+            try:
+                annotation, stop = self.json_decoder.raw_decode(self.text, pos)
+            except json.JSONDecodeError as err:
+                # Errors close to the end of the text (within the length
+                # of a literal, escape or number) may be due to truncation
+                if (err.pos >= len(self.text) - TOKEN_MARGIN or
+                        err.msg.startswith('Unterminated string')) and self.read():
+                    continue
+                raise
+            stop = self.skip_whitespace(stop)
+            if (not isinstance(annotation, dict) or stop == len(self.text)
+                    or self.text[stop] not in ',]'):
+                raise ValueError(f'Invalid annotation at {self.offset_of(pos)}')
+            return annotation, stop
+
+    def find(self, pos):
+        '''
+        Return the first annotation after the given position which can be
+        decoded, with its position and the position of its delimiter,
+        or None if there is none. Text before it is dropped
+        '''
+        while True:
+            match = ANNOTATION_START.search(self.text, pos)
+            if match is None:
+                self.drop(max(pos, len(self.text) - RANGE_OVERLAP))
+                pos = self.start
+                if not self.read():
+                    return None
+                continue
+            try:
+                annotation, stop = self.decode(match.start(1))
+            except ValueError:
+                pos = match.end(1)
+                continue
+            length = stop - match.start(1)
+            self.drop(match.start(1))
+            return annotation, self.start, self.start + length
+
+
+def iter_output_range(path, start, end,
+                      chunk_size=ner_annotator.READ_CHUNK_SIZE):
+    '''
+    Stream the annotations of the given JSON output file which start
+    in the given range of bytes, together with their offset, so that
+    several ranges of the same file can be read independently.
+    Reading starts from the first candidate annotation (slightly before
+    the range) which can be decoded, and annotations are then decoded
+    one after the other, so that text which looks like the start of an
+    annotation inside a string is never mistaken for one. Annotations
+    which are not valid JSON objects are returned as None
+    '''
+    with open(path, 'rb') as f:
+        base = max(0, start - RANGE_OVERLAP)
+        f.seek(base)
+        buffer = OutputBuffer(f, base, chunk_size)
+        found = buffer.find(0)
+        while found is not None:
+            annotation, pos, stop = found
+            offset = buffer.offset_of(pos)
+            if offset >= end:
+                return
+            if offset >= start:
+                yield offset, annotation
+            buffer.drop(stop)
+            if buffer.text[buffer.start] == ']':
+                return
+            pos = buffer.skip_whitespace(buffer.start + 1)
+            if pos == len(buffer.text) or buffer.text[pos] == ']':
+                return
+            try:
+                annotation, stop = buffer.decode(pos)
+                found = annotation, pos, stop
+            except ValueError:
+                offset = buffer.offset_of(pos)
+                if offset >= end:
+                    return
+                if offset >= start:
+                    yield offset, None
+                found = buffer.find(pos + 1)
+
+
+def load_output(path, store, lines):
+    '''
+    Load the annotations of the given JSON output file into the given
+    annotation store, indexed by their position in the given input lines.
+    Annotations without a valid line number (e.g. the ones saved by older
+    versions) are matched by content, with a single pass over the input.
+    Return the number of annotations which could not be matched
+    '''
+    unmatched = {}
+    for annotation in iter_output(path):
+        line = annotation.get('line')
+        if (line is not None and 0 <= line < len(lines) and
+                lines[line] == annotation['content']):
+            store.set(line, annotation['content'], annotation['entities'])
+        else:
+            unmatched.setdefault(annotation['content'], []).append(
+                annotation['entities']
+            )
+    return match_by_content(store, lines, unmatched)
+
+
+def match_by_content(store, lines, unmatched):
+    '''
+    Store the given lists of entities, indexed by the content of their
+    lines, on the first unannotated input lines with the same content,
+    with a single pass over the input.
+    Return the number of lists which could not be matched
+    '''
+    if unmatched:
+        for line, content in enumerate(lines):
+            if content in unmatched and line not in store:
+                store.set(line, content, unmatched[content].pop(0))
+                if not unmatched[content]:
+                    del unmatched[content]
+                    if not unmatched:
+                        break
+    return sum(len(entities) for entities in unmatched.values())
+
+
+def load_annotations(path, store, lines):
+    '''
+    Load the annotations of the given output file or journal into
+    the given annotation store and return the number of annotations
+    which could not be matched to input lines
+    '''
+    if path.endswith(ner_annotator.JOURNAL_EXT):
+        _, unmatched = ner_annotator.replay_journal(path, store, lines)
+        return unmatched
+    return load_output(path, store, lines)
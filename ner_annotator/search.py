@@ -0,0 +1,42 @@
+'''
+Define the full-text search over input lines
+'''
+
+
+import re
+
+
+def search_lines(lines, index, annotations, query, regex=False, label=None):
+    '''
+    Return the sorted numbers of the input lines which match the given
+    query and which contain at least one entity of the given label (if any).
+    Plain queries are case-insensitive and resolved through the given token
+    index (so that only the lines indexed so far are covered), while regular
+    expressions are matched against the whole input
+    '''
+    candidates = None
+    if label is not None:
+        candidates = sorted(annotations.lines_with_label(label))
+    if not query:
+        return candidates if candidates is not None else []
+
+    if regex:
+        pattern = re.compile(query)
+        if candidates is not None:
+            return [line for line in candidates if pattern.search(lines[line])]
+        if hasattr(lines, 'search'):
+            return lines.search(query)
+        return [
+            line for line in range(len(lines)) if pattern.search(lines[line])
+        ]
+
+    query = query.lower()
+    if not index.tokens(query):
+        if candidates is None:
+            candidates = range(len(lines))
+        return [line for line in candidates if query in lines[line].lower()]
+    matches = index.candidates(query)
+    if candidates is not None:
+        allowed = set(candidates)
+        matches = [line for line in matches if line in allowed]
+    return [line for line in matches if query in lines[line].lower()]
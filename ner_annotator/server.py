@@ -0,0 +1,366 @@
+'''
+Define the local multi-annotator server
+'''
+
+
+import os
+import json
+import time
+import sqlite3
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qs
+
+
+# Reason phrases of the HTTP status codes used by the server
+HTTP_REASONS = {
+    200: 'OK', 400: 'Bad Request', 404: 'Not Found',
+    500: 'Internal Server Error'
+}
+
+
+class AnnotationDatabase(object):
+    '''
+    Annotations of several corpora, stored in a SQLite database in WAL
+    mode and indexed by corpus and line, together with the time-limited
+    leases of lines handed out to annotators. Lines are leased in file
+    order, starting from a per-corpus cursor, and expired leases are
+    handed out again first, except to the annotators who released them,
+    which get them back only once no other line is left.
+    Methods must be called from a single thread
+    '''
+
+    def __init__(self, path, lease_time):
+        self.lease_time = lease_time
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(
+            'CREATE TABLE IF NOT EXISTS corpora ('
+            'corpus TEXT PRIMARY KEY, '
+            'lines INTEGER NOT NULL, '
+            'cursor INTEGER NOT NULL);'
+            'CREATE TABLE IF NOT EXISTS annotations ('
+            'corpus TEXT NOT NULL, '
+            'line INTEGER NOT NULL, '
+            'content TEXT NOT NULL, '
+            'entities TEXT NOT NULL, '
+            'annotator TEXT NOT NULL, '
+            'updated REAL NOT NULL, '
+            'PRIMARY KEY (corpus, line));'
+            'CREATE TABLE IF NOT EXISTS leases ('
+            'corpus TEXT NOT NULL, '
+            'line INTEGER NOT NULL, '
+            'annotator TEXT NOT NULL, '
+            'expires REAL NOT NULL, '
+            'PRIMARY KEY (corpus, line));'
+            'CREATE INDEX IF NOT EXISTS leases_expires '
+            'ON leases (corpus, expires);'
+            'CREATE TABLE IF NOT EXISTS releases ('
+            'corpus TEXT NOT NULL, '
+            'annotator TEXT NOT NULL, '
+            'line INTEGER NOT NULL, '
+            'PRIMARY KEY (corpus, annotator, line));'
+        )
+        self.connection.commit()
+
+    def lease(self, corpus, lines, annotator, count):
+        '''
+        Lease at most the given number of lines of the given corpus
+        (with the given number of lines) to the given annotator,
+        and return them together with the expiration time
+        '''
+        now = time.time()
+        expires = now + self.lease_time
+        leased = []
+        with self.connection:
+            self.connection.execute(
+                'INSERT OR IGNORE INTO corpora VALUES (?, ?, 0)',
+                (corpus, lines)
+            )
+            expired = self.connection.execute(
+                'SELECT line FROM leases WHERE corpus = ? AND expires <= ? '
+                'AND line NOT IN (SELECT line FROM releases '
+                'WHERE corpus = ? AND annotator = ?) ORDER BY line LIMIT ?',
+                (corpus, now, corpus, annotator, count)
+            ).fetchall()
+            leased.extend(self._take_over(corpus, expired, annotator, expires))
+            cursor, lines = self.connection.execute(
+                'SELECT cursor, lines FROM corpora WHERE corpus = ?', (corpus,)
+            ).fetchone()
+            while len(leased) < count and cursor < lines:
+                last = min(cursor + 2 * count, lines)
+                taken = {
+                    line for (line,) in self.connection.execute(
+                        'SELECT line FROM annotations WHERE corpus = ? '
+                        'AND line >= ? AND line < ? UNION '
+                        'SELECT line FROM leases WHERE corpus = ? '
+                        'AND line >= ? AND line < ?',
+                        (corpus, cursor, last, corpus, cursor, last)
+                    )
+                }
+                for line in range(cursor, last):
+                    if len(leased) == count:
+                        break
+                    cursor = line + 1
+                    if line not in taken:
+                        self.connection.execute(
+                            'INSERT INTO leases VALUES (?, ?, ?, ?)',
+                            (corpus, line, annotator, expires)
+                        )
+                        leased.append(line)
+            self.connection.execute(
+                'UPDATE corpora SET cursor = ? WHERE corpus = ?',
+                (cursor, corpus)
+            )
+            if len(leased) < count:
+                released = self.connection.execute(
+                    'SELECT leases.line FROM leases JOIN releases '
+                    'ON releases.corpus = leases.corpus '
+                    'AND releases.line = leases.line '
+                    'WHERE leases.corpus = ? AND leases.expires <= ? '
+                    'AND releases.annotator = ? ORDER BY leases.line LIMIT ?',
+                    (corpus, now, annotator, count - len(leased))
+                ).fetchall()
+                leased.extend(
+                    self._take_over(corpus, released, annotator, expires)
+                )
+        return {'lines': sorted(leased), 'expires': expires}
+
+    def _take_over(self, corpus, rows, annotator, expires):
+        '''
+        Lease the lines of the given rows of expired leases
+        to the given annotator, and return them
+        '''
+        lines = [line for (line,) in rows]
+        self.connection.executemany(
+            'UPDATE leases SET annotator = ?, expires = ? '
+            'WHERE corpus = ? AND line = ?',
+            [(annotator, expires, corpus, line) for line in lines]
+        )
+        return lines
+
+    def renew(self, corpus, annotator, lines):
+        '''
+        Extend the leases of the given lines held by the given annotator,
+        and return the lines whose lease could be extended
+        '''
+        expires = time.time() + self.lease_time
+        renewed = []
+        with self.connection:
+            for line in lines:
+                cursor = self.connection.execute(
+                    'UPDATE leases SET expires = ? WHERE corpus = ? '
+                    'AND line = ? AND annotator = ?',
+                    (expires, corpus, line, annotator)
+                )
+                if cursor.rowcount > 0:
+                    renewed.append(line)
+        return {'lines': renewed, 'expires': expires}
+
+    def release(self, corpus, annotator, lines):
+        '''
+        Give up the leases of the given lines held by the given annotator,
+        by expiring them, so that they are handed out again first to other
+        annotators, and remember who released them
+        '''
+        with self.connection:
+            for line in lines:
+                cursor = self.connection.execute(
+                    'UPDATE leases SET expires = 0 WHERE corpus = ? '
+                    'AND line = ? AND annotator = ?',
+                    (corpus, line, annotator)
+                )
+                if cursor.rowcount > 0:
+                    self.connection.execute(
+                        'INSERT OR IGNORE INTO releases VALUES (?, ?, ?)',
+                        (corpus, annotator, line)
+                    )
+        return {'lines': list(lines)}
+
+    def submit(self, corpus, annotator, annotations):
+        '''
+        Store the given annotations (an empty list of entities marking
+        a line as done) in a single transaction and release their leases.
+        Annotations of lines currently leased to other annotators are
+        rejected, and returned
+        '''
+        now = time.time()
+        rejected = []
+        with self.connection:
+            for annotation in annotations:
+                line = annotation['line']
+                holder = self.connection.execute(
+                    'SELECT annotator FROM leases WHERE corpus = ? '
+                    'AND line = ? AND expires > ?', (corpus, line, now)
+                ).fetchone()
+                if holder is not None and holder[0] != annotator:
+                    rejected.append(line)
+                    continue
+                self.connection.execute(
+                    'INSERT OR REPLACE INTO annotations VALUES (?, ?, ?, ?, ?, ?)',
+                    (corpus, line, annotation['content'],
+                     json.dumps(annotation['entities']), annotator, now)
+                )
+                self.connection.execute(
+                    'DELETE FROM leases WHERE corpus = ? AND line = ?',
+                    (corpus, line)
+                )
+                self.connection.execute(
+                    'DELETE FROM releases WHERE corpus = ? AND line = ?',
+                    (corpus, line)
+                )
+        return {'rejected': rejected}
+
+    def annotations(self, corpus):
+        '''
+        Return the annotations of the given corpus with some entities,
+        with the output schema and sorted by line
+        '''
+        return [
+            {'line': line, 'content': content, 'entities': json.loads(entities)}
+            for line, content, entities in self.connection.execute(
+                'SELECT line, content, entities FROM annotations '
+                'WHERE corpus = ? AND entities != ? ORDER BY line',
+                (corpus, '[]')
+            )
+        ]
+
+    def stats(self, corpus):
+        '''
+        Return the number of lines, done lines and active leases
+        of the given corpus
+        '''
+        row = self.connection.execute(
+            'SELECT lines FROM corpora WHERE corpus = ?', (corpus,)
+        ).fetchone()
+        done = self.connection.execute(
+            'SELECT COUNT(*) FROM annotations WHERE corpus = ?', (corpus,)
+        ).fetchone()[0]
+        leased = self.connection.execute(
+            'SELECT COUNT(*) FROM leases WHERE corpus = ? AND expires > ?',
+            (corpus, time.time())
+        ).fetchone()[0]
+        return {
+            'lines': row[0] if row is not None else 0,
+            'done': done,
+            'leased': leased
+        }
+
+    def close(self):
+        '''
+        Close the database
+        '''
+        self.connection.close()
+
+
+class AnnotationServer(object):
+    '''
+    Minimal HTTP/1.1 server, based on asyncio streams, which exposes
+    an annotation database to the annotators of a local network.
+    Database calls run on a single dedicated thread, so that they
+    are serialized and never block the event loop.
+    Requests and responses are JSON objects:
+        POST /lease {corpus, lines, annotator, count}
+        POST /renew {corpus, annotator, lines}
+        POST /release {corpus, annotator, lines}
+        POST /annotations {corpus, annotator, annotations}
+        GET /annotations?corpus=...
+        GET /stats?corpus=...
+    '''
+
+    def __init__(self, db_path, lease_time):
+        self.executor = ThreadPoolExecutor(1)
+        self.database = self.executor.submit(
+            AnnotationDatabase, db_path, lease_time
+        ).result()
+        self.routes = {
+            ('POST', '/lease'): lambda body, query: self.database.lease(
+                body['corpus'], body['lines'], body['annotator'], body['count']
+            ),
+            ('POST', '/renew'): lambda body, query: self.database.renew(
+                body['corpus'], body['annotator'], body['lines']
+            ),
+            ('POST', '/release'): lambda body, query: self.database.release(
+                body['corpus'], body['annotator'], body['lines']
+            ),
+            ('POST', '/annotations'): lambda body, query: self.database.submit(
+                body['corpus'], body['annotator'], body['annotations']
+            ),
+            ('GET', '/annotations'): lambda body, query:
+                self.database.annotations(query['corpus'][0]),
+            ('GET', '/stats'): lambda body, query:
+                self.database.stats(query['corpus'][0])
+        }
+
+    async def handle(self, reader, writer):
+        '''
+        Serve the requests of a client connection
+        '''
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    header = await reader.readline()
+                    if header in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = header.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get('content-length', 0))
+                body = await reader.readexactly(length) if length else b''
+                url = urlsplit(target)
+                route = self.routes.get((method, url.path))
+                if route is None:
+                    status, result = 404, {'error': 'Unknown endpoint'}
+                else:
+                    try:
+                        result = await loop.run_in_executor(
+                            self.executor, route,
+                            json.loads(body) if body else {}, parse_qs(url.query)
+                        )
+                        status = 200
+                    except (KeyError, TypeError, ValueError) as err:
+                        status, result = 400, {'error': str(err)}
+                    except Exception as err:
+                        status, result = 500, {
+                            'error': f'{type(err).__name__}: {err}'
+                        }
+                payload = json.dumps(result).encode()
+                writer.write(
+                    f'HTTP/1.1 {status} {HTTP_REASONS[status]}\r\n'
+                    'Content-Type: application/json\r\n'
+                    f'Content-Length: {len(payload)}\r\n\r\n'.encode()
+                    + payload
+                )
+                await writer.drain()
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host, port, started=None):
+        '''
+        Serve clients forever, calling the given
+        function (if any) once the server is listening
+        '''
+        server = await asyncio.start_server(self.handle, host, port)
+        if started is not None:
+            started(server)
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        '''
+        Close the database and stop its thread
+        '''
+        self.executor.submit(self.database.close).result()
+        self.executor.shutdown()
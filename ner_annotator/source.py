@@ -0,0 +1,492 @@
+'''
+Define sources of input lines
+'''
+
+
+import os
+import re
+import bz2
+import glob
+import gzip
+import json
+import mmap
+import bisect
+import struct
+import threading
+from array import array
+from collections import OrderedDict
+
+import ner_annotator
+
+
+class LineSource(object):
+    '''
+    Random-access view over the lines of a text file, backed by
+    a memory map and by an index of line offsets, which is
+    persisted next to the input file and reused on later runs
+    '''
+
+    HEADER = struct.Struct('<8sQQ')
+    MAGIC = b'NERLIDX1'
+
+    # Whether any line can be read without reading the previous ones
+    random_access = True
+
+    def __init__(self, path, encoding='utf-8'):
+        self.path = path
+        self.encoding = encoding
+        self.index_path = path + ner_annotator.LINE_INDEX_EXT
+        self._file = open(path, 'rb')
+        stat = os.fstat(self._file.fileno())
+        self._signature = (stat.st_size, stat.st_mtime_ns)
+        self._data = (
+            mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            if stat.st_size > 0 else b''
+        )
+        self._offsets = self._load_index()
+        if self._offsets is None:
+            self._offsets = self._build_index()
+            self._save_index()
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, line):
+        if line < 0:
+            line += len(self)
+        if line < 0 or line >= len(self):
+            raise IndexError('Line index out of range')
+        raw = self._data[self._offsets[line]:self._offsets[line + 1]]
+        return raw.rstrip(b'\r\n').decode(self.encoding)
+
+    def __iter__(self):
+        for line in range(len(self)):
+            yield self[line]
+
+    @property
+    def spec(self):
+        '''
+        Return the arguments of `open_source` which open this source again
+        '''
+        return self.path, None
+
+    def search(self, pattern):
+        '''
+        Return the sorted numbers of the lines which match the given
+        regular expression. Blocks of lines are decoded and scanned
+        at once, and each candidate line is then matched on its own,
+        so that matches never span several lines
+        '''
+        regex = re.compile(pattern)
+        if '\\A' in pattern or '\\Z' in pattern:
+            return [line for line, text in enumerate(self) if regex.search(text)]
+        block_regex = re.compile(pattern, re.MULTILINE)
+        lines = []
+        for first in range(0, len(self), ner_annotator.SEARCH_BLOCK_LINES):
+            end = min(first + ner_annotator.SEARCH_BLOCK_LINES, len(self))
+            text = self._data[self._offsets[first]:self._offsets[end]].decode(
+                self.encoding
+            )
+            if '\r' in text:
+                text = re.sub('\r+\n', '\n', text)
+            line, line_start, pos = first, 0, 0
+            while True:
+                match = block_regex.search(text, pos)
+                if match is None:
+                    break
+                line += text.count('\n', line_start, match.start())
+                if line >= end:
+                    break
+                if regex.search(self[line]):
+                    lines.append(line)
+                line_start = text.find('\n', match.start())
+                if line_start == -1:
+                    break
+                line, line_start = line + 1, line_start + 1
+                pos = line_start
+        return lines
+
+    def _build_index(self):
+        '''
+        Scan the whole file once and return the starting offset
+        of each line, followed by the size of the file
+        '''
+        size = len(self._data)
+        offsets = array('Q')
+        if size > 0:
+            offsets.append(0)
+        pos = self._data.find(b'\n')
+        while pos != -1 and pos + 1 < size:
+            offsets.append(pos + 1)
+            pos = self._data.find(b'\n', pos + 1)
+        offsets.append(size)
+        return offsets
+
+    def _load_index(self):
+        '''
+        Load the persisted line index, if it exists
+        and it matches the current input file
+        '''
+        try:
+            with open(self.index_path, 'rb') as f:
+                header = f.read(self.HEADER.size)
+                if len(header) != self.HEADER.size:
+                    return None
+                magic, size, mtime = self.HEADER.unpack(header)
+                if magic != self.MAGIC or (size, mtime) != self._signature:
+                    return None
+                offsets = array('Q')
+                offsets.frombytes(f.read())
+                return offsets if len(offsets) > 0 else None
+        except (OSError, ValueError):
+            return None
+
+    def _save_index(self):
+        '''
+        Persist the line index next to the input file. Failures are
+        ignored, since the index can always be rebuilt
+        '''
+        tmp_path = self.index_path + '.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(self.HEADER.pack(self.MAGIC, *self._signature))
+                f.write(self._offsets.tobytes())
+            os.replace(tmp_path, self.index_path)
+        except OSError:
+            pass
+
+    def close(self):
+        '''
+        Release the memory map and the underlying file
+        '''
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._file.close()
+
+
+def open_zstd(path):
+    '''
+    Open the given Zstandard-compressed file, which
+    requires the optional zstandard package
+    '''
+    try:
+        import zstandard
+    except ImportError:
+        raise Exception(
+            'Reading Zstandard-compressed files requires '
+            'the zstandard package (pip install zstandard)'
+        )
+    return zstandard.open(path, 'rb')
+
+
+# Functions which open compressed files, by extension
+COMPRESSED_OPENERS = {
+    '.gz': gzip.open,
+    '.bz2': bz2.open,
+    '.zst': open_zstd,
+    '.zstd': open_zstd
+}
+
+
+class CompressedLineSource(LineSource):
+    '''
+    Random-access view over the lines of a compressed text file,
+    which is decompressed in a streaming way (never to disk).
+    The index of line offsets in the decompressed data is persisted
+    next to the input file, like for plain files, and blocks of lines
+    are decompressed on demand and kept in a bounded LRU cache.
+    Each thread decompresses blocks with its own stream, without
+    holding the lock of the cache, so that background readers never
+    wait for each other: reading forward continues the stream of
+    the thread, while reading backward restarts it
+    '''
+
+    # Compressed streams cannot seek, so reading a line in a new
+    # stream decompresses every line before it
+    random_access = False
+
+    def __init__(self, path, encoding='utf-8',
+                 block_lines=ner_annotator.COMPRESSED_BLOCK_LINES,
+                 cache_blocks=ner_annotator.COMPRESSED_CACHE_BLOCKS):
+        self.path = path
+        self.encoding = encoding
+        self.index_path = path + ner_annotator.LINE_INDEX_EXT
+        self.block_lines = block_lines
+        self.cache_blocks = cache_blocks
+        self._opener = COMPRESSED_OPENERS[os.path.splitext(path)[1]]
+        stat = os.stat(path)
+        self._signature = (stat.st_size, stat.st_mtime_ns)
+        self._streams = threading.local()
+        self._files = []
+        self._blocks = OrderedDict()
+        self._lock = threading.Lock()
+        self._offsets = self._load_index()
+        if self._offsets is None:
+            self._offsets = self._build_index()
+            self._save_index()
+
+    def __getitem__(self, line):
+        if line < 0:
+            line += len(self)
+        if line < 0 or line >= len(self):
+            raise IndexError('Line index out of range')
+        block = line // self.block_lines
+        with self._lock:
+            lines = self._blocks.get(block)
+            if lines is not None:
+                self._blocks.move_to_end(block)
+        if lines is None:
+            lines = self._read_block(block)
+            with self._lock:
+                self._blocks[block] = lines
+                while len(self._blocks) > self.cache_blocks:
+                    self._blocks.popitem(last=False)
+        return lines[line - block * self.block_lines]
+
+    def search(self, pattern):
+        '''
+        Return the sorted numbers of the lines which
+        match the given regular expression
+        '''
+        regex = re.compile(pattern)
+        return [line for line, text in enumerate(self) if regex.search(text)]
+
+    def _read_block(self, block):
+        '''
+        Decompress and return the lines of the given block,
+        with the stream of the current thread
+        '''
+        first = block * self.block_lines
+        last = min(first + self.block_lines, len(self))
+        start, end = self._offsets[first], self._offsets[last]
+        stream = getattr(self._streams, 'file', None)
+        if stream is None or stream.closed or stream.tell() > start:
+            if stream is not None:
+                stream.close()
+            stream = self._streams.file = self._opener(self.path)
+            with self._lock:
+                self._files = [f for f in self._files if not f.closed]
+                self._files.append(stream)
+        stream.seek(start)
+        data = stream.read(end - start)
+        return [
+            raw.rstrip(b'\r').decode(self.encoding)
+            for raw in data.split(b'\n')[:last - first]
+        ]
+
+    def _build_index(self):
+        '''
+        Decompress the whole file once and return the starting offset
+        of each line, followed by the size of the decompressed data
+        '''
+        offsets = array('Q')
+        size = 0
+        with self._opener(self.path) as f:
+            while True:
+                chunk = f.read(ner_annotator.READ_CHUNK_SIZE)
+                if not chunk:
+                    break
+                if size == 0:
+                    offsets.append(0)
+                pos = chunk.find(b'\n')
+                while pos != -1:
+                    offsets.append(size + pos + 1)
+                    pos = chunk.find(b'\n', pos + 1)
+                size += len(chunk)
+        if len(offsets) > 1 and offsets[-1] == size:
+            offsets.pop()
+        offsets.append(size)
+        return offsets
+
+    def close(self):
+        '''
+        Close the decompression streams of every thread
+        '''
+        with self._lock:
+            for stream in self._files:
+                stream.close()
+            self._files = []
+            self._blocks.clear()
+
+
+class JSONLSource(object):
+    '''
+    View over the given source of JSON lines, which returns
+    the given text field of each JSON object. It has no path, so
+    that indexes of its texts are not persisted next to the file,
+    where they would not depend on the field
+    '''
+
+    def __init__(self, source, field):
+        self.source = source
+        self.field = field
+        self.path = None
+
+    def __len__(self):
+        return len(self.source)
+
+    @property
+    def random_access(self):
+        '''
+        Check if any line can be read without reading the previous ones
+        '''
+        return self.source.random_access
+
+    def __getitem__(self, line):
+        record = json.loads(self.source[line])
+        if not isinstance(record, dict) or self.field not in record:
+            raise Exception(
+                f'Line {line + 1} of {self.source.path} '
+                f'has no "{self.field}" field'
+            )
+        return str(record[self.field])
+
+    def __iter__(self):
+        for line in range(len(self)):
+            yield self[line]
+
+    @property
+    def spec(self):
+        '''
+        Return the arguments of `open_source` which open this source again
+        '''
+        return self.source.path, self.field
+
+    def close(self):
+        '''
+        Close the underlying source
+        '''
+        self.source.close()
+
+
+class ShardedSource(object):
+    '''
+    Concatenation of the given sources (shards), which keeps
+    track of the shard and of the line in the shard of each line
+    '''
+
+    def __init__(self, sources, spec):
+        self.sources = sources
+        self.spec = spec
+        self.path = None
+        self.starts = array('Q', [0])
+        for source in sources:
+            self.starts.append(self.starts[-1] + len(source))
+
+    def __len__(self):
+        return self.starts[-1]
+
+    @property
+    def random_access(self):
+        '''
+        Check if any line of any shard can be read
+        without reading the previous ones
+        '''
+        return all(source.random_access for source in self.sources)
+
+    def locate(self, line):
+        '''
+        Return the index of the shard of the given line
+        and the number of the line in the shard
+        '''
+        if line < 0:
+            line += len(self)
+        if line < 0 or line >= len(self):
+            raise IndexError('Line index out of range')
+        shard = bisect.bisect_right(self.starts, line) - 1
+        return shard, line - self.starts[shard]
+
+    def __getitem__(self, line):
+        shard, shard_line = self.locate(line)
+        return self.sources[shard][shard_line]
+
+    def __iter__(self):
+        for source in self.sources:
+            yield from source
+
+    def provenance(self, line):
+        '''
+        Return the path of the shard of the given line
+        and the number of the line in the shard
+        '''
+        shard, shard_line = self.locate(line)
+        return {'shard': self.sources[shard].spec[0], 'line': shard_line}
+
+    def close(self):
+        '''
+        Close every shard
+        '''
+        for source in self.sources:
+            source.close()
+
+
+def input_format(path):
+    '''
+    Return the format of the given input file and the extension
+    of its compression format (None if it is not compressed)
+    '''
+    base, extension = os.path.splitext(path)
+    if extension in COMPRESSED_OPENERS:
+        return os.path.splitext(base)[1], extension
+    return extension, None
+
+
+def open_file(path, field=None):
+    '''
+    Return a source of lines for the given input file, depending
+    on its extensions: compressed files (.gz, .bz2, .zst) are
+    decompressed in a streaming way, and JSON lines files (.jsonl)
+    return the given text field (`JSONL_TEXT_FIELD` by default)
+    '''
+    extension, compression = input_format(path)
+    if extension not in ner_annotator.VALID_IN_FMT:
+        raise Exception(
+            f'The input file {path} has an invalid extension. '
+            'Please enter files with one of the following formats: '
+            f'{ner_annotator.VALID_IN_FMT}, optionally compressed with one '
+            f'of the following formats: {tuple(COMPRESSED_OPENERS)}'
+        )
+    source = (
+        CompressedLineSource(path) if compression is not None
+        else LineSource(path)
+    )
+    if extension == '.jsonl':
+        return JSONLSource(source, field or ner_annotator.JSONL_TEXT_FIELD)
+    return source
+
+
+def open_source(path, field=None):
+    '''
+    Return a source of lines for the given input path, which can be
+    a file, a directory, a glob pattern or a list of files: the input
+    files found in directories or matching patterns are read in name
+    order, as shards of a single source, and other files (such as indexes
+    and annotation journals) are skipped
+    '''
+    if isinstance(path, (list, tuple)):
+        paths = list(path)
+    elif os.path.isdir(path) or glob.has_magic(path):
+        paths = (
+            [os.path.join(root, name)
+             for root, _, names in os.walk(path) for name in names]
+            if os.path.isdir(path) else glob.glob(path, recursive=True)
+        )
+        paths = sorted(
+            p for p in paths if os.path.isfile(p)
+            and input_format(p)[0] in ner_annotator.VALID_IN_FMT
+            and not p.endswith(ner_annotator.JOURNAL_EXT)
+        )
+    else:
+        if not os.path.isfile(path):
+            raise Exception(
+                'The input path you entered does not exist or is not a file'
+            )
+        paths = [path]
+    if not paths:
+        raise Exception(
+            'The input path you entered does not match any input file'
+        )
+    sources = [open_file(p, field) for p in paths]
+    if len(sources) == 1:
+        return sources[0]
+    return ShardedSource(sources, (tuple(paths), field))
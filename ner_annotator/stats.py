@@ -0,0 +1,282 @@
+'''
+Compute statistics of annotation outputs and validate their spans
+'''
+
+
+import os
+import csv
+import json
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import ner_annotator
+
+
+# Kinds of invalid annotations and spans found in output files
+ISSUES = (
+    'malformed', 'out_of_range', 'overlapping',
+    'text_mismatch', 'content_mismatch'
+)
+
+
+def histogram_percentile(histogram, total, p):
+    '''
+    Return the given percentile of the values counted in the given
+    histogram (a mapping from values to counts), with the given total count
+    '''
+    rank = min(total - 1, int(p / 100 * total))
+    seen = 0
+    for value in sorted(histogram):
+        seen += histogram[value]
+        if seen > rank:
+            return value
+    return None
+
+
+def summarize_lengths(histogram):
+    '''
+    Return the count, mean, percentiles and maximum of
+    the span lengths counted in the given histogram
+    '''
+    total = sum(histogram.values())
+    if total == 0:
+        return dict.fromkeys(('count', 'mean', 'p50', 'p95', 'max'), 0)
+    return {
+        'count': total,
+        'mean': sum(
+            length * count for length, count in histogram.items()
+        ) / total,
+        'p50': histogram_percentile(histogram, total, 50),
+        'p95': histogram_percentile(histogram, total, 95),
+        'max': max(histogram)
+    }
+
+
+class OutputStats(object):
+    '''
+    Counts of annotations, labels, span lengths (as histograms) and
+    issues, which can be computed separately on parts of the output
+    files and then merged. Only the first few examples of each kind
+    of issue are kept, so that memory stays bounded
+    '''
+
+    def __init__(self, max_examples=ner_annotator.STATS_MAX_EXAMPLES):
+        self.max_examples = max_examples
+        self.annotations = 0
+        self.entities = 0
+        self.labels = Counter()
+        self.lengths = {}
+        self.issues = Counter()
+        self.examples = []
+
+    def report(self, path, offset, issue, line=None, entity=None):
+        '''
+        Count an issue of the given kind, keeping it as an example
+        if not enough examples were kept yet
+        '''
+        self.issues[issue] += 1
+        if len(self.examples) < self.max_examples:
+            self.examples.append({
+                'file': path, 'offset': offset, 'issue': issue,
+                'line': line, 'entity': entity
+            })
+
+    def add(self, path, offset, annotation, lines=None):
+        '''
+        Count the given annotation of the given output file, starting at
+        the given offset, checking its spans against its content and,
+        if input lines are given, its content against the input line
+        '''
+        if annotation is None or not isinstance(
+            annotation.get('entities'), list
+        ) or not isinstance(annotation.get('content'), str):
+            self.report(path, offset, 'malformed')
+            return
+        self.annotations += 1
+        content = annotation['content']
+        line = annotation.get('line')
+        if lines is not None and (
+            not isinstance(line, int) or not 0 <= line < len(lines)
+            or lines[line] != content
+        ):
+            self.report(path, offset, 'content_mismatch', line=line)
+        try:
+            entities = sorted(annotation['entities'])
+        except TypeError:
+            entities = sorted(annotation['entities'], key=span_start)
+        covered = 0
+        for entity in entities:
+            if type(entity) is not list or len(entity) < 3:
+                self.report(path, offset, 'malformed', line=line, entity=entity)
+                continue
+            start, end, label = entity[0], entity[1], entity[2]
+            if type(start) is not int or type(end) is not int or (
+                type(label) is not str
+            ):
+                self.report(path, offset, 'malformed', line=line, entity=entity)
+                continue
+            self.entities += 1
+            self.labels[label] += 1
+            if not 0 <= start < end <= len(content):
+                self.report(path, offset, 'out_of_range', line=line, entity=entity)
+                continue
+            lengths = self.lengths.get(label)
+            if lengths is None:
+                lengths = self.lengths[label] = Counter()
+            lengths[end - start] += 1
+            if start < covered:
+                self.report(path, offset, 'overlapping', line=line, entity=entity)
+            if end > covered:
+                covered = end
+            if len(entity) > 3 and entity[3] != content[start:end]:
+                self.report(path, offset, 'text_mismatch', line=line, entity=entity)
+
+    def merge(self, other):
+        '''
+        Add the counts of the given statistics to these ones
+        '''
+        self.annotations += other.annotations
+        self.entities += other.entities
+        self.labels.update(other.labels)
+        for label, histogram in other.lengths.items():
+            self.lengths.setdefault(label, Counter()).update(histogram)
+        self.issues.update(other.issues)
+        self.examples.extend(
+            other.examples[:self.max_examples - len(self.examples)]
+        )
+
+    def summary(self):
+        '''
+        Return a JSON-serializable summary of the statistics
+        '''
+        lengths = Counter()
+        for histogram in self.lengths.values():
+            lengths.update(histogram)
+        return {
+            'annotations': self.annotations,
+            'entities': self.entities,
+            'lengths': dict(summarize_lengths(lengths), count=self.entities),
+            'labels': {
+                label: dict(
+                    summarize_lengths(self.lengths.get(label, {})), count=count
+                )
+                for label, count in self.labels.most_common()
+            },
+            'issues': {issue: self.issues[issue] for issue in ISSUES},
+            'examples': self.examples
+        }
+
+
+def span_start(entity):
+    '''
+    Return the start of the given entity, for sorting
+    (malformed entities come first)
+    '''
+    if isinstance(entity, list) and entity and isinstance(entity[0], int):
+        return entity[0]
+    return -1
+
+
+def range_stats(path, start, end, spec=None,
+                max_examples=ner_annotator.STATS_MAX_EXAMPLES):
+    '''
+    Return the statistics of the annotations starting in the given range
+    of bytes of the given output file, checking their content against
+    the input source opened with the given arguments of `open_source`
+    (if any), in a worker process
+    '''
+    lines = ner_annotator.open_source(*spec) if spec is not None else None
+    stats = OutputStats(max_examples)
+    try:
+        for offset, annotation in ner_annotator.iter_output_range(
+            path, start, end
+        ):
+            stats.add(path, offset, annotation, lines)
+    finally:
+        if lines is not None:
+            lines.close()
+    return stats
+
+
+def output_stats(paths, input_path=None, field=None, processes=None,
+                 chunk_size=ner_annotator.STATS_CHUNK_SIZE,
+                 max_examples=ner_annotator.STATS_MAX_EXAMPLES):
+    '''
+    Compute the statistics of the given output files, split into ranges
+    of the given number of bytes which are streamed by a pool of worker
+    processes, and return their summary. If an input path is given,
+    the content of each annotation is also compared to its input line
+    '''
+    spec = None
+    if input_path is not None:
+        lines = ner_annotator.open_source(input_path, field=field)
+        spec = lines.spec
+        lines.close()
+    ranges = [
+        (path, start, min(start + chunk_size, size))
+        for path, size in ((path, os.path.getsize(path)) for path in paths)
+        for start in range(0, max(size, 1), chunk_size)
+    ]
+    stats = OutputStats(max_examples)
+    processes = min(processes or os.cpu_count() or 1, len(ranges))
+    if processes <= 1:
+        for path, start, end in ranges:
+            stats.merge(range_stats(path, start, end, spec, max_examples))
+    else:
+        with ProcessPoolExecutor(processes) as pool:
+            futures = [
+                pool.submit(range_stats, path, start, end, spec, max_examples)
+                for path, start, end in ranges
+            ]
+            for future in futures:
+                stats.merge(future.result())
+    return {'files': list(paths), **stats.summary()}
+
+
+def format_stats(summary):
+    '''
+    Return a human-readable report of the given summary
+    '''
+    rows = [
+        f'Files: {", ".join(summary["files"])}',
+        f'Annotations: {summary["annotations"]}',
+        f'Entities: {summary["entities"]}',
+        '',
+        f'{"Label":<20} {"Count":>10} {"Mean":>8} {"p50":>6} {"p95":>6} {"Max":>6}'
+    ]
+    for label, lengths in [('(all)', summary['lengths'])] + list(
+        summary['labels'].items()
+    ):
+        if label == '(all)' and lengths['count'] == 0:
+            continue
+        rows.append(
+            f'{str(label):<20} {lengths["count"]:>10} {lengths["mean"]:>8.2f} '
+            f'{lengths["p50"]:>6} {lengths["p95"]:>6} {lengths["max"]:>6}'
+        )
+    rows.append('')
+    for issue, count in summary['issues'].items():
+        rows.append(f'{issue.replace("_", " ").capitalize()}: {count}')
+    for example in summary['examples']:
+        rows.append(
+            f'  {example["issue"]}: {example["file"]} at byte '
+            f'{example["offset"]}, line {example["line"]}, '
+            f'entity {example["entity"]}'
+        )
+    return '\n'.join(rows)
+
+
+def dump_stats(summary, path):
+    '''
+    Save the given summary to the given file, as a CSV table
+    of labels if its extension is .csv and as JSON otherwise
+    '''
+    if path.endswith('.csv'):
+        with open(path, 'w', newline='') as f:
+            fields = ['label', 'count', 'mean', 'p50', 'p95', 'max']
+            writer = csv.DictWriter(f, fieldnames=fields)
+            writer.writeheader()
+            for label, lengths in summary['labels'].items():
+                writer.writerow({'label': label, **lengths})
+    else:
+        with open(path, 'w') as f:
+            json.dump(summary, f, indent=4)
@@ -0,0 +1,129 @@
+'''
+Define the in-memory storage of annotations
+'''
+
+
+class AnnotationStore(object):
+    '''
+    Annotations indexed by their line number in the input file,
+    with a secondary index on entity labels, so that lookups,
+    insertions and deletions take constant time.
+    Lines changed since the latest save are tracked as well
+    '''
+
+    def __init__(self):
+        self._by_line = {}
+        self._by_label = {}
+        self._dirty = set()
+
+    def __len__(self):
+        return len(self._by_line)
+
+    def __contains__(self, line):
+        return line in self._by_line
+
+    def __iter__(self):
+        '''
+        Iterate over annotated line numbers, in file order
+        '''
+        return iter(sorted(self._by_line))
+
+    def get(self, line):
+        '''
+        Return the annotation of the given line,
+        or None if the line is not annotated
+        '''
+        return self._by_line.get(line)
+
+    def set(self, line, content, entities):
+        '''
+        Store the given entities for the given line,
+        replacing previous ones (if any)
+        '''
+        self._remove(line)
+        self._by_line[line] = {
+            'line': line, 'content': content, 'entities': entities
+        }
+        for label in {entity[2] for entity in entities}:
+            self._by_label.setdefault(label, set()).add(line)
+        self._dirty.add(line)
+
+    def delete(self, line):
+        '''
+        Remove the annotation of the given line (if any)
+        '''
+        annotation = self._remove(line)
+        if annotation is not None:
+            self._dirty.add(line)
+        return annotation
+
+    def _remove(self, line):
+        '''
+        Remove the annotation of the given line (if any) from
+        the indexes, without tracking the change
+        '''
+        annotation = self._by_line.pop(line, None)
+        if annotation is not None:
+            for label in {entity[2] for entity in annotation['entities']}:
+                lines = self._by_label[label]
+                lines.discard(line)
+                if not lines:
+                    del self._by_label[label]
+        return annotation
+
+    def is_dirty(self):
+        '''
+        Check if some lines changed since the latest save
+        '''
+        return bool(self._dirty)
+
+    def mark_saved(self):
+        '''
+        Forget about changed lines and return them
+        '''
+        dirty, self._dirty = self._dirty, set()
+        return dirty
+
+    def mark_dirty(self, lines):
+        '''
+        Consider the given lines as changed since the latest save
+        '''
+        self._dirty.update(lines)
+
+    def lines_with_label(self, label):
+        '''
+        Return the set of annotated line numbers
+        with at least one entity of the given label
+        '''
+        return set(self._by_label.get(label, ()))
+
+    def first_unannotated(self, start=0):
+        '''
+        Return the first line number, greater than or
+        equal to the given one, which is not annotated
+        '''
+        line = start
+        while line in self._by_line:
+            line += 1
+        return line
+
+    def items(self):
+        '''
+        Return (line number, annotation) pairs, sorted by line number
+        '''
+        return [(line, self._by_line[line]) for line in self]
+
+    def snapshot(self):
+        '''
+        Return a copy of the mapping from line numbers to annotations,
+        which later changes to the store do not affect, so that
+        it can be read from other threads
+        '''
+        return dict(self._by_line)
+
+    def to_list(self):
+        '''
+        Return annotations as a list of JSON-serializable dictionaries,
+        sorted by line number
+        '''
+        return [self._by_line[line] for line in self]
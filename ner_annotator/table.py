@@ -0,0 +1,177 @@
+'''
+Define the model behind the output table
+'''
+
+
+import hashlib
+from array import array
+
+from PyQt5.QtCore import Qt, QAbstractTableModel, QModelIndex, QVariant
+from PyQt5.QtGui import QColor
+
+import ner_annotator
+
+
+def label_color(label, alpha=80):
+    '''
+    Return a color which is stable across sessions for the given label
+    '''
+    digest = hashlib.md5(label.encode('utf-8')).digest()
+    return QColor(digest[0], digest[1], digest[2], alpha)
+
+
+class SpanTableModel(QAbstractTableModel):
+    '''
+    Table model over the entity spans of the current line, stored
+    as compact arrays of start and end offsets and of label ids
+    '''
+
+    def __init__(self, columns, parent=None):
+        QAbstractTableModel.__init__(self, parent)
+        self.columns = columns
+        self.text = ''
+        self.starts = array('i')
+        self.ends = array('i')
+        self.label_ids = array('H')
+        self.labels = []
+        self.label_colors = []
+        self.label_index = {}
+
+    def label_id(self, label):
+        '''
+        Return the id of the given label, assigning a new one if needed
+        '''
+        if label not in self.label_index:
+            self.label_index[label] = len(self.labels)
+            self.labels.append(label)
+            self.label_colors.append(label_color(label))
+        return self.label_index[label]
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.starts)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.columns)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.columns[section]
+        return QAbstractTableModel.headerData(self, section, orientation, role)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return QVariant()
+        row, column = index.row(), self.columns[index.column()]
+        if role in (Qt.DisplayRole, Qt.EditRole):
+            start, end = self.starts[row], self.ends[row]
+            if column == ner_annotator.ENTITY_LABEL:
+                return self.labels[self.label_ids[row]]
+            if column == ner_annotator.VALUE_LABEL:
+                return self.text[start:end]
+            if column == ner_annotator.SELECTION_START_LABEL:
+                return str(start)
+            if column == ner_annotator.SELECTION_END_LABEL:
+                return str(end)
+        elif role == Qt.BackgroundRole:
+            return self.color(row)
+        return QVariant()
+
+    def flags(self, index):
+        flags = QAbstractTableModel.flags(self, index)
+        if self.columns[index.column()] != ner_annotator.VALUE_LABEL:
+            flags |= Qt.ItemIsEditable
+        return flags
+
+    def setData(self, index, value, role=Qt.EditRole):
+        if not index.isValid() or role != Qt.EditRole:
+            return False
+        row, column = index.row(), self.columns[index.column()]
+        if column == ner_annotator.ENTITY_LABEL and value:
+            self.label_ids[row] = self.label_id(value)
+        elif column in (
+            ner_annotator.SELECTION_START_LABEL,
+            ner_annotator.SELECTION_END_LABEL
+        ) and str(value).isdigit() and int(value) <= len(self.text):
+            if column == ner_annotator.SELECTION_START_LABEL:
+                self.starts[row] = int(value)
+            else:
+                self.ends[row] = int(value)
+        else:
+            return False
+        self.dataChanged.emit(
+            self.index(row, 0), self.index(row, len(self.columns) - 1)
+        )
+        return True
+
+    def set_spans(self, text, entities):
+        '''
+        Replace the shown spans with the given entities of the given text,
+        each one in the [start, end, label] format
+        '''
+        self.beginResetModel()
+        self.text = text
+        self.starts = array('i', (ent[0] for ent in entities))
+        self.ends = array('i', (ent[1] for ent in entities))
+        self.label_ids = array('H', (self.label_id(ent[2]) for ent in entities))
+        self.endResetModel()
+
+    def add_span(self, label, start, end):
+        '''
+        Append the given span
+        '''
+        row = len(self.starts)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self.starts.append(start)
+        self.ends.append(end)
+        self.label_ids.append(self.label_id(label))
+        self.endInsertRows()
+        return row
+
+    def add_spans(self, entities):
+        '''
+        Append the given entities, each one in the [start, end, label]
+        format, with a single insertion of rows
+        '''
+        if not entities:
+            return
+        row = len(self.starts)
+        self.beginInsertRows(QModelIndex(), row, row + len(entities) - 1)
+        self.starts.extend(ent[0] for ent in entities)
+        self.ends.extend(ent[1] for ent in entities)
+        self.label_ids.extend(self.label_id(ent[2]) for ent in entities)
+        self.endInsertRows()
+
+    def remove_span(self, row):
+        '''
+        Remove the span at the given row
+        '''
+        self.beginRemoveRows(QModelIndex(), row, row)
+        del self.starts[row]
+        del self.ends[row]
+        del self.label_ids[row]
+        self.endRemoveRows()
+
+    def color(self, row):
+        '''
+        Return the color of the label of the span at the given row
+        '''
+        return self.label_colors[self.label_ids[row]]
+
+    def span(self, row):
+        '''
+        Return the span at the given row, in the [start, end, label] format
+        '''
+        return [
+            self.starts[row], self.ends[row],
+            self.labels[self.label_ids[row]]
+        ]
+
+    def spans(self):
+        '''
+        Return a snapshot of all the valid spans,
+        in the [start, end, label] format
+        '''
+        return [
+            self.span(row) for row in range(len(self.starts))
+            if self.ends[row] > self.starts[row]
+        ]
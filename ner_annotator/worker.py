@@ -0,0 +1,245 @@
+'''
+Define background workers used by the main window
+'''
+
+
+import math
+import time
+import sqlite3
+import threading
+import multiprocessing
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+
+from PyQt5.QtCore import QObject, pyqtSignal
+
+import ner_annotator
+
+
+class ModelLoader(QObject):
+    '''
+    Load a NER model on a background thread
+    '''
+
+    # Emitted (from the loader thread) with the loaded model
+    loaded = pyqtSignal(object)
+
+    # Emitted (from the loader thread) with the raised exception
+    failed = pyqtSignal(object)
+
+    def __init__(self, model_path, parent=None):
+        QObject.__init__(self, parent)
+        self.model_path = model_path
+        self.thread = None
+
+    def start(self):
+        '''
+        Start loading the model, or loading it again
+        if it was loaded already
+        '''
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        try:
+            model = ner_annotator.load_model(self.model_path)
+        except Exception as err:
+            self.failed.emit(err)
+            return
+        self.loaded.emit(model)
+
+
+class ClassificationWorker(QObject):
+    '''
+    Classify lines with the given model on a background thread,
+    speculatively prefetching the lines which follow the current one
+    and keeping results in a bounded LRU cache. If a persistent
+    prediction cache is given, it is checked before running the model,
+    and if a profiler is given, model inference is timed
+    '''
+
+    # Emitted (from the worker thread) with the line number
+    # and the retrieved entities, each time a line is classified
+    classified = pyqtSignal(int, object)
+
+    # Emitted (from the worker thread) with the line number
+    # and the raised exception, each time a line cannot be classified
+    failed = pyqtSignal(int, object)
+
+    # Emitted (from the worker thread) with the raised exception
+    # when the prediction cache fails, after which it is not used anymore
+    cache_failed = pyqtSignal(object)
+
+    def __init__(self, model, lines, ahead, cache_size,
+                 prediction_cache=None, profiler=None, parent=None):
+        QObject.__init__(self, parent)
+        self.model = model
+        self.prediction_cache = prediction_cache
+        self.profiler = profiler
+        self.lines = lines
+        self.ahead = ahead
+        self.cache_size = max(cache_size, ahead + 1)
+        self.cache = OrderedDict()
+        self.queue = deque()
+        self.condition = threading.Condition()
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def get(self, line):
+        '''
+        Return the cached entities of the given line,
+        or None if the line was not classified yet
+        '''
+        with self.condition:
+            entities = self.cache.get(line)
+            if entities is not None:
+                self.cache.move_to_end(line)
+            return entities
+
+    def prefetch(self, line):
+        '''
+        Classify the given line first and the following ones next,
+        cancelling every other pending line
+        '''
+        with self.condition:
+            window = range(line, min(line + self.ahead + 1, len(self.lines)))
+            self.queue = deque(l for l in window if l not in self.cache)
+            self.condition.notify()
+
+    def stop(self):
+        '''
+        Stop the worker thread, after the current classification
+        (if any) is completed
+        '''
+        with self.condition:
+            self.running = False
+            self.queue.clear()
+            self.condition.notify()
+
+    def _classify(self, text):
+        '''
+        Return the entities of the given text, either from the
+        persistent prediction cache or by running the model.
+        If the prediction cache fails, the model is used directly
+        from then on
+        '''
+        try:
+            if self.prediction_cache is not None:
+                entities = self.prediction_cache.get(text)
+                if entities is not None:
+                    return entities
+        except (sqlite3.Error, OSError, ValueError) as err:
+            self._disable_cache(err)
+        start = time.perf_counter()
+        entities = self.model.classify(text)
+        if self.profiler is not None:
+            self.profiler.add('inference', time.perf_counter() - start)
+        try:
+            if self.prediction_cache is not None:
+                self.prediction_cache.put(text, entities)
+        except (sqlite3.Error, OSError) as err:
+            self._disable_cache(err)
+        return entities
+
+    def _disable_cache(self, error):
+        '''
+        Stop using the prediction cache, after the given error
+        '''
+        self.prediction_cache = None
+        self.cache_failed.emit(error)
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while self.running and not self.queue:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                line = self.queue.popleft()
+                if line in self.cache:
+                    continue
+            try:
+                entities = self._classify(self.lines[line])
+            except Exception as err:
+                self.failed.emit(line, err)
+                continue
+            with self.condition:
+                self.cache[line] = entities
+                while len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+            self.classified.emit(line, entities)
+
+
+class RankingWorker(QObject):
+    '''
+    Score the uncertainty of the given model on every line, with a pool
+    of worker processes driven from a background thread. Lines are
+    scored in chunks, starting from the given line and wrapping around,
+    with a bounded number of chunks in flight. Scores are tagged
+    with the given generation, so that the scores of a stopped
+    worker can be told apart from those of the one replacing it
+    '''
+
+    # Emitted (from the worker thread) with the generation of scores,
+    # the first line of a scored chunk and the scores of its lines
+    scored = pyqtSignal(int, int, object)
+
+    # Emitted (from the worker thread) with the raised exception
+    failed = pyqtSignal(object)
+
+    def __init__(self, model_path, lines, start, chunk_size,
+                 processes, generation=0, parent=None):
+        QObject.__init__(self, parent)
+        self.model_path = model_path
+        self.generation = generation
+        self.lines = lines
+        self.start_line = start
+        self.chunk_size = chunk_size
+        self.processes = processes
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        '''
+        Start scoring lines
+        '''
+        self.thread.start()
+
+    def stop(self):
+        '''
+        Stop scoring lines, after the chunks in flight are completed
+        '''
+        self.running = False
+
+    def _run(self):
+        total = len(self.lines)
+        first_chunk = self.start_line // self.chunk_size
+        chunks = math.ceil(total / self.chunk_size)
+        firsts = deque(
+            ((first_chunk + i) % chunks) * self.chunk_size
+            for i in range(chunks)
+        )
+        try:
+            with ProcessPoolExecutor(
+                self.processes, initializer=ner_annotator.init_scorer,
+                initargs=(self.model_path,),
+                mp_context=multiprocessing.get_context('spawn')
+            ) as pool:
+                pending = deque()
+                while self.running and (firsts or pending):
+                    while firsts and len(pending) < 2 * self.processes:
+                        first = firsts.popleft()
+                        texts = [
+                            self.lines[line] for line in
+                            range(first, min(first + self.chunk_size, total))
+                        ]
+                        pending.append(
+                            (first, pool.submit(ner_annotator.score_lines, texts))
+                        )
+                    first, future = pending.popleft()
+                    self.scored.emit(
+                        self.generation, first, future.result()
+                    )
+        except Exception as err:
+            self.failed.emit(err)
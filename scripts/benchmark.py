@@ -0,0 +1,260 @@
+'''
+Benchmark the latency of annotator actions on synthetic corpora,
+driving the GUI offscreen, and print the results as JSON
+'''
+
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import statistics
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PyQt5.QtWidgets import QApplication
+
+import ner_annotator
+import ner_annotator.annotator
+from ner_annotator.model import NERModel
+
+
+# Words used to build synthetic lines and the ones tagged as entities
+WORDS = [
+    'the', 'of', 'and', 'to', 'in', 'report', 'market', 'said',
+    'company', 'year', 'new', 'first', 'city', 'government', 'people'
+]
+ENTITIES = {'Acme': 'ORG', 'Globex': 'ORG', 'Rome': 'LOC', 'Alice': 'PER'}
+
+# File which marks a directory as a benchmark model
+MODEL_MARKER = 'benchmark-model'
+
+
+class BenchmarkModel(NERModel):
+    '''
+    Model which tags the known entity words, standing in for real models
+    '''
+
+    @classmethod
+    def _detect(cls, model_path):
+        return os.path.isfile(os.path.join(model_path, MODEL_MARKER))
+
+    @classmethod
+    def _load_model(cls, model_path):
+        return ENTITIES
+
+    def classify(self, text):
+        entities, start = [], 0
+        for word in text.split(' '):
+            if word in self.model:
+                entities.append({
+                    'label': self.model[word],
+                    'start': start,
+                    'end': start + len(word),
+                    'text': word
+                })
+            start += len(word) + 1
+        return entities
+
+
+def synthetic_line(rng, length, density):
+    '''
+    Return a line with the given number of words, where each word
+    is an entity with the given probability
+    '''
+    return ' '.join(
+        rng.choice(list(ENTITIES)) if rng.random() < density
+        else rng.choice(WORDS) for _ in range(length)
+    )
+
+
+def build_corpus(directory, args):
+    '''
+    Write the synthetic input file, a previous output file annotating
+    a fraction of its lines and the benchmark model, and return their paths
+    '''
+    rng = random.Random(args.seed)
+    model = BenchmarkModel.__new__(BenchmarkModel)
+    model.model = ENTITIES
+    input_path = os.path.join(directory, 'input.txt')
+    output_path = os.path.join(directory, 'output.json')
+    annotations = []
+    with open(input_path, 'w') as f:
+        for line in range(args.lines):
+            content = synthetic_line(rng, args.words, args.density)
+            f.write(content + '\n')
+            if rng.random() < args.annotated:
+                entities = [
+                    [ent['start'], ent['end'], ent['label']]
+                    for ent in model.classify(content)
+                ]
+                if entities:
+                    annotations.append({
+                        'line': line, 'content': content, 'entities': entities
+                    })
+    with open(output_path, 'w') as f:
+        json.dump(annotations, f)
+    model_path = os.path.join(directory, 'model')
+    os.makedirs(model_path)
+    open(os.path.join(model_path, MODEL_MARKER), 'w').close()
+    return input_path, output_path, model_path
+
+
+def summary(timings):
+    '''
+    Return latency statistics (in milliseconds) of the given timings
+    '''
+    timings = sorted(t * 1000 for t in timings)
+
+    def percentile(p):
+        return timings[min(len(timings) - 1, int(p / 100 * len(timings)))]
+
+    return {
+        'count': len(timings),
+        'min': timings[0],
+        'mean': statistics.mean(timings),
+        'p50': percentile(50),
+        'p95': percentile(95),
+        'p99': percentile(99),
+        'max': timings[-1]
+    }
+
+
+def timed(function, *args):
+    '''
+    Call the given function and return the elapsed time
+    '''
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+def wait_for(app, condition, timeout=30):
+    '''
+    Process Qt events until the given condition holds
+    '''
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise Exception('Timed out while waiting for the annotator')
+        app.processEvents()
+
+
+def run(app, args, directory):
+    '''
+    Drive the annotator and return the timings of each action
+    '''
+    rng = random.Random(args.seed)
+    input_path, output_path, model_path = build_corpus(directory, args)
+
+    timings = {}
+    start = time.perf_counter()
+    window = ner_annotator.NERAnnotator(
+        ner_annotator.LineSource(input_path), output_path,
+        sorted(set(ENTITIES.values())), model_path=model_path,
+        cache_predictions=False
+    )
+    window.show()
+    app.processEvents()
+    timings['startup'] = [time.perf_counter() - start]
+    wait_for(app, lambda: window.model is not None)
+
+    steps = min(args.steps, args.lines - 1)
+    timings['next'] = [timed(window.next) for _ in range(steps)]
+    timings['prev'] = [timed(window.prev) for _ in range(steps)]
+    timings['record'] = [timed(window.record) for _ in range(steps)]
+    timings['lookup'] = [
+        timed(window.annotations.get, rng.randrange(args.lines))
+        for _ in range(steps)
+    ]
+
+    timings['classify'] = []
+    for _ in range(steps):
+        window.next()
+        app.processEvents()
+        start = time.perf_counter()
+        window.classify()
+        wait_for(app, lambda: window.pending_classification is None)
+        timings['classify'].append(time.perf_counter() - start)
+
+    timings['save'] = []
+    for _ in range(args.saves):
+        window.show_line(rng.randrange(args.lines))
+        window.add_entity('ORG', 0, 1)
+        window.record()
+        start = time.perf_counter()
+        window.save()
+        window.journal.wait()
+        timings['save'].append(time.perf_counter() - start)
+
+    window.journal.close()
+    window.classifier.stop()
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the annotator on synthetic corpora'
+    )
+    parser.add_argument(
+        '-l', '--lines', dest='lines', action='store', type=int,
+        default=100000, help='number of lines of the corpus'
+    )
+    parser.add_argument(
+        '-w', '--words', dest='words', action='store', type=int,
+        default=30, help='number of words per line'
+    )
+    parser.add_argument(
+        '-d', '--density', dest='density', action='store', type=float,
+        default=0.1, help='probability of each word being an entity'
+    )
+    parser.add_argument(
+        '-a', '--annotated', dest='annotated', action='store', type=float,
+        default=0.5, help='fraction of lines already annotated'
+    )
+    parser.add_argument(
+        '-s', '--steps', dest='steps', action='store', type=int,
+        default=500, help='number of measurements of each action'
+    )
+    parser.add_argument(
+        '--saves', dest='saves', action='store', type=int,
+        default=10, help='number of measurements of saves'
+    )
+    parser.add_argument(
+        '--seed', dest='seed', action='store', type=int,
+        default=0, help='seed of the synthetic corpus'
+    )
+    parser.add_argument(
+        '-o', '--output', dest='output', action='store',
+        type=str, help='path to the JSON results (defaults to stdout)'
+    )
+    args = parser.parse_args()
+
+    # Dialogs would block the benchmark
+    ner_annotator.annotator.show_dialog = lambda *args, **kwargs: None
+
+    app = QApplication(sys.argv[:1])
+    with tempfile.TemporaryDirectory() as directory:
+        timings = run(app, args, directory)
+
+    results = {
+        'version': ner_annotator.__version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': vars(args),
+        'results': {name: summary(values) for name, values in timings.items()}
+    }
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
+    else:
+        print(json.dumps(results, indent=4))
+
+
+if __name__ == '__main__':
+    main()
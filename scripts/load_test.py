@@ -0,0 +1,267 @@
+'''
+Load test the multi-annotator server with many simulated clients,
+which lease lines and submit annotations concurrently, check that
+no line is handed out twice and print request latencies as JSON.
+Some clients go through `ServerClient`, like the annotation window:
+they skip some lines and spend long enough on their first line
+to renew their leases
+'''
+
+
+import os
+import sys
+import json
+import time
+import random
+import socket
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ner_annotator
+
+
+# Name of the simulated corpus
+CORPUS = 'load-test'
+
+
+def free_port():
+    '''
+    Return a free local port
+    '''
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(db_path, port, lease_time, env):
+    '''
+    Run the server in a separate process and wait until it accepts connections
+    '''
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'ner_annotator', 'serve',
+         '--db', db_path, '--port', str(port),
+         '--lease-time', str(lease_time)],
+        env=env, stdout=subprocess.DEVNULL
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.05)
+    process.kill()
+    raise Exception('The server did not start')
+
+
+def simulate(server, annotator, args, profiler, leased, errors):
+    '''
+    Lease and annotate lines until none is left
+    '''
+    try:
+        while True:
+            start = time.perf_counter()
+            result = server.request('POST', '/lease', {
+                'corpus': CORPUS, 'lines': args.lines,
+                'annotator': annotator, 'count': args.batch
+            })
+            profiler.add('lease', time.perf_counter() - start)
+            if not result['lines']:
+                return
+            leased.extend(result['lines'])
+            time.sleep(args.think)
+            annotations = [
+                {'line': line, 'content': f'Line {line}',
+                 'entities': [[0, 4, 'ORG']]}
+                for line in result['lines']
+            ]
+            start = time.perf_counter()
+            result = server.request('POST', '/annotations', {
+                'corpus': CORPUS, 'annotator': annotator,
+                'annotations': annotations
+            })
+            profiler.add('submit', time.perf_counter() - start)
+            if result['rejected']:
+                errors.append(f'{annotator}: rejected {result["rejected"]}')
+    except Exception as err:
+        errors.append(f'{annotator}: {err}')
+    finally:
+        server.close()
+
+
+def simulate_client(url, annotator, args, profiler, leased, skipped, errors):
+    '''
+    Annotate lines through a `ServerClient` until none is left,
+    skipping some of them and renewing leases on the first one
+    '''
+    ready = threading.Event()
+    renewals = []
+
+    class RenewingClient(ner_annotator.ServerClient):
+        def renew(self):
+            renewals.append(time.perf_counter())
+            super(RenewingClient, self).renew()
+
+    client = RenewingClient(
+        url, CORPUS, args.lines, annotator, args.batch,
+        args.lease_time / 3, args.batch, callback=ready.set
+    )
+    try:
+        while True:
+            ready.clear()
+            start = time.perf_counter()
+            line = client.next_line()
+            if line is None:
+                if not ready.wait(60):
+                    raise Exception('no line was leased in time')
+                if client.error is not None:
+                    raise client.error
+                line = client.next_line(request=False)
+                if line is None:
+                    if client.exhausted:
+                        break
+                    continue
+            profiler.add('next_line', time.perf_counter() - start)
+            leased.append(line)
+            time.sleep(args.lease_time if len(leased) == 1 else args.think)
+            if random.random() < args.skip:
+                skipped.append(line)
+                client.skip(line)
+            else:
+                client.submit(line, f'Line {line}', [[0, 4, 'ORG']])
+        if client.rejected:
+            errors.append(f'{annotator}: rejected {client.rejected}')
+        if not renewals:
+            errors.append(f'{annotator}: leases were never renewed')
+    except Exception as err:
+        errors.append(f'{annotator}: {err}')
+    finally:
+        client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Load test the multi-annotator server'
+    )
+    parser.add_argument(
+        '-c', '--clients', dest='clients', action='store', type=int,
+        default=50, help='number of simulated clients'
+    )
+    parser.add_argument(
+        '-l', '--lines', dest='lines', action='store', type=int,
+        default=20000, help='number of lines of the corpus'
+    )
+    parser.add_argument(
+        '-b', '--batch', dest='batch', action='store', type=int,
+        default=10, help='number of lines leased and submitted at once'
+    )
+    parser.add_argument(
+        '-t', '--think', dest='think', action='store', type=float,
+        default=0.01, help='seconds spent annotating each batch'
+    )
+    parser.add_argument(
+        '-w', '--window-clients', dest='window_clients', action='store',
+        type=int, default=5,
+        help='number of simulated clients going through ServerClient'
+    )
+    parser.add_argument(
+        '-s', '--skip', dest='skip', action='store', type=float,
+        default=0.1, help='probability that ServerClient clients skip a line'
+    )
+    parser.add_argument(
+        '--lease-time', dest='lease_time', action='store', type=float,
+        default=3, help='seconds after which leases expire'
+    )
+    parser.add_argument(
+        '-o', '--output', dest='output', action='store',
+        type=str, help='path to the JSON results (defaults to stdout)'
+    )
+    args = parser.parse_args()
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        filter(None, [root, env.get('PYTHONPATH')])
+    )
+    port = free_port()
+    url = f'http://127.0.0.1:{port}'
+    profiler = ner_annotator.Profiler(None)
+    errors = []
+    with tempfile.TemporaryDirectory() as directory:
+        server = start_server(
+            os.path.join(directory, 'db.sqlite'), port, args.lease_time, env
+        )
+        try:
+            leased = [[] for _ in range(args.clients + args.window_clients)]
+            skipped = [[] for _ in range(args.window_clients)]
+            threads = [
+                threading.Thread(
+                    target=simulate,
+                    args=(ner_annotator.ServerConnection(url), f'client-{i}',
+                          args, profiler, leased[i], errors)
+                )
+                for i in range(args.clients)
+            ] + [
+                threading.Thread(
+                    target=simulate_client,
+                    args=(url, f'window-{i}', args, profiler,
+                          leased[args.clients + i], skipped[i], errors)
+                )
+                for i in range(args.window_clients)
+            ]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+            stats = ner_annotator.ServerConnection(url).request(
+                'GET', '/stats', query={'corpus': CORPUS}
+            )
+        finally:
+            server.terminate()
+            server.wait()
+
+    all_skipped = {line for lines in skipped for line in lines}
+    all_leased = [
+        line for lines in leased for line in lines if line not in all_skipped
+    ]
+    if len(all_leased) != len(set(all_leased)):
+        errors.append('some lines were leased to several clients')
+    # Skipped lines leased again to the client which skipped them,
+    # which only happens once no other line is left
+    returned = sum(
+        len(set(lines) & set(leased[args.clients + i][
+            leased[args.clients + i].index(lines[0]) + 1:
+        ])) if lines else 0
+        for i, lines in enumerate(skipped)
+    )
+    if stats['done'] != args.lines:
+        errors.append(f'{stats["done"]}/{args.lines} lines were annotated')
+    results = {
+        'version': ner_annotator.__version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': vars(args),
+        'elapsed': elapsed,
+        'lines_per_second': args.lines / elapsed,
+        'skipped': sum(map(len, skipped)),
+        'skipped_returned': returned,
+        'results': profiler.summary(),
+        'errors': errors
+    }
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
+    else:
+        print(json.dumps(results, indent=4))
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+'''
+Measure the startup time of the annotator and check it against a budget:
+exits with a non-zero status if the budget is exceeded, so that
+it can be used as a regression check
+'''
+
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import subprocess
+import statistics
+
+
+# Budgets (in seconds)
+HELP_BUDGET = 0.5
+WINDOW_BUDGET = 2.0
+
+# Open the annotator window and print the time elapsed
+# since the given timestamp, once the window is shown
+WINDOW_SCRIPT = '''
+import sys
+import time
+
+import ner_annotator
+from PyQt5.QtWidgets import QApplication
+
+start = float(sys.argv[1])
+app = QApplication(sys.argv[:1])
+window = ner_annotator.NERAnnotator(
+    ner_annotator.LineSource(sys.argv[2]), sys.argv[3], ['Entity', 'Other']
+)
+window.show()
+app.processEvents()
+print(time.time() - start)
+'''
+
+
+def time_help(env):
+    '''
+    Return the time needed to print the CLI help
+    '''
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable, '-m', 'ner_annotator', '--help'],
+        env=env, check=True, stdout=subprocess.DEVNULL
+    )
+    return time.perf_counter() - start
+
+
+def time_window(env, directory):
+    '''
+    Return the time needed to show the annotator window
+    '''
+    input_path = os.path.join(directory, 'input.txt')
+    output_path = os.path.join(directory, 'output.json')
+    with open(input_path, 'w') as f:
+        f.write('\n'.join(f'Line number {i}' for i in range(1000)))
+    result = subprocess.run(
+        [sys.executable, '-c', WINDOW_SCRIPT,
+         str(time.time()), input_path, output_path],
+        env=env, check=True, stdout=subprocess.PIPE, universal_newlines=True
+    )
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Measure the startup time of the annotator'
+    )
+    parser.add_argument(
+        '-r', '--runs', dest='runs', action='store', type=int, default=5,
+        help='number of measurements (the median is reported)'
+    )
+    parser.add_argument(
+        '--help-budget', dest='help_budget', action='store', type=float,
+        default=HELP_BUDGET, help='budget for printing the CLI help'
+    )
+    parser.add_argument(
+        '--window-budget', dest='window_budget', action='store', type=float,
+        default=WINDOW_BUDGET, help='budget for showing the window'
+    )
+    args = parser.parse_args()
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        filter(None, [root, env.get('PYTHONPATH')])
+    )
+    env.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+    with tempfile.TemporaryDirectory() as directory:
+        results = {
+            'help': (
+                statistics.median(time_help(env) for _ in range(args.runs)),
+                args.help_budget
+            ),
+            'window': (
+                statistics.median(
+                    time_window(env, directory) for _ in range(args.runs)
+                ),
+                args.window_budget
+            )
+        }
+
+    failed = False
+    for name, (elapsed, budget) in results.items():
+        status = 'ok' if elapsed <= budget else 'over budget'
+        failed = failed or elapsed > budget
+        print(f'{name}: {elapsed:.3f}s (budget {budget:.3f}s) {status}')
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
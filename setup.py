@@ -44,7 +44,7 @@ setup(
             'ner_annotator = ner_annotator.__main__:main'
         ]
     },
-    python_requires='>=3.6',
+    python_requires='>=3.7',
     install_requires=install_requires,
     extras_require=extras_require
 )
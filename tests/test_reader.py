@@ -0,0 +1,73 @@
+'''
+Test the reading of output files by ranges of bytes
+'''
+
+
+import os
+import json
+
+from ner_annotator.reader import iter_output_range
+
+
+# Contents which look like the start of an annotation inside a string
+CONTENTS = ['x,{', 'x [{', ',{', '[{', 'a,{"b": 1}', 'é,{', 'plain text']
+
+
+def write_output(path, annotations, **kwargs):
+    '''
+    Write the given annotations to the given output file
+    and return its size
+    '''
+    with open(path, 'w') as f:
+        json.dump(annotations, f, **kwargs)
+    return os.path.getsize(path)
+
+
+def read_ranges(path, size, parts, chunk_size):
+    '''
+    Read the given output file split into the given number of ranges
+    '''
+    bounds = [size * part // parts for part in range(parts + 1)]
+    return [
+        annotation
+        for start, end in zip(bounds, bounds[1:])
+        for _, annotation in iter_output_range(
+            path, start, end, chunk_size=chunk_size
+        )
+    ]
+
+
+def test_annotation_start_inside_strings(tmp_path):
+    annotations = [
+        {'line': line, 'content': CONTENTS[line % len(CONTENTS)],
+         'entities': [[0, 1, 'ORG']]}
+        for line in range(200)
+    ]
+    path = str(tmp_path / 'output.json')
+    for kwargs in ({}, {'indent': 2}, {'separators': (',', ':')}):
+        size = write_output(path, annotations, **kwargs)
+        for parts in (1, 3, 16):
+            for chunk_size in (7, 64, 1 << 20):
+                assert read_ranges(path, size, parts, chunk_size) == annotations
+
+
+def test_invalid_annotations(tmp_path):
+    annotations = [
+        {'line': line, 'content': CONTENTS[line % len(CONTENTS)],
+         'entities': []}
+        for line in range(20)
+    ]
+    text = json.dumps(annotations).replace('{"line": 7,', '{"line": 7,,', 1)
+    path = tmp_path / 'output.json'
+    path.write_text(text)
+    for chunk_size in (7, 1 << 20):
+        read = read_ranges(str(path), len(text.encode()), 1, chunk_size)
+        assert read[:7] == annotations[:7] and read[7] is None
+        assert read[8:] == annotations[8:]
+
+
+def test_empty_output(tmp_path):
+    path = tmp_path / 'output.json'
+    for text in ('', '[]'):
+        path.write_text(text)
+        assert list(iter_output_range(str(path), 0, len(text))) == []